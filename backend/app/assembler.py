@@ -2,8 +2,50 @@
 Ассемблер для преобразования кода в машинные инструкции
 """
 import re
+from bisect import bisect_left
+from dataclasses import replace
+from itertools import accumulate, compress
+from operator import attrgetter
 from typing import List, Dict, Tuple, Optional
 
+from .ir import Instruction, OperandKind, Program, ProgramEdit, format_instruction
+from .verifier import StackDepthReport, reverify_edit, verify_stack_depth
+
+# Сколько сдвигов строк накапливает программа после правок, прежде чем
+# номера строк будут пересчитаны целиком
+_MAX_LINE_SHIFTS = 32
+
+# Лексер: один скомпилированный шаблон разбирает строку целиком
+# [метка:] [мнемоника [операнд]] [; комментарий]
+_LINE_RE = re.compile(r"""
+    ^[ \t\r\f\v]*
+    (?:(?P<label>[A-Za-z_.$][\w.$]*)[ \t]*:[ \t]*)?
+    (?:
+        (?P<mnemonic>[A-Za-z_][\w]*)
+        (?:[ \t]+
+            (?:
+                \[[ \t]*(?P<address>[^\]\s]*)[ \t]*\]
+              | (?P<decimal>[-+]?\d+)(?![\w.$])
+              | (?P<number>[-+]?0[xX][0-9A-Fa-f]+|[-+]?0[bB][01]+)(?![\w.$])
+              | (?P<name>[A-Za-z_.$][\w.$]*)
+            )
+        )?
+    )?
+    [ \t\r\f\v]*(?:;.*)?$
+""", re.VERBOSE | re.MULTILINE)
+
+# Команды, для которых операнд обязателен
+OPERAND_REQUIRED = frozenset(['PUSH', 'JMP', 'JZ', 'JNZ', 'LOOP'])
+
+
+class AssemblerError(ValueError):
+    """Ошибка ассемблирования с номером строки исходного кода"""
+
+    def __init__(self, message: str, line: Optional[int] = None):
+        self.line = line
+        super().__init__(f"Строка {line}: {message}" if line is not None else message)
+
+
 class Assembler:
     """Ассемблер для стекового процессора"""
     
@@ -13,6 +55,7 @@ class Assembler:
             'POP': 0x02,
             'DUP': 0x03,
             'SWAP': 0x04,
+            'ROT': 0x05,
             'ADD': 0x10,
             'SUB': 0x11,
             'MUL': 0x12,
@@ -21,9 +64,16 @@ class Assembler:
             'DEC': 0x15,
             'LOAD': 0x20,
             'STORE': 0x21,
+            'MEMCPY': 0x22,
+            'MEMFILL': 0x23,
+            'VSUM': 0x24,
+            'VDOT': 0x25,
             'JMP': 0x30,
             'JZ': 0x31,
             'JNZ': 0x32,
+            'LOOP': 0x33,
+            'SETLC': 0x34,
+            'GETLC': 0x35,
             'HALT': 0xFF
         }
     
@@ -104,55 +154,259 @@ class Assembler:
     
     def _format_operand(self, instruction: str, operand) -> str:
         """Форматирование операнда для отображения"""
-        if instruction in ['PUSH', 'LOAD', 'STORE', 'JMP', 'JZ', 'JNZ'] and operand is not None:
-            # Для команд с адресами отображаем в шестнадцатеричном формате
-            if isinstance(operand, int) and operand >= 0x1000:  # Если это адрес памяти
-                return f"{instruction} 0x{operand:04X}"
+        return format_instruction(instruction, operand)
+
+    def _lex(self, source_code: str, first_line: int = 1) -> Tuple[List[Instruction], List[int], List[Tuple[str, int, int]]]:
+        """
+        Разбор текста в инструкции IR.
+        Возвращает инструкции (операнды-метки еще не разрешены), номера их
+        строк и определения меток в виде (имя, номер строки, индекс инструкции).
+        Строки программы в основном повторяются (ADD, PUSH 1, ...), поэтому
+        шаблон применяется один раз к каждой различной строке, а одинаковые
+        строки дают одну и ту же инструкцию; остальные проходы по строкам
+        выполняются встроенными функциями без цикла на Python.
+        """
+        texts = source_code.split('\n')
+        distinct = list(dict.fromkeys(texts))
+        matches = list(map(_LINE_RE.match, distinct))
+
+        def fail(text: str, message: str):
+            # Различные строки идут в порядке первого появления — первая ошибка раньше остальных
+            raise AssemblerError(message, first_line + texts.index(text))
+
+        instruction_of: Dict[str, Instruction] = {}
+        label_of: Dict[str, str] = {}
+        opcodes = self.instructions
+        kind_immediate, kind_address, kind_label = OperandKind.IMMEDIATE, OperandKind.ADDRESS, OperandKind.LABEL
+        for text, match in zip(distinct, matches):
+            if match is None:
+                fail(text, f"Некорректная строка: {text.strip()}")
+            label, mnemonic, address, decimal, number, name = match.groups()
+            if label is not None:
+                label_of[text] = label
+            if mnemonic is None:
+                continue
+
+            mnemonic = mnemonic.upper()
+            opcode = opcodes.get(mnemonic)
+            if opcode is None:
+                fail(text, f"Неизвестная инструкция: {mnemonic}")
+            if decimal is not None:
+                instruction = Instruction(opcode, mnemonic, kind_immediate, int(decimal))
+            elif name is not None:
+                instruction = Instruction(opcode, mnemonic, kind_label, None, name)
+            elif number is not None:
+                instruction = Instruction(opcode, mnemonic, kind_immediate, self._parse_number(number))
+            elif address is not None:
+                try:
+                    value = self._parse_number(address)
+                except ValueError:
+                    fail(text, f"Некорректный адрес: [{address}]")
+                instruction = Instruction(opcode, mnemonic, kind_address, value)
+            elif mnemonic in OPERAND_REQUIRED:
+                fail(text, f"{mnemonic} требует операнд")
             else:
-                return f"{instruction} {operand}"
-        elif operand is not None:
-            return f"{instruction} {operand}"
+                instruction = Instruction(opcode, mnemonic)
+            instruction_of[text] = instruction
+
+        instructions = list(map(instruction_of.__getitem__, filter(instruction_of.__contains__, texts)))
+        present = list(map(instruction_of.__contains__, texts))
+        lines = list(compress(range(first_line, first_line + len(texts)), present))
+        label_defs: List[Tuple[str, int, int]] = []
+        if label_of:
+            # Метка указывает на первую инструкцию не раньше своей строки
+            before = list(accumulate(present))
+            for index in compress(range(len(texts)), map(label_of.__contains__, texts)):
+                label_defs.append((label_of[texts[index]], first_line + index, before[index] - present[index]))
+        return instructions, lines, label_defs
+
+    def _resolve(self, instructions: List[Instruction], lines: List[int], labels: Dict[str, int]):
+        """Подставить адреса меток в инструкции с операндом-меткой (каждая различная инструкция — один раз)"""
+        distinct = dict(zip(map(id, instructions), instructions))
+        for instruction in distinct.values():
+            if instruction.operand_kind != OperandKind.LABEL:
+                continue
+            address = labels.get(instruction.label)
+            if address is None:
+                line = lines[next(index for index, item in enumerate(instructions) if item is instruction)]
+                raise AssemblerError(f"Неизвестная метка или некорректный операнд: {instruction.label}", line)
+            instruction.operand = address
+
+    def _link(self, instructions: List[Instruction], lines: List[int],
+              label_defs: List[Tuple[str, int, int]]) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Сбор адресов меток и подстановка (backpatching) ссылок на метки"""
+        labels: Dict[str, int] = {}
+        label_lines: Dict[str, int] = {}
+        for name, line, address in label_defs:
+            if name in labels:
+                raise AssemblerError(f"Повторное определение метки: {name}", line)
+            labels[name] = address
+            label_lines[name] = line
+        self._resolve(instructions, lines, labels)
+        return labels, label_lines
+
+    def verify(self, program: Program) -> Program:
+        """
+        Статическая проверка глубины стека. Гарантированное переполнение —
+        ошибка компиляции, нехватка элементов — предупреждение (стек от
+        предыдущего запуска сохраняется); доказуемо безопасные программы
+        помечаются verified и выполняются без проверок стека.
+        """
+        return self._accept(program, verify_stack_depth(program))
+
+    def _accept(self, program: Program, report: StackDepthReport) -> Program:
+        """Записать результат проверки в программу (гарантированная ошибка — AssemblerError)"""
+        if report.errors:
+            line, message = report.errors[0]
+            raise AssemblerError(message, line)
+        program.verified = report.safe
+        program.max_stack_depth = report.max_depth
+        program.warnings = report.warnings
+        program.stack_depths = report.depths
+        return program
+
+    def assemble_program(self, source_code: str, verify: bool = True) -> Program:
+        """Ассемблирование исходного кода в IR с картой меток и строк"""
+        instructions, lines, label_defs = self._lex(source_code)
+        labels, label_lines = self._link(instructions, lines, label_defs)
+        program = Program(instructions=instructions, lines=lines, labels=labels,
+                          source_code=source_code, label_lines=label_lines)
+        return self.verify(program) if verify else program
+
+    def reassemble(self, program: Program, start_line: int, end_line: int, text: str) -> Tuple[Program, List[int]]:
+        """
+        Инкрементальное ассемблирование после правки в редакторе.
+        Строки [start_line, end_line) программы program (нумерация с 1) заменяются
+        текстом text; заново разбираются только новые строки, а ссылки на метки
+        переразрешаются только там, где изменился адрес метки.
+        Возвращает новую программу (program не изменяется) и отсортированный
+        список адресов изменившихся инструкций.
+        """
+        old_lines = program.source_code.split('\n')
+        if not 1 <= start_line <= end_line <= len(old_lines) + 1:
+            raise AssemblerError(f"Некорректный диапазон строк: {start_line}-{end_line}")
+
+        new_lines = text.split('\n') if text else []
+        if new_lines and new_lines[-1] == '' and text.endswith('\n'):
+            new_lines.pop()
+        source_code = '\n'.join(old_lines[:start_line - 1] + new_lines + old_lines[end_line - 1:])
+
+        # Разбираем только измененные строки
+        lexed, lexed_lines, label_defs = self._lex('\n'.join(new_lines), start_line) if new_lines else ([], [], [])
+
+        instructions = program.instructions
+        addresses = range(len(instructions))
+        lo = bisect_left(addresses, start_line, key=program.line_of)
+        hi = bisect_left(addresses, end_line, lo=lo, key=program.line_of)
+        line_delta = len(new_lines) - (end_line - start_line)
+        address_delta = len(lexed) - (hi - lo)
+
+        # Метки: удаленные вместе со строками, сдвинутые и новые
+        if line_delta or address_delta:
+            labels: Dict[str, int] = {}
+            label_lines: Dict[str, int] = {}
+            changed_labels = set()
+            for name, address in program.labels.items():
+                line = program.label_lines[name]
+                if line < start_line:
+                    labels[name] = address
+                    label_lines[name] = line
+                elif line >= end_line:
+                    labels[name] = address + address_delta
+                    label_lines[name] = line + line_delta
+                    if address_delta:
+                        changed_labels.add(name)
+                else:
+                    changed_labels.add(name)
         else:
-            return instruction
+            # Строки и адреса вне правки не сдвинулись: убираем только метки из диапазона
+            labels = dict(program.labels)
+            label_lines = dict(program.label_lines)
+            changed_labels = {name for name, line in label_lines.items() if start_line <= line < end_line}
+            for name in changed_labels:
+                del labels[name]
+                del label_lines[name]
+        for name, line, index in label_defs:
+            if name in labels:
+                raise AssemblerError(f"Повторное определение метки: {name}", line)
+            labels[name] = lo + index
+            label_lines[name] = line
+            if program.labels.get(name) == lo + index:
+                changed_labels.discard(name)
+            else:
+                changed_labels.add(name)
+
+        self._resolve(lexed, lexed_lines, labels)
+
+        tail = lo + len(lexed)
+        result = instructions[:lo] + lexed + instructions[hi:]
+        base_code = program.machine_code()
+        code = base_code[:lo] + [instruction.text() for instruction in lexed] + base_code[hi:]
+        changed = list(range(lo, tail))
+        if address_delta:
+            # Все последующие инструкции сдвинулись
+            changed.extend(range(tail, len(result)))
+        changed_set = set(changed)
+
+        # Номера строк хвоста не переписываются: его сдвиг добавляется в line_shifts
+        shifts = program.line_shifts
+        base_shift = sum(delta for address, delta in shifts if address < lo)
+        line_shifts = [(address, delta) for address, delta in shifts if address < lo]
+        moved = [(tail, line_delta + sum(delta for address, delta in shifts if lo <= address < hi))]
+        moved.extend((address + address_delta, delta) for address, delta in shifts if address >= hi)
+        for address, delta in moved:
+            if line_shifts and line_shifts[-1][0] == address:
+                delta += line_shifts.pop()[1]
+            if delta:
+                line_shifts.append((address, delta))
+        lines = program.lines[:lo] + [line - base_shift for line in lexed_lines] + program.lines[hi:]
+        relinked: List[int] = []
+        new_program = Program(
+            instructions=result, lines=lines, line_shifts=line_shifts, labels=labels, source_code=source_code,
+            label_lines=label_lines, code=code, edit=ProgramEdit(base_code, lo, hi, len(lexed), relinked)
+        )
+        if len(line_shifts) > _MAX_LINE_SHIFTS:
+            new_program.lines = new_program.source_map
+            new_program.line_shifts = []
+
+        if changed_labels:
+            # Одна новая инструкция на каждую различную инструкцию со ссылкой на сдвинутую метку
+            replacements: Dict[int, Instruction] = {}
+            referring = map(changed_labels.__contains__, map(attrgetter('label'), result))
+            for address in compress(range(len(result)), referring):
+                if lo <= address < tail:
+                    continue
+                instruction = result[address]
+                target = labels.get(instruction.label)
+                if target is None:
+                    raise AssemblerError(
+                        f"Неизвестная метка или некорректный операнд: {instruction.label}", new_program.line_of(address)
+                    )
+                if target == instruction.operand:
+                    continue
+                replacement = replacements.get(id(instruction))
+                if replacement is None:
+                    replacement = replacements[id(instruction)] = replace(instruction, operand=target)
+                result[address] = replacement
+                code[address] = replacement.text()
+                relinked.append(address)
+                if address not in changed_set:
+                    changed_set.add(address)
+                    changed.append(address)
+
+        changed.sort()
+        report = reverify_edit(new_program, program)
+        if report is None:
+            # Правка меняет глубину стека: проверка всей программы откладывается
+            # до выполнения (verifier.ensure_verified)
+            new_program.verification_pending = True
+            return new_program, changed
+        return self._accept(new_program, report), changed
 
     def assemble(self, source_code: str) -> Tuple[List[str], Dict[str, int]]:
         """Ассемблирование исходного кода"""
-        lines = source_code.split('\n')
-        machine_code = []
-        labels = {}
-        
-        # Первый проход: сбор меток
-        for i, line in enumerate(lines):
-            label, instruction, operand = self.parse_line(line, resolve_labels=False)
-            if label:
-                labels[label] = i
-            if instruction:
-                # В первом проходе сохраняем как есть, форматирование будет во втором проходе
-                if operand is not None:
-                    machine_code.append(f"{instruction} {operand}")
-                else:
-                    machine_code.append(instruction)
-        
-        # Второй проход: замена меток на адреса
-        resolved_code = []
-        for i, instruction_line in enumerate(machine_code):
-            parts = instruction_line.split()
-            if len(parts) >= 2:
-                instruction = parts[0]
-                operand_str = parts[1]
-                
-                # Проверяем, является ли операнд меткой
-                if operand_str in labels:
-                    operand = labels[operand_str]
-                    resolved_code.append(self._format_operand(instruction, operand))
-                else:
-                    # Парсим операнд и применяем форматирование
-                    operand = self._parse_number(operand_str)
-                    resolved_code.append(self._format_operand(instruction, operand))
-            else:
-                resolved_code.append(instruction_line)
-        
-        return resolved_code, labels
+        program = self.assemble_program(source_code)
+        return program.machine_code(), program.labels
     
     def disassemble(self, machine_code: List[str]) -> str:
         """Дизассемблирование машинного кода"""
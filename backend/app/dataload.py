@@ -0,0 +1,107 @@
+"""
+Разбор двоичных массивов для массовой загрузки памяти данных
+
+Поддерживаются сырые массивы little-endian и файлы NumPy (.npy) без
+зависимости от NumPy. Данные не копируются, если порядок байтов совпадает
+с машинным: возвращается memoryview над исходным буфером или отображенным
+в память (mmap) файлом.
+"""
+import ast
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Sequence, Tuple
+
+# Типы элементов: имя -> код формата (struct / array / memoryview)
+DTYPES = {
+    "int8": "b", "uint8": "B",
+    "int16": "h", "uint16": "H",
+    "int32": "i", "uint32": "I",
+    "int64": "q",
+}
+
+NPY_MAGIC = b"\x93NUMPY"
+
+# Коды видов NumPy (descr = порядок байтов + вид + размер) -> имя типа
+_NPY_KINDS = {("i", 1): "int8", ("u", 1): "uint8", ("i", 2): "int16", ("u", 2): "uint16",
+              ("i", 4): "int32", ("u", 4): "uint32", ("i", 8): "int64"}
+
+
+class DataFormatError(ValueError):
+    """Некорректный или неподдерживаемый двоичный массив"""
+
+
+def _typecode(dtype: str) -> str:
+    code = DTYPES.get(dtype)
+    if code is None:
+        raise DataFormatError(f"Неподдерживаемый тип элементов: {dtype} (допустимы: {', '.join(DTYPES)})")
+    return code
+
+
+def parse_npy_header(buffer) -> Tuple[int, str, bool]:
+    """
+    Заголовок файла .npy: (смещение данных, тип элементов, big-endian).
+    Многомерные массивы читаются построчно (только C-порядок).
+    """
+    header = bytes(buffer[:12])
+    if not header.startswith(NPY_MAGIC) or len(header) < 10:
+        raise DataFormatError("Нет сигнатуры .npy")
+    major = header[6]
+    if major == 1:
+        length, start = struct.unpack_from("<H", header, 8)[0], 10
+    elif major in (2, 3):
+        length, start = struct.unpack_from("<I", header, 8)[0], 12
+    else:
+        raise DataFormatError(f"Неподдерживаемая версия .npy: {major}")
+    try:
+        meta = ast.literal_eval(bytes(buffer[start:start + length]).decode("latin1"))
+        descr, fortran_order, shape = meta["descr"], meta["fortran_order"], meta["shape"]
+    except (ValueError, SyntaxError, KeyError, TypeError):
+        raise DataFormatError("Некорректный заголовок .npy")
+    if not isinstance(descr, str) or len(descr) < 3:
+        raise DataFormatError(f"Неподдерживаемый тип .npy: {descr!r}")
+    dtype = _NPY_KINDS.get((descr[1], int(descr[2:]) if descr[2:].isdigit() else 0))
+    if dtype is None:
+        raise DataFormatError(f"Неподдерживаемый тип .npy: {descr}")
+    if fortran_order and len(shape) > 1:
+        raise DataFormatError("Массивы .npy в порядке Fortran не поддерживаются")
+    big_endian = descr[0] == ">" or (descr[0] == "=" and sys.byteorder == "big")
+    return start + length, dtype, big_endian
+
+
+def decode(buffer, dtype: str = "int64") -> Sequence[int]:
+    """
+    Массив целых из байтов (сырые little-endian или .npy — определяется по
+    сигнатуре). Без копирования, если порядок байтов машинный.
+    """
+    view = memoryview(buffer)
+    big_endian = False
+    if bytes(view[:len(NPY_MAGIC)]) == NPY_MAGIC:
+        offset, dtype, big_endian = parse_npy_header(view)
+        view = view[offset:]
+    code = _typecode(dtype)
+    size = struct.calcsize(code)
+    if len(view) % size:
+        raise DataFormatError(f"Размер данных ({len(view)} байт) не кратен размеру элемента {dtype} ({size})")
+    if big_endian == (sys.byteorder == "big"):
+        return view.cast("B").cast(code)
+    values = array(code)
+    values.frombytes(view)
+    values.byteswap()
+    return values
+
+
+def map_file(path: str, dtype: str = "int64") -> Sequence[int]:
+    """
+    Массив из файла, отображенного в память только для чтения. Страницы
+    файла загружаются операционной системой по мере обращения; файл не
+    должен изменяться, пока данные используются.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return array(_typecode(dtype))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # memoryview удерживает отображение, пока на данные есть ссылки
+    return decode(mapped, dtype)
@@ -0,0 +1,485 @@
+"""
+Дифференциальное тестирование движков выполнения
+
+Случайные и пограничные программы и образы памяти выполняются всеми
+движками одного семейства команд; сравниваются итоговые стек, память,
+флаги, остановка/ошибка, pc и число циклов. Расхождение сокращается до
+минимального воспроизведения. Выводится также производительность движков.
+
+Запуск:
+    python -m app.difftest --count 2000 --seed 1
+Код возврата 1 — найдены расхождения.
+"""
+import argparse
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .assembler import Assembler, AssemblerError
+from .emulator import OpCode, StackEmulator
+from .hooks import ExecutionHooks
+from .processor import HISTORY_PC, StackProcessor
+
+DEFAULT_MAX_CYCLES = 2000
+
+# Пограничные значения операндов и ячеек памяти
+EDGE_VALUES = (0, 1, -1, 2, 255, 256, 32767, 32768, -32768, -32769,
+               2 ** 31 - 1, 2 ** 31, -2 ** 31, 2 ** 63 - 1, 2 ** 63, -2 ** 63)
+EDGE_ADDRESSES = (0, 1, 0x100, 0x120, 4095, 4096, -1)
+
+
+@dataclass
+class Case:
+    """Программа и образ памяти"""
+    program: List           # строки исходного кода (процессор) или слова команд (эмулятор)
+    memory: Dict[int, int] = field(default_factory=dict)
+    kind: str = "random"
+
+
+@dataclass(frozen=True)
+class Outcome:
+    """Итоговое состояние после выполнения"""
+    stack: Tuple[int, ...]
+    memory: Tuple[int, ...]
+    flags: int
+    pc: int
+    halted: bool
+    error: Optional[str]
+    cycles: int
+    loop_counter: int = 0
+
+    def differences(self, other: "Outcome") -> List[str]:
+        return [name for name in self.__dataclass_fields__ if getattr(self, name) != getattr(other, name)]
+
+
+@dataclass
+class Engine:
+    """Движок выполнения: run(case, max_cycles) -> Outcome"""
+    name: str
+    family: str
+    run: Callable[[Case, int], Outcome]
+    seconds: float = 0.0
+    cycles: int = 0
+
+
+class ShadowHooks(ExecutionHooks):
+    """
+    Обработчик, восстанавливающий стек, записи памяти и переходы только по
+    событиям. Несогласованное событие — ошибка выполнения (и расхождение с
+    эталоном); check() сверяет итог с состоянием движка.
+    """
+
+    def __init__(self):
+        self.stack: List[int] = []
+        self.memory: Dict[int, int] = {}
+        self.expected_pc: Optional[int] = None
+        self.halts = 0
+
+    def on_step(self, engine, pc, command):
+        if self.expected_pc is not None and pc != self.expected_pc:
+            raise AssertionError(f"hook: pc {pc}, expected {self.expected_pc}")
+        self.expected_pc = None
+
+    def on_branch(self, engine, pc, target, taken):
+        self.expected_pc = target if taken else pc + 1
+
+    def on_pop(self, engine, value):
+        if not self.stack or self.stack.pop() != value:
+            raise AssertionError(f"hook: unexpected pop {value}")
+
+    def on_push(self, engine, value):
+        self.stack.append(value)
+
+    def on_memory_read(self, engine, address, value):
+        if self.memory.get(address, value) != value:
+            raise AssertionError(f"hook: read {value} at {address}, written {self.memory[address]}")
+
+    def on_memory_write(self, engine, address, value):
+        self.memory[address] = value
+
+    def on_halt(self, engine):
+        self.halts += 1
+
+    def check(self, stack: Sequence[int], memory: Sequence[int], pc: int, halted: bool):
+        if list(stack) != self.stack:
+            raise AssertionError(f"hook: stack {self.stack}, engine {list(stack)}")
+        for address, value in self.memory.items():
+            if memory[address] != value:
+                raise AssertionError(f"hook: memory[{address}] = {value}, engine {memory[address]}")
+        if self.expected_pc is not None and pc != self.expected_pc:
+            raise AssertionError(f"hook: final pc {pc}, expected {self.expected_pc}")
+        if self.halts != (1 if halted else 0):
+            raise AssertionError(f"hook: {self.halts} halt events, halted={halted}")
+
+
+# ---------------------------------------------------------------------------
+# Семейство процессора (StackProcessor, текстовый ассемблер)
+
+_assembler = Assembler()
+
+
+def _processor_outcome(processor: StackProcessor) -> Outcome:
+    state = processor.processor
+    command = state.current_command
+    return Outcome(
+        stack=tuple(state.stack),
+        memory=tuple(processor.memory.ram.tolist()),
+        flags=processor.flag_bits,
+        pc=state.program_counter,
+        halted=state.is_halted,
+        error=command if command.startswith("ERROR") else None,
+        cycles=state.cycles,
+        loop_counter=state.loop_counter,
+    )
+
+
+def _processor_load(case: Case, verified: bool, history_mode: str = "full") -> StackProcessor:
+    source = "\n".join(case.program)
+    program = None
+    if verified:
+        try:
+            program = _assembler.assemble_program(source)
+        except AssemblerError:
+            program = None
+    if program is None:
+        program = _assembler.assemble_program(source, verify=False)
+    processor = StackProcessor(history_mode=history_mode)
+    for address, value in case.memory.items():
+        processor.store_to_memory(address, value)
+    # Эталон получает программу без IR: только проверяемый пошаговый путь
+    processor.load_program(program.machine_code(), source, program if verified else None)
+    return processor
+
+
+def run_reference(case: Case, max_cycles: int) -> Outcome:
+    """Эталон: пошаговое выполнение с проверками"""
+    processor = _processor_load(case, verified=False)
+    processor.run(max_cycles)
+    return _processor_outcome(processor)
+
+
+def run_fast(case: Case, max_cycles: int) -> Outcome:
+    """Быстрый цикл для программ с доказанной глубиной стека"""
+    processor = _processor_load(case, verified=True)
+    processor.run(max_cycles)
+    return _processor_outcome(processor)
+
+
+def run_pc_log(case: Case, max_cycles: int) -> Outcome:
+    """Режим истории с журналом адресов"""
+    processor = _processor_load(case, verified=True, history_mode=HISTORY_PC)
+    processor.run(max_cycles)
+    return _processor_outcome(processor)
+
+
+def run_snapshot(case: Case, max_cycles: int) -> Outcome:
+    """Половина выполнения, снимок, восстановление в новом процессоре, продолжение"""
+    processor = _processor_load(case, verified=True)
+    processor.run(max_cycles // 2)
+    restored = StackProcessor()
+    restored.restore(processor.snapshot(include_program=True))
+    restored.run(max_cycles - max_cycles // 2)
+    return _processor_outcome(restored)
+
+
+def run_fork(case: Case, max_cycles: int) -> Outcome:
+    """Половина выполнения, ветвление, продолжение в дочернем процессоре"""
+    processor = _processor_load(case, verified=True)
+    processor.run(max_cycles // 2)
+    child = processor.fork()
+    processor.store_to_memory(0, 12345)   # запись родителя не должна быть видна потомку
+    child.run(max_cycles - max_cycles // 2)
+    return _processor_outcome(child)
+
+
+def run_hooked(case: Case, max_cycles: int) -> Outcome:
+    """Вариант шага с обработчиками событий (ShadowHooks проверяет события)"""
+    processor = _processor_load(case, verified=True)
+    shadow = ShadowHooks()
+    processor.add_hook(shadow)
+    processor.run(max_cycles)
+    outcome = _processor_outcome(processor)
+    shadow.check(outcome.stack, outcome.memory, outcome.pc, outcome.halted)
+    return outcome
+
+
+_PROCESSOR_OPS = ("PUSH", "PUSH", "PUSH", "POP", "DUP", "SWAP", "ROT", "ADD", "SUB", "MUL", "DIV",
+                  "INC", "DEC", "LOAD", "STORE", "JMP", "JZ", "JNZ", "HALT",
+                  "MEMCPY", "MEMFILL", "VSUM", "VDOT", "LOOP", "SETLC", "GETLC")
+
+
+def _processor_instruction(rng: random.Random, size: int, kind: str) -> str:
+    mnemonic = rng.choice(_PROCESSOR_OPS)
+    if kind == "divzero" and rng.random() < 0.3:
+        mnemonic = "DIV"
+    if mnemonic == "PUSH":
+        if kind == "overflow" or rng.random() < 0.3:
+            return f"PUSH {rng.choice(EDGE_VALUES)}"
+        if rng.random() < 0.3:
+            return f"PUSH {rng.choice(EDGE_ADDRESSES)}"
+        return f"PUSH {rng.randint(-3, 10)}"
+    if mnemonic in ("JMP", "JZ", "JNZ", "LOOP"):
+        return f"{mnemonic} {rng.randrange(size + 1)}"
+    return mnemonic
+
+
+def generate_processor_case(rng: random.Random) -> Case:
+    """Случайная программа процессора одного из видов"""
+    kind = rng.choice(("random", "overflow", "divzero", "deep", "loop", "block"))
+    size = rng.randint(1, 24)
+    program = [_processor_instruction(rng, size, kind) for _ in range(size)]
+    if kind == "deep":
+        # Глубокий стек: до и сверх предела в 256 элементов
+        program = ["PUSH 1"] * rng.randint(200, 300) + program
+    elif kind == "block":
+        # Блочные команды с адресами у краев памяти и перекрывающимися блоками
+        program = []
+        for _ in range(rng.randint(1, 4)):
+            mnemonic = rng.choice(("MEMCPY", "MEMFILL", "VSUM", "VDOT"))
+            operands = [rng.choice((0, 1, 5, 4090, 4095, -3, rng.randrange(4096))) for _ in range(2)]
+            operands.append(rng.choice((0, 1, 3, 8, 300, -1, 10 ** 6)))
+            if mnemonic == "VSUM":
+                operands = operands[1:]
+            program += [f"PUSH {value}" for value in operands] + [mnemonic]
+        program += [_processor_instruction(rng, size, "random") for _ in range(rng.randint(0, 4))]
+    elif kind == "loop":
+        # Цикл со счетчиком и телом со случайными командами
+        body = [_processor_instruction(rng, size, "random").replace("JMP", "JZ") for _ in range(rng.randint(0, 4))]
+        count = rng.choice((1, 2, 5, 50, 1000))
+        if rng.random() < 0.5:
+            program = [f"PUSH {count}"] + body + ["DEC", "JNZ 1", "HALT"]
+        else:
+            # Тот же цикл на регистре счетчика
+            program = [f"PUSH {count}", "SETLC"] + body + ["LOOP 2", "HALT"]
+    memory = {}
+    for _ in range(rng.randint(0, 6)):
+        memory[rng.choice(EDGE_ADDRESSES[:-2] + (rng.randrange(4096),))] = rng.choice(EDGE_VALUES)
+    return Case(program=program, memory=memory, kind=kind)
+
+
+# ---------------------------------------------------------------------------
+# Семейство эмулятора (StackEmulator, слова команд)
+
+def _emulator_outcome(emulator: StackEmulator) -> Outcome:
+    state = emulator.state
+    return Outcome(
+        stack=tuple(state.stack),
+        memory=tuple(state.data_memory),
+        flags=state.flag_bits,
+        pc=state.pc,
+        halted=state.halted,
+        error=state.error,
+        cycles=state.cycles,
+        loop_counter=state.loop_counter,
+    )
+
+
+def _emulator_load(case: Case) -> StackEmulator:
+    emulator = StackEmulator()
+    emulator.load_program(case.program)
+    for address, value in case.memory.items():
+        emulator.load_data([value], address)
+    return emulator
+
+
+def run_emulator(case: Case, max_cycles: int) -> Outcome:
+    emulator = _emulator_load(case)
+    emulator.run_until_halt(max_cycles)
+    return _emulator_outcome(emulator)
+
+
+def run_emulator_snapshot(case: Case, max_cycles: int) -> Outcome:
+    emulator = _emulator_load(case)
+    emulator.run_until_halt(max_cycles // 2)
+    restored = StackEmulator()
+    restored.restore(emulator.snapshot(include_program=True))
+    restored.run_until_halt(max_cycles - max_cycles // 2)
+    return _emulator_outcome(restored)
+
+
+def run_emulator_hooked(case: Case, max_cycles: int) -> Outcome:
+    emulator = _emulator_load(case)
+    shadow = ShadowHooks()
+    emulator.add_hook(shadow)
+    emulator.run_until_halt(max_cycles)
+    outcome = _emulator_outcome(emulator)
+    shadow.check(outcome.stack, outcome.memory, outcome.pc, outcome.halted)
+    return outcome
+
+
+_EMULATOR_OPS = [opcode for opcode in OpCode]
+
+
+def generate_emulator_case(rng: random.Random) -> Case:
+    """Случайная программа эмулятора (операнд в старших битах слова)"""
+    kind = rng.choice(("random", "overflow", "loop"))
+    size = rng.randint(1, 24)
+    program = []
+    for _ in range(size):
+        opcode = rng.choice(_EMULATOR_OPS)
+        if opcode == OpCode.PUSH:
+            operand = rng.choice(EDGE_VALUES) if kind == "overflow" else rng.randint(0, 40)
+            operand = abs(operand)
+        elif opcode.name.startswith("J") or opcode == OpCode.LOOP:
+            operand = rng.randrange(size + 1)
+        else:
+            operand = 0
+        program.append((operand << 8) | opcode.value)
+    if kind == "loop":
+        count = rng.choice((1, 3, 100))
+        # PUSH count; PUSH 1; SUB; DUP; JNZ 1; HALT
+        program = [(count << 8) | OpCode.PUSH.value, (1 << 8) | OpCode.PUSH.value, OpCode.SUB.value,
+                   OpCode.DUP.value, (1 << 8) | OpCode.JNZ.value, OpCode.HALT.value] + program
+    memory = {rng.randrange(30): rng.choice(EDGE_VALUES) for _ in range(rng.randint(0, 4))}
+    return Case(program=program, memory=memory, kind=kind)
+
+
+# ---------------------------------------------------------------------------
+
+def default_engines() -> List[Engine]:
+    return [
+        Engine("reference", "processor", run_reference),
+        Engine("fast", "processor", run_fast),
+        Engine("pc-log", "processor", run_pc_log),
+        Engine("snapshot", "processor", run_snapshot),
+        Engine("fork", "processor", run_fork),
+        Engine("hooked", "processor", run_hooked),
+        Engine("emulator", "emulator", run_emulator),
+        Engine("emulator-snapshot", "emulator", run_emulator_snapshot),
+        Engine("emulator-hooked", "emulator", run_emulator_hooked),
+    ]
+
+
+GENERATORS: Dict[str, Callable[[random.Random], Case]] = {
+    "processor": generate_processor_case,
+    "emulator": generate_emulator_case,
+}
+
+
+def _safe_run(engine: Engine, case: Case, max_cycles: int) -> Outcome:
+    """Исключение движка — тоже результат (и повод для расхождения)"""
+    try:
+        return engine.run(case, max_cycles)
+    except Exception as e:
+        return Outcome((), (), 0, -1, True, f"EXCEPTION {type(e).__name__}: {e}", -1)
+
+
+def _mismatch(engines: Sequence[Engine], case: Case, max_cycles: int) -> Optional[Tuple[Engine, Engine, Outcome, Outcome]]:
+    reference = engines[0]
+    expected = _safe_run(reference, case, max_cycles)
+    for engine in engines[1:]:
+        actual = _safe_run(engine, case, max_cycles)
+        if actual != expected:
+            return reference, engine, expected, actual
+    return None
+
+
+def _shrink_candidates(case: Case):
+    """Упрощения случая: удалить команду, ячейку памяти, упростить операнд"""
+    program = case.program
+    for index in range(len(program)):
+        yield Case(program[:index] + program[index + 1:], dict(case.memory), case.kind)
+    for address in list(case.memory):
+        memory = dict(case.memory)
+        del memory[address]
+        yield Case(list(program), memory, case.kind)
+    for index, item in enumerate(program):
+        if isinstance(item, str):
+            parts = item.split()
+            if len(parts) == 2 and parts[0] == "PUSH" and parts[1] not in ("0", "1"):
+                for value in ("0", "1"):
+                    yield Case(program[:index] + [f"PUSH {value}"] + program[index + 1:], dict(case.memory), case.kind)
+        elif item >> 8:
+            yield Case(program[:index] + [item & 0xFF] + program[index + 1:], dict(case.memory), case.kind)
+
+
+def shrink(case: Case, pair: Sequence[Engine], max_cycles: int) -> Case:
+    """Сократить случай, сохраняя расхождение между двумя движками"""
+    changed = True
+    while changed:
+        changed = False
+        for candidate in _shrink_candidates(case):
+            if _mismatch(pair, candidate, max_cycles) is not None:
+                case = candidate
+                changed = True
+                break
+    return case
+
+
+def run_campaign(count: int, seed: int, max_cycles: int = DEFAULT_MAX_CYCLES,
+                 families: Sequence[str] = ("processor", "emulator"),
+                 engines: Optional[List[Engine]] = None, out=sys.stdout) -> int:
+    """Прогнать count случаев на семейство; возвращает число расхождений"""
+    engines = engines or default_engines()
+    rng = random.Random(seed)
+    failures = 0
+    for family in families:
+        members = [engine for engine in engines if engine.family == family]
+        if len(members) < 2:
+            continue
+        generate = GENERATORS[family]
+        for number in range(count):
+            case = generate(rng)
+            outcomes = []
+            for engine in members:
+                start = time.perf_counter()
+                outcome = _safe_run(engine, case, max_cycles)
+                engine.seconds += time.perf_counter() - start
+                engine.cycles += max(outcome.cycles, 0)
+                outcomes.append(outcome)
+            for engine, outcome in zip(members[1:], outcomes[1:]):
+                if outcome == outcomes[0]:
+                    continue
+                failures += 1
+                pair = (members[0], engine)
+                minimal = shrink(case, pair, max_cycles)
+                _, _, expected, actual = _mismatch(pair, minimal, max_cycles)
+                print(f"MISMATCH [{family}] {members[0].name} vs {engine.name} (case {number}, kind {minimal.kind})", file=out)
+                print(f"  program: {minimal.program}", file=out)
+                print(f"  memory:  {minimal.memory}", file=out)
+                for name in expected.differences(actual):
+                    left, right = getattr(expected, name), getattr(actual, name)
+                    if name == "memory":
+                        cells = [i for i, (a, b) in enumerate(zip(left, right)) if a != b][:8]
+                        left = {i: left[i] for i in cells}
+                        right = {i: right[i] for i in cells}
+                    print(f"  {name}: {members[0].name}={left!r} {engine.name}={right!r}", file=out)
+
+        print(f"[{family}] {count} cases", file=out)
+        base = members[0]
+        base_rate = base.cycles / base.seconds if base.seconds else 0.0
+        for engine in members:
+            rate = engine.cycles / engine.seconds if engine.seconds else 0.0
+            ratio = rate / base_rate if base_rate else 0.0
+            print(f"  {engine.name:18} {engine.cycles:>10} cycles {engine.seconds:8.3f} s "
+                  f"{rate:>12.0f} cycles/s  x{ratio:.2f}", file=out)
+    print("OK" if not failures else f"{failures} mismatches", file=out)
+    return failures
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Дифференциальное тестирование движков эмулятора")
+    parser.add_argument("--count", type=int, default=1000, help="случаев на семейство")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-cycles", type=int, default=DEFAULT_MAX_CYCLES)
+    parser.add_argument("--family", choices=sorted(GENERATORS), action="append",
+                        help="семейство команд (по умолчанию все)")
+    parser.add_argument("--engine", action="append",
+                        help="движки для сравнения (первый движок семейства — эталон)")
+    args = parser.parse_args(argv)
+
+    engines = default_engines()
+    if args.engine:
+        unknown = set(args.engine) - {engine.name for engine in engines}
+        if unknown:
+            parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+        engines = [engine for engine in engines if engine.name in args.engine]
+    failures = run_campaign(args.count, args.seed, args.max_cycles,
+                            args.family or sorted(GENERATORS), engines)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
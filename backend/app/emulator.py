@@ -1,10 +1,15 @@
 """
 Эмулятор безадресной стековой архитектуры
 """
-from typing import List, Dict, Optional, Any
+from operator import mul
+from typing import List, Dict, Optional, Any, Sequence
 from enum import Enum
 from dataclasses import dataclass, field
 
+from .hooks import Hookable
+from .snapshot import (ENGINE_EMULATOR, EMPTY_PROGRAM_HASH, PROGRAMS, Snapshot, check_pc, memory_runs, pack,
+                       program_hash, unpack)
+
 class OpCode(Enum):
     """Коды операций для безадресной стековой архитектуры"""
     # Арифметические операции (безадресные)
@@ -32,6 +37,12 @@ class OpCode(Enum):
     LOAD = 0x20     # загрузить из памяти данных: pop addr, push [addr]
     STORE = 0x21    # сохранить в память данных: pop value, pop addr, [addr] = value
 
+    # Блочные операции (операнды на стеке в порядке записи, стоимость 1 + n циклов)
+    MEMCPY = 0x22   # pop n, pop src, pop dst: [dst..dst+n) = [src..src+n)
+    MEMFILL = 0x23  # pop n, pop value, pop dst: [dst..dst+n) = value
+    VSUM = 0x24     # pop n, pop addr: push sum([addr..addr+n))
+    VDOT = 0x25     # pop n, pop b, pop a: push sum([a+i] * [b+i])
+
     # Операции перехода
     JMP = 0x30      # безусловный переход
     JZ = 0x31       # переход если zero flag
@@ -41,10 +52,60 @@ class OpCode(Enum):
     JLE = 0x35      # переход если less or equal
     JGE = 0x36      # переход если greater or equal
 
+    # Счетчик цикла
+    LOOP = 0x37     # счетчик -= 1; переход, если счетчик не 0
+    SETLC = 0x38    # счетчик = pop
+    GETLC = 0x39    # push счетчик
+
     # Системные операции
     HALT = 0x99     # остановка выполнения
     NOP = 0x00      # нет операции
 
+# Блочные операции: число операндов на стеке; стоимость — 1 + BLOCK_ELEMENT_CYCLES на элемент
+BLOCK_OPERANDS = {OpCode.MEMCPY: 3, OpCode.MEMFILL: 3, OpCode.VSUM: 2, OpCode.VDOT: 3}
+BLOCK_ELEMENT_CYCLES = 1
+
+# Флаги: битовая маска, вычисляемая лениво по результату последней операции
+FLAG_ZERO = 0x1
+FLAG_NEGATIVE = 0x2
+FLAG_OVERFLOW = 0x4
+FLAG_CARRY = 0x8
+FLAG_NAMES = (('zero', FLAG_ZERO), ('negative', FLAG_NEGATIVE), ('overflow', FLAG_OVERFLOW), ('carry', FLAG_CARRY))
+
+# Действие команд на стек для событий обработчиков: (нужно элементов, снимается, помещается).
+# При нехватке элементов команда пропускается, и событий стека нет
+STACK_EFFECTS = {
+    OpCode.PUSH: (0, 0, 1), OpCode.POP: (1, 1, 0), OpCode.DUP: (1, 0, 1), OpCode.SWAP: (2, 2, 2),
+    OpCode.ADD: (2, 2, 1), OpCode.SUB: (2, 2, 1), OpCode.MUL: (2, 2, 1), OpCode.DIV: (2, 2, 2),
+    OpCode.AND: (2, 2, 1), OpCode.OR: (2, 2, 1), OpCode.XOR: (2, 2, 1), OpCode.NOT: (1, 1, 1),
+    OpCode.CMP: (2, 1, 0), OpCode.LOAD: (1, 1, 1), OpCode.STORE: (2, 2, 0),
+    OpCode.SETLC: (1, 1, 0), OpCode.GETLC: (0, 0, 1),
+    OpCode.MEMCPY: (3, 3, 0), OpCode.MEMFILL: (3, 3, 0), OpCode.VSUM: (2, 2, 1), OpCode.VDOT: (3, 3, 1),
+}
+
+def flag_bits(value: Optional[int]) -> int:
+    """Маска флагов по значению (None — флаги не установлены)"""
+    if value is None:
+        return 0
+    if value == 0:
+        return FLAG_ZERO
+    bits = FLAG_NEGATIVE | FLAG_CARRY if value < 0 else 0
+    # Упрощенная логика для overflow и carry
+    if abs(value) > 2**31 - 1:
+        bits |= FLAG_OVERFLOW
+    return bits
+
+# Условия переходов по маске флагов (LOOP — по счетчику цикла)
+BRANCH_CONDITIONS = {
+    OpCode.JMP: lambda bits: True,
+    OpCode.JZ: lambda bits: bool(bits & FLAG_ZERO),
+    OpCode.JNZ: lambda bits: not bits & FLAG_ZERO,
+    OpCode.JL: lambda bits: bool(bits & FLAG_NEGATIVE),
+    OpCode.JG: lambda bits: not bits & (FLAG_NEGATIVE | FLAG_ZERO),
+    OpCode.JLE: lambda bits: bool(bits & (FLAG_NEGATIVE | FLAG_ZERO)),
+    OpCode.JGE: lambda bits: not bits & FLAG_NEGATIVE,
+}
+
 @dataclass
 class ExecutionState:
     """Состояние выполнения программы"""
@@ -54,12 +115,11 @@ class ExecutionState:
     instruction_preview: List[int] = field(default_factory=lambda: [0] * 30)  # Память команд в формате 0x...
     pc: int = 0  # Program Counter (указатель команд)
     sp: int = -1  # Stack Pointer (указатель стека)
-    flags: Dict[str, bool] = field(default_factory=lambda: {
-        'zero': False, 'negative': False, 'overflow': False, 'carry': False
-    })
+    flag_value: Optional[int] = None  # Результат последней операции, задающий флаги
     halted: bool = False
     error: Optional[str] = None
     cycles: int = 0
+    loop_counter: int = 0  # Регистр счетчика цикла
 
     def push(self, value: int):
         """Поместить значение на стек"""
@@ -80,14 +140,21 @@ class ExecutionState:
         return self.stack[-1]
 
     def set_flags(self, value: int):
-        """Установить флаги на основе значения"""
-        self.flags['zero'] = value == 0
-        self.flags['negative'] = value < 0
-        # Упрощенная логика для overflow и carry
-        self.flags['overflow'] = abs(value) > 2**31 - 1
-        self.flags['carry'] = value < 0
-
-class StackEmulator:
+        """Установить флаги на основе значения (вычисляются лениво при чтении)"""
+        self.flag_value = value
+
+    @property
+    def flag_bits(self) -> int:
+        """Текущая маска флагов"""
+        return flag_bits(self.flag_value)
+
+    @property
+    def flags(self) -> Dict[str, bool]:
+        """Флаги в виде словаря (для API)"""
+        bits = flag_bits(self.flag_value)
+        return {name: bool(bits & mask) for name, mask in FLAG_NAMES}
+
+class StackEmulator(Hookable):
     """Эмулятор безадресной стековой архитектуры"""
 
     def __init__(self):
@@ -102,15 +169,29 @@ class StackEmulator:
         self.state.instruction_memory = instructions.copy()
         self.state.instruction_preview = [hex(x) for x in self.state.instruction_memory[:5]] if self.state.instruction_memory else []
         self.state.pc = 0
+        # Программа доступна по хэшу для восстановления снимков
+        self.program_key = program_hash(self.state.instruction_memory)
+        PROGRAMS.register(self.program_key, self.state.instruction_memory)
 
     def load_data(self, data: List[int], start_addr: int = 0):
         """Загрузить данные в память данных"""
-        for i, value in enumerate(data):
-            if start_addr + i < len(self.state.data_memory):
-                self.state.data_memory[start_addr + i] = value
+        memory = self.state.data_memory
+        end = min(start_addr + len(data), len(memory))
+        if end > start_addr:
+            # Одно копирование среза; значения за пределами памяти отбрасываются
+            memory[start_addr:end] = data[:end - start_addr]
+
+    def load_memory(self, start: int, values: Sequence[int]):
+        """Загрузить values в память данных с адреса start (интерфейс движков)"""
+        self.load_data(list(values), start)
 
     def step(self) -> bool:
         """Выполнить одну инструкцию. Возвращает True если выполнение продолжается"""
+        if self._hook_set is not None:
+            return self._step_hooked()
+        return self._step()
+
+    def _step(self) -> bool:
         if self.state.halted or self.state.pc >= len(self.state.instruction_memory):
             return False
 
@@ -131,10 +212,116 @@ class StackEmulator:
             self.state.halted = True
             return False
 
+    def _memory_access(self, opcode: OpCode) -> tuple:
+        """
+        Ячейки памяти, которые прочитает и запишет команда с текущими операндами:
+        (чтения..., записи). Блоки обрезаются по памяти: блок, выходящий за ее
+        пределы, приводит к ошибке команды, и события не доставляются.
+        """
+        stack = self.state.stack
+        size = len(self.state.data_memory)
+
+        def block(start: int, count: int) -> range:
+            return range(max(start, 0), max(min(start + count, size), 0))
+
+        empty = range(0)
+        if opcode == OpCode.LOAD:
+            return (block(stack[-1], 1), empty)
+        if opcode == OpCode.STORE:
+            return (empty, block(stack[-2], 1))
+        count = max(stack[-1], 0)
+        if opcode == OpCode.VSUM:
+            return (block(stack[-2], count), empty)
+        first, second = stack[-3], stack[-2]
+        if opcode == OpCode.VDOT:
+            return (block(first, count), block(second, count), empty)
+        if opcode == OpCode.MEMFILL:
+            return (empty, block(first, count))
+        return (block(second, count), block(first, count))
+
+    def _step_hooked(self) -> bool:
+        """
+        Шаг с вызовом обработчиков событий (app/hooks.py). Семантика
+        совпадает с _step(); используется только при подключенных обработчиках.
+        """
+        hooks = self._hook_set
+        state = self.state
+        if state.halted or state.pc >= len(state.instruction_memory):
+            return False
+
+        memory = state.data_memory
+        stack = state.stack
+        depth = len(stack)
+        popped_values: List[int] = []
+        executed = False
+        try:
+            pc = state.pc
+            instruction = state.instruction_memory[pc]
+            opcode = OpCode(instruction & 0xFF)
+            operand = instruction >> 8
+            for hook in hooks.on_step:
+                hook(self, pc, instruction)
+
+            required, popped, pushed = STACK_EFFECTS.get(opcode, (0, 0, 0))
+            if len(stack) < required:
+                # Команда будет пропущена: событий стека и памяти нет
+                popped = pushed = 0
+            if popped:
+                popped_values = stack[depth - popped:][::-1]
+            reads, writes = (), ()
+            if popped and (hooks.on_memory_read or hooks.on_memory_write) and (
+                    opcode in BLOCK_OPERANDS or opcode in (OpCode.LOAD, OpCode.STORE)):
+                *blocks, writes = self._memory_access(opcode)
+                reads = [(address, memory[address]) for block in blocks for address in block]
+            taken = False
+            if opcode == OpCode.LOOP:
+                taken = state.loop_counter != 1
+            elif opcode in BRANCH_CONDITIONS:
+                taken = BRANCH_CONDITIONS[opcode](state.flag_bits)
+
+            state.cycles += 1
+            state.pc += 1
+            self._execute_instruction(opcode, operand)
+            executed = True
+
+            for value in popped_values:
+                for hook in hooks.on_pop:
+                    hook(self, value)
+            for address, value in reads:
+                for hook in hooks.on_memory_read:
+                    hook(self, address, value)
+            for address in writes:
+                for hook in hooks.on_memory_write:
+                    hook(self, address, memory[address])
+            for value in (stack[len(stack) - pushed:] if pushed else ()):
+                for hook in hooks.on_push:
+                    hook(self, value)
+            if opcode == OpCode.LOOP or opcode in BRANCH_CONDITIONS:
+                for hook in hooks.on_branch:
+                    hook(self, pc, operand, taken)
+
+        except Exception as e:
+            state.error = str(e)
+            state.halted = True
+            if not executed:
+                # Значения, снятые командой до ошибки, тоже сообщаются
+                for value in popped_values[:depth - len(stack)]:
+                    for hook in hooks.on_pop:
+                        hook(self, value)
+        if state.halted:
+            hooks.halt(self)
+        return not state.halted
+
     def _execute_instruction(self, opcode: OpCode, operand: int):
         """Выполнить конкретную инструкцию"""
 
-        if opcode == OpCode.PUSH:
+        if opcode == OpCode.LOOP:
+            # Проверяется первым: выполняется на каждой итерации цикла
+            self.state.loop_counter -= 1
+            if self.state.loop_counter != 0:
+                self.state.pc = operand
+
+        elif opcode == OpCode.PUSH:
             self.state.push(operand)
 
         elif opcode == OpCode.POP:
@@ -247,33 +434,44 @@ class StackEmulator:
                 else:
                     raise RuntimeError(f"Invalid memory address: {addr}")
 
+        elif opcode in BLOCK_OPERANDS:
+            if len(self.state.stack) >= BLOCK_OPERANDS[opcode]:
+                self._execute_block(opcode)
+
         elif opcode == OpCode.JMP:
             self.state.pc = operand
 
         elif opcode == OpCode.JZ:
-            if self.state.flags['zero']:
+            if self.state.flag_bits & FLAG_ZERO:
                 self.state.pc = operand
 
         elif opcode == OpCode.JNZ:
-            if not self.state.flags['zero']:
+            if not self.state.flag_bits & FLAG_ZERO:
                 self.state.pc = operand
 
         elif opcode == OpCode.JL:
-            if self.state.flags['negative']:
+            if self.state.flag_bits & FLAG_NEGATIVE:
                 self.state.pc = operand
 
         elif opcode == OpCode.JG:
-            if not self.state.flags['negative'] and not self.state.flags['zero']:
+            if not self.state.flag_bits & (FLAG_NEGATIVE | FLAG_ZERO):
                 self.state.pc = operand
 
         elif opcode == OpCode.JLE:
-            if self.state.flags['negative'] or self.state.flags['zero']:
+            if self.state.flag_bits & (FLAG_NEGATIVE | FLAG_ZERO):
                 self.state.pc = operand
 
         elif opcode == OpCode.JGE:
-            if not self.state.flags['negative']:
+            if not self.state.flag_bits & FLAG_NEGATIVE:
                 self.state.pc = operand
 
+        elif opcode == OpCode.SETLC:
+            if self.state.stack:
+                self.state.loop_counter = self.state.pop()
+
+        elif opcode == OpCode.GETLC:
+            self.state.push(self.state.loop_counter)
+
         elif opcode == OpCode.HALT:
             self.state.halted = True
 
@@ -283,14 +481,104 @@ class StackEmulator:
         else:
             raise RuntimeError(f"Unknown opcode: {opcode}")
 
-    def run_until_halt(self, max_cycles: int = 10000) -> Dict[str, Any]:
-        """Выполнить программу до остановки или превышения лимита циклов"""
+    def _execute_block(self, opcode: OpCode):
+        """Блочная операция над памятью данных; блок должен целиком лежать в памяти"""
+        memory = self.state.data_memory
+        count = max(self.state.pop(), 0)
+        operands = [self.state.pop() for _ in range(BLOCK_OPERANDS[opcode] - 1)][::-1]
+        # Адреса блоков (у MEMFILL второй операнд — значение)
+        starts = operands[:1] if opcode == OpCode.MEMFILL else operands
+        for start in starts:
+            if count and not (0 <= start and start + count <= len(memory)):
+                raise RuntimeError(f"Invalid memory block: {start}..{start + count - 1}")
+        self.state.cycles += count * BLOCK_ELEMENT_CYCLES
+
+        if opcode == OpCode.MEMCPY:
+            dst, src = operands
+            memory[dst:dst + count] = memory[src:src + count]
+        elif opcode == OpCode.MEMFILL:
+            dst, value = operands
+            memory[dst:dst + count] = [value] * count
+        elif opcode == OpCode.VSUM:
+            result = sum(memory[operands[0]:operands[0] + count])
+            self.state.push(result)
+            self.state.set_flags(result)
+        else:
+            a, b = operands
+            result = sum(map(mul, memory[a:a + count], memory[b:b + count]))
+            self.state.push(result)
+            self.state.set_flags(result)
+
+    def run(self, max_cycles: Optional[int] = None, stop_pc: Optional[int] = None) -> int:
+        """
+        Выполнить до остановки, max_cycles инструкций или перехода на адрес
+        stop_pc; возвращает число выполненных инструкций
+        """
+        # Вариант шага выбирается один раз: без обработчиков шаг их не проверяет
+        step = self._step if self._hook_set is None else self._step_hooked
+        state = self.state
         cycles = 0
-        while cycles < max_cycles and self.step():
+        while (not state.halted and state.pc < len(state.instruction_memory)
+               and (max_cycles is None or cycles < max_cycles)):
             cycles += 1
+            if not step() or state.pc == stop_pc:
+                break
+        return cycles
 
+    def run_until_halt(self, max_cycles: int = 10000) -> Dict[str, Any]:
+        """Выполнить программу до остановки или превышения лимита циклов"""
+        self.run(max_cycles)
         return self.get_state()
 
+    def snapshot(self, include_program: bool = False) -> bytes:
+        """Двоичный снимок состояния (программа передается хэшем или целиком при include_program)"""
+        state = self.state
+        if getattr(self, 'program_key', None) is None:
+            self.program_key = program_hash(state.instruction_memory)
+            PROGRAMS.register(self.program_key, state.instruction_memory)
+        return pack(Snapshot(
+            engine=ENGINE_EMULATOR,
+            pc=state.pc,
+            halted=state.halted,
+            flag_value=state.flag_value,
+            stack=state.stack,
+            ram_size=len(state.data_memory),
+            runs=memory_runs(state.data_memory),
+            program_hash=self.program_key,
+            cycles=state.cycles,
+            loop_counter=state.loop_counter,
+            message=state.error or "",
+            program_code=[str(word) for word in state.instruction_memory] if include_program else None,
+        ))
+
+    def restore(self, blob: bytes):
+        """Восстановить состояние из снимка"""
+        snapshot = unpack(blob, ENGINE_EMULATOR)
+        instructions = PROGRAMS.get(snapshot.program_hash)
+        if instructions is None:
+            if snapshot.program_code is not None:
+                instructions = [int(word) for word in snapshot.program_code]
+            elif snapshot.program_hash == EMPTY_PROGRAM_HASH:
+                instructions = []
+            else:
+                raise RuntimeError("Snapshot program is not loaded")
+        check_pc(snapshot, len(instructions))
+
+        self.state = ExecutionState(
+            stack=snapshot.stack,
+            data_memory=snapshot.ram(),
+            instruction_memory=instructions,
+            instruction_preview=[hex(x) for x in instructions[:5]],
+            pc=snapshot.pc,
+            sp=len(snapshot.stack) - 1,
+            flag_value=snapshot.flag_value,
+            halted=snapshot.halted,
+            error=snapshot.message or None,
+            cycles=snapshot.cycles,
+            loop_counter=snapshot.loop_counter,
+        )
+        self.program_key = snapshot.program_hash
+
     def get_state(self) -> Dict[str, Any]:
         """Получить текущее состояние эмулятора"""
         return {
@@ -300,9 +588,10 @@ class StackEmulator:
             'instruction_preview': [hex(x) for x in self.state.instruction_memory],  # ДОБАВЛЕНО
             'pc': self.state.pc,
             'sp': self.state.sp,
-            'flags': self.state.flags.copy(),
+            'flags': self.state.flags,
             'halted': self.state.halted,
             'error': self.state.error,
-            'cycles': self.state.cycles
+            'cycles': self.state.cycles,
+            'loop_counter': self.state.loop_counter
         }
 
@@ -0,0 +1,161 @@
+"""
+Реестр движков выполнения
+
+Движок — объект с общим интерфейсом ExecutionEngine: загрузка программы и
+памяти, шаг, выполнение с ограничением числа инструкций, экспорт состояния
+и снимки. Движки регистрируются с набором команд, который они выполняют,
+возможностями (история, обработчики событий, остановка на адресе, снимки)
+и оценкой скорости. API выбирает самый быстрый движок, который выполняет
+программы нужного набора команд и поддерживает все возможности, нужные
+запросу; движок, явно указанный в запросе (для сравнения скорости),
+проверяется на те же требования.
+
+Процессоры сессий — StackProcessor; движок другого класса из семейства
+процессора получает состояние сессии через adopt() (страницы памяти
+разделяются) и после выполнения передает его обратно.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Protocol, Sequence
+
+from .emulator import StackEmulator
+from .processor import StackProcessor
+
+# Наборы команд: текстовый машинный код ассемблера (StackProcessor) и слова
+# команд эмулятора (код операции в младшем байте, операнд — в старших)
+ISA_ASSEMBLY = "assembly"
+ISA_WORDS = "words"
+
+# Возможности движков
+HISTORY = "history"          # история выполнения по шагам
+TRACING = "tracing"          # обработчики событий выполнения (add_hook)
+BREAKPOINTS = "breakpoints"  # остановка на адресе (run(stop_pc=...))
+SNAPSHOTS = "snapshots"      # двоичные снимки состояния
+CAPABILITIES = frozenset((HISTORY, TRACING, BREAKPOINTS, SNAPSHOTS))
+
+
+class ExecutionEngine(Protocol):
+    """
+    Общий интерфейс движков. load_program принимает код в наборе команд
+    движка (строки машинного кода или слова команд); run выполняет не более
+    max_cycles инструкций, процессор дополнительно проверяет бюджет памяти.
+    """
+
+    def load_program(self, code: Sequence[Any], *args: Any) -> None: ...
+
+    def load_memory(self, start: int, values: Sequence[int]) -> None: ...
+
+    def step(self) -> bool: ...
+
+    def run(self, max_cycles: Optional[int] = None, stop_pc: Optional[int] = None) -> int: ...
+
+    def get_state(self) -> Dict[str, Any]: ...
+
+    def snapshot(self, include_program: bool = False) -> bytes: ...
+
+    def restore(self, blob: bytes) -> None: ...
+
+
+class ReferenceProcessor(StackProcessor):
+    """Эталонный интерпретатор: всегда пошаговый цикл с проверками, без быстрого цикла"""
+
+    def _can_run_unchecked(self) -> bool:
+        return False
+
+
+class EngineSelectionError(ValueError):
+    """Нет движка с нужным набором команд и возможностями"""
+
+
+@dataclass(frozen=True)
+class EngineInfo:
+    """Зарегистрированный движок"""
+    name: str
+    engine_class: type
+    isa: str
+    capabilities: FrozenSet[str]
+    speed: int              # оценка шагов в секунду (membench, нагрузка counter)
+    description: str = ""
+
+    def supports(self, needs: Iterable[str]) -> bool:
+        return self.capabilities.issuperset(needs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "isa": self.isa,
+            "capabilities": sorted(self.capabilities),
+            "speed": self.speed,
+            "description": self.description,
+        }
+
+
+class EngineRegistry:
+    """Движки по именам с выбором самого быстрого подходящего"""
+
+    def __init__(self):
+        self._engines: Dict[str, EngineInfo] = {}
+
+    def register(self, info: EngineInfo) -> EngineInfo:
+        if info.name in self._engines:
+            raise ValueError(f"Engine already registered: {info.name}")
+        unknown = info.capabilities - CAPABILITIES
+        if unknown:
+            raise ValueError(f"Unknown engine capabilities: {', '.join(sorted(unknown))}")
+        self._engines[info.name] = info
+        return info
+
+    def get(self, name: str) -> Optional[EngineInfo]:
+        return self._engines.get(name)
+
+    def engines(self, isa: Optional[str] = None) -> List[EngineInfo]:
+        """Движки набора команд isa (None — все), от самого быстрого"""
+        found = [info for info in self._engines.values() if isa is None or info.isa == isa]
+        return sorted(found, key=lambda info: -info.speed)
+
+    def select(self, isa: str, needs: Iterable[str] = (), name: Optional[str] = None) -> EngineInfo:
+        """Движок name или самый быстрый движок набора команд isa, поддерживающий needs"""
+        needs = frozenset(needs)
+        if name is not None:
+            info = self._engines.get(name)
+            if info is None:
+                raise EngineSelectionError(f"Unknown engine: {name}")
+            if info.isa != isa:
+                raise EngineSelectionError(f"Engine {name} does not run {isa} programs")
+            if not info.supports(needs):
+                raise EngineSelectionError(
+                    f"Engine {name} does not support: {', '.join(sorted(needs - info.capabilities))}")
+            return info
+        for info in self.engines(isa):
+            if info.supports(needs):
+                return info
+        raise EngineSelectionError(f"No engine for {isa} programs supports: {', '.join(sorted(needs))}")
+
+
+def bind(info: EngineInfo, processor: StackProcessor, copy: bool = False) -> StackProcessor:
+    """
+    Процессор движка info с программой и состоянием processor: сам processor
+    (copy — его ветвь), если класс совпадает, иначе новый процессор движка,
+    перенявший состояние и обработчики событий.
+    """
+    if type(processor) is info.engine_class:
+        return processor.fork() if copy else processor
+    engine = info.engine_class(processor.memory_size, processor.history_mode)
+    engine.adopt(processor)
+    for plugin in processor.hooks:
+        engine.add_hook(plugin)
+    return engine
+
+
+REGISTRY = EngineRegistry()
+REGISTRY.register(EngineInfo(
+    "fast", StackProcessor, ISA_ASSEMBLY, CAPABILITIES, 1000000,
+    "Быстрый цикл для статически проверенных программ, остальные — пошаговым циклом с проверками",
+))
+REGISTRY.register(EngineInfo(
+    "reference", ReferenceProcessor, ISA_ASSEMBLY, CAPABILITIES, 30000,
+    "Эталонный пошаговый интерпретатор с проверками",
+))
+REGISTRY.register(EngineInfo(
+    "emulator", StackEmulator, ISA_WORDS, frozenset((TRACING, BREAKPOINTS, SNAPSHOTS)), 300000,
+    "Эмулятор на словах команд (память данных 30 ячеек, без истории)",
+))
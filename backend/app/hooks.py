@@ -0,0 +1,83 @@
+"""
+Подключаемые обработчики событий выполнения (трассировка, профилирование,
+покрытие, проверка решений)
+
+Обработчик — объект с любыми из методов ExecutionHooks (удобно наследовать
+ExecutionHooks и переопределить нужные). Движок без обработчиков выполняет
+обычные циклы без каких-либо проверок; после add_hook() выполнение идет
+отдельным вариантом шага, который вызывает только переопределенные методы.
+
+События шага доставляются в порядке: on_step (до выполнения команды), затем
+после выполнения — on_pop (снятые значения, начиная с вершины),
+on_memory_read, on_memory_write, on_push, on_branch и on_halt. Чтения и
+записи сообщаются только для ячеек внутри памяти. Исключение в обработчике
+(кроме on_halt) останавливает выполнение так же, как ошибка команды.
+"""
+from typing import Any, Optional, Tuple
+
+EVENTS = ("on_step", "on_branch", "on_memory_read", "on_memory_write", "on_push", "on_pop", "on_halt")
+
+
+class ExecutionHooks:
+    """Базовый обработчик: все события игнорируются"""
+
+    def on_step(self, engine: Any, pc: int, command: Any):
+        """Перед выполнением команды по адресу pc"""
+
+    def on_branch(self, engine: Any, pc: int, target: int, taken: bool):
+        """Условный или безусловный переход (taken — переход выполнен)"""
+
+    def on_memory_read(self, engine: Any, address: int, value: int):
+        """Чтение ячейки памяти данных"""
+
+    def on_memory_write(self, engine: Any, address: int, value: int):
+        """Запись ячейки памяти данных (value — новое значение)"""
+
+    def on_push(self, engine: Any, value: int):
+        """Значение помещено на стек"""
+
+    def on_pop(self, engine: Any, value: int):
+        """Значение снято со стека"""
+
+    def on_halt(self, engine: Any):
+        """Выполнение остановлено (HALT, конец программы или ошибка)"""
+
+
+def _overrides(plugin: Any, event: str) -> bool:
+    method = getattr(type(plugin), event, None)
+    return method is not None and method is not getattr(ExecutionHooks, event)
+
+
+class HookSet:
+    """Обработчики, сгруппированные по событиям: для каждого события — только переопределенные методы"""
+
+    def __init__(self, plugins: Tuple[Any, ...]):
+        self.plugins = plugins
+        for event in EVENTS:
+            setattr(self, event, tuple(getattr(plugin, event) for plugin in plugins if _overrides(plugin, event)))
+
+    def halt(self, engine: Any):
+        for hook in self.on_halt:
+            hook(engine)
+
+
+class Hookable:
+    """
+    Регистрация обработчиков в движке. Обработчики не переходят в ветви
+    (fork) и не вызываются при повторном выполнении для восстановления истории.
+    """
+
+    _hook_set: Optional[HookSet] = None
+
+    @property
+    def hooks(self) -> Tuple[Any, ...]:
+        return self._hook_set.plugins if self._hook_set is not None else ()
+
+    def add_hook(self, plugin: Any):
+        """Подключить обработчик (выполнение переходит на вариант с событиями)"""
+        self._hook_set = HookSet(self.hooks + (plugin,))
+
+    def remove_hook(self, plugin: Any):
+        """Отключить обработчик; без обработчиков снова используются обычные циклы"""
+        plugins = tuple(item for item in self.hooks if item is not plugin)
+        self._hook_set = HookSet(plugins) if plugins else None
@@ -0,0 +1,115 @@
+"""
+Промежуточное представление (IR) программы стекового процессора
+"""
+from dataclasses import dataclass, field
+from enum import IntEnum
+from itertools import repeat
+from operator import add
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Команды, операнд которых отображается как адрес
+ADDRESS_OPERAND_INSTRUCTIONS = frozenset(['PUSH', 'LOAD', 'STORE', 'JMP', 'JZ', 'JNZ', 'LOOP'])
+
+
+class OperandKind(IntEnum):
+    """Вид операнда инструкции"""
+    NONE = 0        # без операнда
+    IMMEDIATE = 1   # число: PUSH 10
+    ADDRESS = 2     # адрес в скобках: PUSH [0x100]
+    LABEL = 3       # ссылка на метку: JMP LOOP
+
+
+def format_instruction(mnemonic: str, operand: Optional[int]) -> str:
+    """Текстовое представление инструкции (формат машинного кода для фронтенда)"""
+    if operand is None:
+        return mnemonic
+    if mnemonic in ADDRESS_OPERAND_INSTRUCTIONS and isinstance(operand, int) and operand >= 0x1000:
+        # Для команд с адресами отображаем в шестнадцатеричном формате
+        return f"{mnemonic} 0x{operand:04X}"
+    return f"{mnemonic} {operand}"
+
+
+@dataclass(slots=True)
+class Instruction:
+    """
+    Инструкция IR. Номер строки хранится в программе (Program.lines): одна
+    инструкция может стоять по нескольким адресам (одинаковые строки исходника).
+    """
+    opcode: int
+    mnemonic: str
+    operand_kind: OperandKind = OperandKind.NONE
+    operand: Optional[int] = None
+    label: Optional[str] = None   # имя метки для операнда вида LABEL
+
+    def text(self) -> str:
+        return format_instruction(self.mnemonic, self.operand)
+
+
+class ProgramEdit(NamedTuple):
+    """
+    Правка, которой программа получена из предыдущей (Assembler.reassemble):
+    команды base_code по адресам [start, end) заменены новыми, остальные
+    сдвинуты; relinked — адреса вне замененного участка с новым адресом
+    перехода. Позволяет обновить производные данные (декодированные команды,
+    хэш) только для изменившихся адресов.
+    """
+    base_code: List[str]
+    start: int
+    end: int
+    count: int            # число новых команд на месте [start, end)
+    relinked: List[int]
+
+
+@dataclass
+class Program:
+    """Результат ассемблирования: инструкции, метки и карта исходного кода"""
+    instructions: List[Instruction] = field(default_factory=list)
+    lines: List[int] = field(default_factory=list)         # адрес -> номер строки исходного кода (с 1) без line_shifts
+    line_shifts: List[Tuple[int, int]] = field(default_factory=list)  # (адрес, сдвиг) по возрастанию: к строкам с этого адреса прибавляется сдвиг
+    labels: Dict[str, int] = field(default_factory=dict)   # метка -> адрес инструкции
+    source_code: str = ""
+    label_lines: Dict[str, int] = field(default_factory=dict)  # метка -> строка определения
+    code: Optional[List[str]] = field(default=None, repr=False)  # кэш текстового машинного кода
+    verified: bool = False                     # доказано отсутствие выхода за границы стека
+    max_stack_depth: Optional[int] = None      # максимальная глубина стека (None — не ограничена)
+    warnings: List[Tuple[int, str]] = field(default_factory=list)  # (строка, сообщение)
+    verification_pending: bool = False         # проверка стека отложена после правки (verifier.ensure_verified)
+    stack_depths: Optional[List[Optional[Tuple[int, Optional[int]]]]] = field(default=None, repr=False)  # интервалы глубины по адресам
+    optimization_level: int = 0                # уровень оптимизации, которым получена программа
+    entry_flags_read: Optional[bool] = field(default=None, repr=False)  # кэш optimizer.reads_entry_flags
+    edit: Optional[ProgramEdit] = field(default=None, repr=False)  # правка относительно предыдущей программы
+
+    @property
+    def source_map(self) -> List[int]:
+        """Адрес инструкции -> номер строки исходного кода"""
+        lines = list(self.lines)
+        shift = 0
+        bounds = [address for address, _ in self.line_shifts[1:]] + [len(lines)]
+        for (start, delta), end in zip(self.line_shifts, bounds):
+            shift += delta
+            lines[start:end] = map(add, lines[start:end], repeat(shift, max(end - start, 0)))
+        return lines
+
+    def line_of(self, address: int) -> int:
+        """Номер строки исходного кода инструкции по адресу address"""
+        line = self.lines[address]
+        for start, delta in self.line_shifts:
+            if start > address:
+                break
+            line += delta
+        return line
+
+    def address_of_line(self, line: int) -> Optional[int]:
+        """Адрес первой инструкции, сгенерированной строкой line (или следующей за ней)"""
+        for address, source_line in enumerate(self.source_map):
+            if source_line >= line:
+                return address
+        return None
+
+    def machine_code(self) -> List[str]:
+        """Машинный код в текстовом виде (текст одной инструкции строится один раз)"""
+        if self.code is None:
+            distinct = dict(zip(map(id, self.instructions), self.instructions))
+            texts = dict(zip(distinct, map(Instruction.text, distinct.values())))
+            self.code = list(map(texts.__getitem__, map(id, self.instructions)))
+        return self.code
@@ -0,0 +1,187 @@
+"""
+Очередь фоновых заданий для долгих выполнений программ
+"""
+import queue
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from .processor import StackProcessor
+
+# Состояния задания
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = frozenset([DONE, FAILED, CANCELLED])
+
+# Сколько инструкций выполняется между проверками отмены и обновлением прогресса
+DEFAULT_CHUNK = 10000
+
+
+class QueueFullError(RuntimeError):
+    """Очередь заданий заполнена"""
+
+
+@dataclass
+class Job:
+    """Задание: собственный процессор, прогресс и результат"""
+    id: str
+    processor: StackProcessor
+    max_cycles: Optional[int] = None
+    on_finish: Optional[Callable[[StackProcessor], Any]] = None
+    status: str = QUEUED
+    cycles: int = 0
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    lock: threading.Lock = field(default_factory=threading.Lock)  # удерживается во время выполнения порции
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "cycles": self.cycles,
+            "max_cycles": self.max_cycles,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Пул рабочих потоков с ограниченной очередью. Задание выполняется
+    порциями по chunk инструкций: между порциями обновляется прогресс
+    и проверяется отмена. Завершенные задания хранятся ttl секунд.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, ttl: float = 600.0,
+                 chunk: int = DEFAULT_CHUNK,
+                 on_run: Optional[Callable[[int, float], Any]] = None):
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.chunk = chunk
+        self.on_run = on_run   # (циклы, секунды) — учет завершенного выполнения
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._workers: List[threading.Thread] = []
+        for index in range(workers):
+            worker = threading.Thread(target=self._work, name=f"emulator-job-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def submit(self, processor: StackProcessor, max_cycles: Optional[int] = None,
+               on_finish: Optional[Callable[[StackProcessor], Any]] = None) -> Job:
+        """Поставить выполнение в очередь; QueueFullError, если очередь заполнена"""
+        self.expire()
+        with self._lock:
+            if self._queued >= self.max_queue:
+                raise QueueFullError(f"Очередь заданий заполнена ({self.max_queue})")
+            job = Job(id=secrets.token_hex(8), processor=processor, max_cycles=max_cycles, on_finish=on_finish)
+            self._jobs[job.id] = job
+            self._queued += 1
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.expire()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Отменить задание (выполняющееся останавливается после текущей порции)"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        with self._lock:
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                self._queued -= 1
+        return job
+
+    def expire(self):
+        """Удалить завершенные задания старше ttl"""
+        deadline = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job.id for job in self._jobs.values()
+                           if job.status in FINISHED and job.finished_at is not None and job.finished_at < deadline]:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        """Отменить все задания и остановить рабочие потоки"""
+        for job in list(self._jobs.values()):
+            if job.status not in FINISHED:
+                self.cancel(job.id)
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.status != QUEUED:
+                    continue   # отменено в очереди
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._queued -= 1
+                self._running += 1
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _run(self, job: Job):
+        processor = job.processor
+        start = time.perf_counter()
+        try:
+            while not processor.processor.is_halted and not job.cancel_event.is_set():
+                chunk = self.chunk
+                if job.max_cycles is not None:
+                    chunk = min(chunk, job.max_cycles - job.cycles)
+                    if chunk <= 0:
+                        break
+                with job.lock:
+                    executed = processor.run(chunk)
+                job.cycles += executed
+                if executed == 0:
+                    break
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+            else:
+                if job.on_finish is not None:
+                    with job.lock:
+                        job.result = job.on_finish(processor)
+                job.status = DONE
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            if self.on_run is not None:
+                self.on_run(job.cycles, time.perf_counter() - start)
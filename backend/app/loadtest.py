@@ -0,0 +1,330 @@
+"""
+Нагрузочное тестирование backend
+
+Виртуальные пользователи (как студенты на занятии) работают в собственных
+сессиях: компилируют программы, выполняют их по шагам, запускают задачи
+и опрашивают состояние. Запросы идут в приложение внутри процесса через
+ASGI-транспорт httpx или на запущенный сервер (--url). Для каждого этапа
+с заданным числом пользователей выводятся пропускная способность и
+задержки p50/p95/p99 по маршрутам, в конце — сводка по этапам: точка
+насыщения там, где число запросов в секунду перестает расти, а p99 растет.
+Перед этапами проверяется кэш результатов: повторные запуски задач в
+одной сессии должны браться из кэша.
+
+Запуск:
+    python -m app.loadtest --users 1,8,32 --duration 10
+    python -m app.loadtest --url http://localhost:8000 --users 16 --think 0.5
+Код возврата 1 — были ошибочные ответы, ошибки соединения или проверка кэша результатов не прошла.
+
+Внутри процесса генератор нагрузки и обработчики делят один цикл событий,
+поэтому абсолютные задержки выше, чем у отдельного сервера; для сравнения
+изменений обработки запросов достаточно одинаковых параметров запуска.
+"""
+import argparse
+import asyncio
+import math
+import random
+import re
+import sys
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+
+from . import wire
+from .wire import COLUMNAR_MEDIA_TYPE
+
+DEFAULT_DURATION = 10.0
+DEFAULT_USERS = "1,8,32"
+REQUEST_TIMEOUT = 30.0
+
+# Программа студента: сумма чисел от 1 до N с записью результата в память
+STUDENT_PROGRAM = """PUSH 0
+PUSH {n}
+loop:
+DUP
+PUSH 0x10
+STORE
+ADD
+PUSH 0x10
+LOAD
+PUSH 1
+SUB
+DUP
+JNZ loop
+POP
+PUSH 0x20
+STORE
+HALT
+"""
+
+# Действия пользователя и их веса (частота в смеси)
+ACTIONS = (
+    ("poll_state", 5),
+    ("step", 3),
+    ("compile", 2),
+    ("run_steps", 1),
+    ("execute", 1),
+    ("task", 1),
+    ("history", 1),
+)
+
+
+def payload(response: httpx.Response) -> Any:
+    """Тело ответа в JSON или колоночном формате"""
+    if response.headers.get("content-type", "").startswith(COLUMNAR_MEDIA_TYPE):
+        return wire.decode(response.content)
+    return response.json()
+
+
+def metric_value(text: str, name: str) -> float:
+    """Значение метрики без меток из экспозиции Prometheus (0, если ее нет)"""
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """Перцентиль по ближайшему рангу (values отсортированы)"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+@dataclass
+class EndpointStats:
+    """Задержки и ошибки одного маршрута"""
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+class Recorder:
+    """Учет запросов этапа по маршрутам"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.recording = True
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str,
+                      **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        if self.recording:
+            stats = self.endpoints.get(name)
+            if stats is None:
+                stats = self.endpoints[name] = EndpointStats(name)
+            stats.latencies.append(time.perf_counter() - start)
+            stats.errors += failed
+        return None if failed else response
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        latencies = sorted(value for stats in self.endpoints.values() for value in stats.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": sum(stats.errors for stats in self.endpoints.values()),
+            "rate": len(latencies) / seconds if seconds else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else 0.0,
+        }
+
+
+class VirtualUser:
+    """Пользователь со своей сессией, выполняющий случайную смесь действий"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random,
+                 think: float, headers: Dict[str, str]):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.headers = dict(headers)
+        self.session_id: Optional[str] = None
+        self.loaded = False
+
+    async def call(self, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        return await self.recorder.request(self.client, name, method, url, headers=self.headers, **kwargs)
+
+    async def start(self):
+        response = await self.recorder.request(self.client, "POST /api/sessions", "POST", "/api/sessions")
+        if response is not None:
+            # Без своей сессии (предел числа сессий) пользователь работает в основной
+            self.session_id = payload(response)["id"]
+            self.headers["X-Session-Id"] = self.session_id
+
+    async def stop(self):
+        if self.session_id is not None:
+            await self.recorder.request(self.client, "DELETE /api/sessions/{id}", "DELETE",
+                                        f"/api/sessions/{self.session_id}")
+
+    def source(self) -> str:
+        return STUDENT_PROGRAM.format(n=self.rng.randint(1, 50))
+
+    async def compile(self):
+        response = await self.call("POST /api/compile", "POST", "/api/compile",
+                                   json={"source_code": self.source()})
+        self.loaded = response is not None
+
+    async def poll_state(self):
+        await self.call("GET /api/state", "GET", "/api/state")
+
+    async def step(self):
+        if not self.loaded:
+            await self.compile()
+        response = await self.call("POST /api/step", "POST", "/api/step")
+        if response is None or not payload(response)["continues"]:
+            self.loaded = False
+
+    async def run_steps(self):
+        if not self.loaded:
+            await self.compile()
+        await self.call("POST /api/step?count", "POST", "/api/step",
+                        params={"count": self.rng.choice((10, 50, 100))})
+
+    async def execute(self):
+        await self.call("POST /api/execute", "POST", "/api/execute", json={"source_code": self.source()})
+        self.loaded = False
+
+    async def task(self):
+        await self.call("POST /api/execute (task)", "POST", "/api/execute",
+                        json={"task_id": self.rng.choice((1, 2))})
+        self.loaded = False
+
+    async def history(self):
+        await self.call("GET /api/history", "GET", "/api/history", params={"limit": 100})
+
+    async def run(self, deadline: float):
+        names = [name for name, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(names, weights)[0])()
+            if self.think:
+                await asyncio.sleep(self.rng.expovariate(1 / self.think))
+
+
+@asynccontextmanager
+async def open_client(url: Optional[str]) -> AsyncIterator[httpx.AsyncClient]:
+    """Клиент к серверу по url или к приложению внутри процесса (с его lifespan)"""
+    timeout = httpx.Timeout(REQUEST_TIMEOUT)
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            yield client
+        return
+    from .main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+            yield client
+
+
+async def run_stage(client: httpx.AsyncClient, users: int, duration: float, think: float,
+                    seed: int, headers: Dict[str, str], warmup: float = 0.0) -> Recorder:
+    """Этап нагрузки: users пользователей в течение duration секунд (после прогрева warmup)"""
+    recorder = Recorder()
+    members = [VirtualUser(client, recorder, random.Random(seed * 100003 + index), think, headers)
+               for index in range(users)]
+    await asyncio.gather(*(user.start() for user in members))
+    if warmup:
+        recorder.recording = False
+        await asyncio.gather(*(user.run(time.perf_counter() + warmup) for user in members))
+        recorder.recording = True
+    recorder.endpoints.clear()
+    await asyncio.gather(*(user.run(time.perf_counter() + duration) for user in members))
+    recorder.recording = False
+    await asyncio.gather(*(user.stop() for user in members))
+    return recorder
+
+
+async def check_result_cache(client: httpx.AsyncClient, runs: int = 3, out=sys.stdout) -> bool:
+    """
+    Повторные запуски в одной сессии: задачи 1 и 2 по runs раз подряд. Все
+    запуски, кроме первого для каждой задачи, должны быть попаданиями в кэш
+    результатов (стек предыдущего запуска в ключ не входит). Возвращает
+    True, если так и есть.
+    """
+    recorder = Recorder()
+    user = VirtualUser(client, recorder, random.Random(0), 0.0, {})
+    await user.start()
+    before = (await client.get("/metrics")).text
+    bodies = [{"task_id": 1}] * runs + [{"task_id": 2}] * runs
+    for body in bodies:
+        await user.call("POST /api/execute", "POST", "/api/execute", json=body)
+    after = (await client.get("/metrics")).text
+    await user.stop()
+    hits, misses = (metric_value(after, name) - metric_value(before, name)
+                    for name in ("emulator_result_cache_hits_total", "emulator_result_cache_misses_total"))
+    expected = len(bodies) - 2
+    errors = sum(stats.errors for stats in recorder.endpoints.values())
+    passed = not errors and hits >= expected
+    print(f"result cache: {hits:.0f} hits, {misses:.0f} misses in {len(bodies)} repeated runs "
+          f"(expected at least {expected} hits) — {'ok' if passed else 'FAILED'}", file=out)
+    return passed
+
+
+def print_stage(users: int, duration: float, recorder: Recorder, out=sys.stdout):
+    total = recorder.summary(duration)
+    print(f"[{users} users, {duration:.1f} s] {total['requests']} requests, "
+          f"{total['rate']:.1f} req/s, {total['errors']} errors", file=out)
+    print(f"  {'endpoint':28} {'requests':>8} {'errors':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}", file=out)
+    for name in sorted(recorder.endpoints):
+        stats = recorder.endpoints[name]
+        latencies = sorted(stats.latencies)
+        print(f"  {name:28} {len(latencies):>8} {stats.errors:>6} {len(latencies) / duration:>8.1f} "
+              f"{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+              f"{percentile(latencies, 0.99) * 1000:>8.1f} {(latencies[-1] if latencies else 0) * 1000:>8.1f}",
+              file=out)
+
+
+async def run_load(stages: Sequence[int], duration: float, think: float = 0.0, seed: int = 0,
+                   url: Optional[str] = None, json_only: bool = False, warmup: float = 1.0,
+                   out=sys.stdout) -> int:
+    """Прогнать проверку кэша и этапы нагрузки; возвращает общее число ошибок"""
+    headers = {} if json_only else {"Accept": f"{COLUMNAR_MEDIA_TYPE}, application/json;q=0.9"}
+    results = []
+    async with open_client(url) as client:
+        cache_failures = 0 if await check_result_cache(client, out=out) else 1
+        for users in stages:
+            recorder = await run_stage(client, users, duration, think, seed, headers, warmup)
+            print_stage(users, duration, recorder, out)
+            results.append((users, recorder.summary(duration)))
+    print("summary", file=out)
+    print(f"  {'users':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}", file=out)
+    for users, total in results:
+        print(f"  {users:>6} {total['rate']:>8.1f} {total['p50'] * 1000:>8.1f} {total['p95'] * 1000:>8.1f} "
+              f"{total['p99'] * 1000:>8.1f} {total['errors']:>6}", file=out)
+    return sum(total["errors"] for _, total in results) + cache_failures
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование backend эмулятора")
+    parser.add_argument("--users", default=DEFAULT_USERS,
+                        help="число пользователей на этапах через запятую (по умолчанию 1,8,32)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="длительность этапа, с")
+    parser.add_argument("--warmup", type=float, default=1.0, help="прогрев перед этапом (не учитывается), с")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="средняя пауза пользователя между действиями, с (0 — без пауз)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="адрес запущенного сервера (по умолчанию — приложение внутри процесса)")
+    parser.add_argument("--json", action="store_true", help="запрашивать JSON вместо колоночного формата")
+    args = parser.parse_args(argv)
+
+    try:
+        stages = [int(value) for value in args.users.split(",")]
+    except ValueError:
+        parser.error(f"invalid --users: {args.users}")
+    if any(users < 1 for users in stages):
+        parser.error("--users values must be positive")
+    errors = asyncio.run(run_load(stages, args.duration, args.think, args.seed, args.url, args.json, args.warmup))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,214 @@
 """
 FastAPI приложение для эмулятора стекового процессора
 """
-from fastapi import FastAPI, HTTPException
+import asyncio
+import dataclasses
+import logging
+import os
+import time
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 from contextlib import asynccontextmanager
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
 from .models import (
-    EmulatorState, CompileRequest, LoadTaskRequest, ExecuteRequest, ResetRequest, 
-    TaskInfo, TaskData
+    EmulatorState, CompileRequest, IncrementalCompileRequest, LoadTaskRequest, ExecuteRequest, ResetRequest, 
+    TaskInfo, TaskData, JobRequest, MemoryMapRequest
 )
-from .processor import StackProcessor
+from .processor import HISTORY_MODES, StackProcessor
+from .memory import PagedRAM
 from .assembler import Assembler
+from .ir import Program
+from .optimizer import OptimizationReport, optimize
 from .tasks import TaskManager
+from .sessions import DEFAULT_SESSION, SessionLimitError, SessionManager
+from .jobs import JobManager, QueueFullError
+from .results import ExecutionResult, ResultCache, execution_key, keeps_entry_stack
+from .engines import EngineInfo
+from .store import open_store
+from .dataload import DTYPES, DataFormatError, decode, map_file
+from .serialization import (
+    TrustedJSONResponse, accepts_columnar, choose_encoding, encode_response, entity_tag, etag_matches
+)
+from . import engines, metrics
+
+# Логирование выключено по умолчанию; уровень задается EMULATOR_LOG_LEVEL (DEBUG, INFO, ...)
+logger = logging.getLogger("app")
+_log_level = os.environ.get("EMULATOR_LOG_LEVEL")
+if _log_level:
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger.setLevel(_log_level.upper())
+else:
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+COMPILE_CACHE_SIZE = int(os.environ.get("EMULATOR_COMPILE_CACHE_SIZE", "128"))
+# Предельная оценка памяти результатов в кэше /api/execute, байт (0 — без кэша)
+RESULT_CACHE_BYTES = int(os.environ.get("EMULATOR_RESULT_CACHE_BYTES", str(128 << 20)))
+MAX_SESSIONS = int(os.environ.get("EMULATOR_MAX_SESSIONS", "64"))
+SESSION_IDLE_TTL = float(os.environ.get("EMULATOR_SESSION_IDLE_TTL", "3600"))
+# Режим записи истории новых процессоров: full — полная, pc — журнал адресов
+HISTORY_MODE = os.environ.get("EMULATOR_HISTORY_MODE", "full")
+if HISTORY_MODE not in HISTORY_MODES:
+    raise ValueError(f"Unknown EMULATOR_HISTORY_MODE: {HISTORY_MODE}")
+# Внешнее хранилище сессий: '' — нет (один процесс), 'memory', 'sqlite:<путь>'
+SESSION_STORE = os.environ.get("EMULATOR_SESSION_STORE", "")
+JOB_WORKERS = int(os.environ.get("EMULATOR_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("EMULATOR_JOB_QUEUE_SIZE", "16"))
+JOB_TTL = float(os.environ.get("EMULATOR_JOB_TTL", "600"))
+JOB_MAX_CYCLES = int(os.environ.get("EMULATOR_JOB_MAX_CYCLES", "100000000"))
+
+# Массовая загрузка памяти: предельный размер памяти данных (ячеек) и каталог
+# файлов для отображения в память ('' — отображение файлов выключено)
+MAX_MEMORY_SIZE = int(os.environ.get("EMULATOR_MAX_MEMORY_SIZE", str(1 << 24)))
+DATA_DIR = os.environ.get("EMULATOR_DATA_DIR", "")
+
+# Тип содержимого двоичного снимка состояния
+SNAPSHOT_MEDIA_TYPE = "application/x-emulator-snapshot"
+
+# Максимальные размеры окон памяти и истории в одном ответе
+MAX_MEMORY_WINDOW = 4096
+MAX_HISTORY_WINDOW = 10000
+
+# Бюджет памяти выполнения одного процессора (история, стек, страницы памяти), байт; 0 — без ограничения
+RUN_MEMORY_BUDGET = int(os.environ.get("EMULATOR_RUN_MEMORY_BUDGET", str(256 << 20)))
+
+# Максимальное число шагов за один запрос /api/step
+MAX_STEP_COUNT = int(os.environ.get("EMULATOR_MAX_STEP_COUNT", "100000"))
+
+# Условные ответы GET: клиент (и кэш браузера) проверяет ETag при каждом опросе,
+# ответ зависит от формата, сжатия и сессии
+STATE_CACHE_CONTROL = "private, no-cache"
+STATE_VARY = "Accept, Accept-Encoding, X-Session-Id"
 
 # Глобальные объекты
 processor = None
 assembler = None
 task_manager = None
+sessions = None
+jobs = None
+results = None
+
+metrics.LIVE_SESSIONS.set_function(lambda: len(sessions) if sessions else 0)
+metrics.JOBS_QUEUED.set_function(lambda: jobs.queued if jobs else 0)
+metrics.JOBS_RUNNING.set_function(lambda: jobs.running if jobs else 0)
+metrics.HISTORY_SIZE.set_function(lambda: processor.history_size if processor else 0)
+metrics.RESULT_CACHE_BYTES.set_function(lambda: results.size if results else 0)
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _assemble_cached(source_code: str, optimize_level: int = 0) -> Tuple[Program, Optional[OptimizationReport]]:
+    with metrics.ASSEMBLE_SECONDS.time():
+        program = assembler.assemble_program(source_code)
+        if not optimize_level:
+            return program, None
+        return optimize(program, optimize_level)
+
+def assemble_source(source_code: str, optimize_level: int = 0) -> Tuple[Program, Optional[OptimizationReport]]:
+    """Ассемблирование (и оптимизация) с кэшированием результата по исходному коду"""
+    hits = _assemble_cached.cache_info().hits
+    result = _assemble_cached(source_code, optimize_level)
+    if _assemble_cached.cache_info().hits > hits:
+        metrics.COMPILE_CACHE_HITS.inc()
+    else:
+        metrics.COMPILE_CACHE_MISSES.inc()
+    return result
+
+def measure_cycles(program: Program, ram: PagedRAM, max_cycles: int = 100000) -> Optional[int]:
+    """
+    Стоимость выполнения в циклах до остановки на копии памяти
+    (None — не остановилась за max_cycles инструкций)
+    """
+    scratch = StackProcessor(len(ram))
+    scratch.memory.ram = ram.fork()
+    scratch.load_program(program.machine_code(), program.source_code, program)
+    scratch.run(max_cycles)
+    return scratch.processor.cycles if scratch.processor.is_halted else None
+
+def run_to_halt(processor: StackProcessor) -> int:
+    """Выполнить программу до остановки, возвращает число выполненных шагов"""
+    start = time.perf_counter()
+    cycles = processor.run()
+    metrics.record_run(cycles, time.perf_counter() - start)
+    return cycles
+
+def select_engine(processor: StackProcessor, name: Optional[str], needs: Tuple[str, ...] = ()) -> EngineInfo:
+    """
+    Движок для программы процессора сессии: указанный в запросе (name) или
+    самый быстрый, поддерживающий нужные запросу возможности
+    """
+    if processor.hooks:
+        needs += (engines.TRACING,)
+    return engines.REGISTRY.select(engines.ISA_ASSEMBLY, needs, name)
+
+async def execute_to_halt(processor: StackProcessor, engine: EngineInfo, task_id: Optional[int] = None,
+                          use_cache: bool = True) -> ExecutionResult:
+    """
+    Выполнить загруженную программу движком engine до остановки и проверить
+    результат задачи task_id. Одинаковые запуски (та же программа и начальное
+    состояние) берутся из кэша результатов, и итоговое состояние переносится
+    в processor. Стек от предыдущего запуска сохраняется под результатом
+    проверенной программы, которая его не читает; остальные программы
+    выполняются с пустым стеком.
+    """
+    def verify(finished: StackProcessor) -> Optional[Dict[str, Any]]:
+        return task_manager.verify_task_result(finished, task_id) if task_id else None
+    
+    prefix = processor.processor.stack if keeps_entry_stack(processor) else []
+    processor.processor.stack = []
+    key = execution_key(processor, None, task_id) if RESULT_CACHE_BYTES > 0 and use_cache else None
+    if key is None:
+        processor.processor.stack = prefix
+        target = engines.bind(engine, processor)
+        cycles = run_to_halt(target)
+        if target is not processor:
+            processor.adopt(target)
+        return ExecutionResult(processor, cycles, verify(processor))
+    
+    def prepare():
+        # Выполнение идет на копии: процессор сессии не меняется до получения результата
+        scratch = engines.bind(engine, processor, copy=True)
+        return lambda: ExecutionResult(scratch, run_to_halt(scratch), verify(scratch))
+    
+    try:
+        outcome = await results.get_or_run(key + (engine.name,), prepare)
+    except BaseException:
+        processor.processor.stack = prefix
+        raise
+    processor.adopt(outcome.processor, prefix)
+    # Ответ с другим стеком кодируется для процессора сессии, а не для результата в кэше
+    return outcome._replace(processor=processor) if prefix else outcome
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Инициализация при запуске приложения"""
-    global processor, assembler, task_manager
+    global processor, assembler, task_manager, sessions, jobs, results
     
-    processor = StackProcessor()
+    # Бюджет по умолчанию для всех процессоров: сессий, заданий и восстановленных из хранилища
+    StackProcessor.memory_budget = RUN_MEMORY_BUDGET or None
+    processor = StackProcessor(history_mode=HISTORY_MODE)
     assembler = Assembler()
     task_manager = TaskManager()
+    sessions = SessionManager(MAX_SESSIONS, SESSION_IDLE_TTL, open_store(SESSION_STORE))
+    sessions.create(processor, DEFAULT_SESSION)
+    jobs = JobManager(JOB_WORKERS, JOB_QUEUE_SIZE, JOB_TTL, on_run=metrics.record_run)
+    results = ResultCache(RESULT_CACHE_BYTES)
+    _assemble_cached.cache_clear()
     
     yield
     
     # Очистка при завершении
+    jobs.shutdown()
+    jobs = None
+    results = None
+    sessions.close()
     processor = None
     assembler = None
     task_manager = None
+    sessions = None
 
 app = FastAPI(
     title="Эмулятор стекового процессора",
@@ -49,47 +224,350 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+def _route_path(request: Request) -> str:
+    """Шаблон маршрута запроса (ограничивает кардинальность меток)"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+async def commit_session(request: Request, response: Response) -> Response:
+    """
+    Сохранить сессию изменяющего запроса до отправки ответа: клиент получает
+    ответ только после записи в хранилище; 409 — сессию одновременно изменил
+    другой процесс и изменение не сохранено.
+    """
+    session = getattr(request.state, "modified_session", None)
+    if session is None:
+        return response
+    try:
+        written = await asyncio.wrap_future(sessions.commit(session))
+    except Exception:
+        return JSONResponse({"detail": "Хранилище сессий недоступно, изменение не сохранено"}, status_code=503)
+    if not written:
+        return JSONResponse(
+            {"detail": f"Сессия {session.id} изменена другим процессом, изменение не сохранено"},
+            status_code=409,
+        )
+    response.headers["X-Session-Version"] = str(session.version)
+    return response
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Гистограмма длительности запросов по маршрутам; сохранение сессии и ее версия в заголовке ответа"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await commit_session(request, await call_next(request))
+        status = response.status_code
+        version = getattr(request.state, "session_version", None)
+        if version is not None:
+            response.headers["X-Session-Version"] = str(version)
+        return response
+    finally:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method, route=_route_path(request), status=str(status)
+        )
+
 @app.get("/")
 async def root():
     """Корневой endpoint"""
     return {"message": "Эмулятор стекового процессора API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.MetricsRegistry.CONTENT_TYPE)
+
+def session_processor(
+    request: Request,
+    x_session_id: Optional[str] = Header(None),
+    session: Optional[str] = Query(None),
+    if_match: Optional[str] = Header(None),
+):
+    """
+    Процессор сессии из параметра session или заголовка X-Session-Id (по умолчанию — основной).
+    С внешним хранилищем состояние загружается перед запросом, а после изменяющего
+    запроса сохраняется до отправки ответа (commit_session); If-Match с версией
+    сессии включает проверку версии (409).
+    """
+    session_id = session or x_session_id or DEFAULT_SESSION
+    if not sessions:
+        return processor
+    current = sessions.acquire(session_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail=f"Сессия {session_id} не найдена")
+    if if_match is not None and if_match.strip('"') != str(current.version):
+        raise HTTPException(status_code=409, detail=f"Версия сессии {session_id} изменилась: {current.version}")
+    
+    if sessions.store is not None:
+        if request.method != "GET":
+            request.state.modified_session = current
+        else:
+            request.state.session_version = current.version
+    return current.processor
+
+def state_view(
+    request: Request,
+    include_ram: bool = True,
+    include_history: bool = True,
+    ram_start: int = Query(0, ge=0),
+    ram_count: Optional[int] = Query(None, ge=0),
+    history_from: Optional[int] = Query(None, ge=0),
+    history_limit: Optional[int] = Query(None, ge=0),
+) -> Dict[str, Any]:
+    """
+    Параметры запроса, исключающие или ограничивающие окном память и историю в состоянии.
+    Для колоночного формата история передается сырыми записями, без словарей.
+    """
+    return {
+        "include_ram": include_ram,
+        "include_history": include_history,
+        "ram_start": ram_start,
+        "ram_count": ram_count,
+        "history_from": history_from,
+        "history_limit": history_limit,
+        "raw_history": accepts_columnar(request.headers.get("accept")),
+    }
+
+def cached_response(request: Request, processor: StackProcessor, key: Tuple, build: Callable[[], Any],
+                    headers: Optional[Dict[str, str]] = None) -> Response:
+    """Ответ, закодированный один раз для текущей версии состояния processor (с учетом формата и сжатия)"""
+    view_key = (key, accepts_columnar(request.headers.get("accept")),
+                choose_encoding(request.headers.get("accept-encoding")))
+    body, media_type, encoded_headers = processor.cached_view(view_key, lambda: encode_response(build(), request))
+    return Response(body, media_type=media_type, headers={**encoded_headers, **(headers or {})})
+
+def versioned_response(request: Request, processor: StackProcessor, key: Tuple, build: Callable[[], Any]) -> Response:
+    """
+    Ответ, зависящий только от состояния процессора: ETag по версии состояния,
+    304 без тела, если клиент прислал текущий ETag в If-None-Match, и
+    закодированное тело, которое строится один раз до следующего изменения
+    """
+    etag = entity_tag(processor.state_tag)
+    headers = {"ETag": etag, "Cache-Control": STATE_CACHE_CONTROL, "Vary": STATE_VARY}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.NOT_MODIFIED_RESPONSES.inc()
+        return Response(status_code=304, headers=headers)
+    return cached_response(request, processor, key, build, headers)
+
 @app.get("/api/state", response_model=EmulatorState)
-async def get_state():
+async def get_state(
+    request: Request,
+    view: Dict[str, Any] = Depends(state_view),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
     """Получить текущее состояние эмулятора"""
     if not processor:
         raise HTTPException(status_code=500, detail="Processor not initialized")
     
-    state = processor.get_state()
-    return EmulatorState(**state)
+    # Состояние сформировано сервером: отдаем без повторной валидации
+    return versioned_response(request, processor, ("state", *view.values()),
+                              lambda: processor.get_state(copy=False, **view))
+
+@app.get("/api/memory")
+async def get_memory(
+    request: Request,
+    start: int = Query(0, ge=0),
+    count: int = Query(256, ge=0, le=MAX_MEMORY_WINDOW),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """Получить окно памяти данных"""
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    
+    return versioned_response(request, processor, ("memory", start, count), lambda: {
+        "start": start,
+        "size": len(processor.memory.ram),
+        "values": processor.memory_window(start, count)
+    })
+
+def _load_block(processor: StackProcessor, address: int, values, zero_copy: bool, grow: bool) -> Dict[str, Any]:
+    """Записать блок в память процессора с проверкой границ"""
+    end = address + len(values)
+    limit = MAX_MEMORY_SIZE if grow else len(processor.memory.ram)
+    if end > limit:
+        raise HTTPException(
+            status_code=413 if grow else 400,
+            detail=f"Блок [{address}, {end}) не помещается в память ({limit} ячеек)"
+        )
+    start = time.perf_counter()
+    processor.load_memory(address, values, zero_copy=zero_copy, grow=grow)
+    logger.info("Loaded %d cells at %d in %.3f ms", len(values), address, (time.perf_counter() - start) * 1000)
+    return {"success": True, "address": address, "count": len(values), "size": len(processor.memory.ram)}
+
+@app.post("/api/memory/load")
+async def load_memory(
+    request: Request,
+    address: int = Query(0, ge=0),
+    dtype: str = Query("int64", pattern="^(" + "|".join(DTYPES) + ")$"),
+    grow: bool = False,
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """
+    Загрузить массив в память данных с адреса address. Тело запроса — сырой
+    массив little-endian типа dtype или файл NumPy .npy (тип берется из заголовка).
+    """
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    
+    try:
+        values = decode(await request.body(), dtype)
+    except DataFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _load_block(processor, address, values, False, grow)
+
+@app.post("/api/memory/map")
+async def map_memory(
+    request: MemoryMapRequest,
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """
+    Отобразить файл из EMULATOR_DATA_DIR в память данных без копирования:
+    целые страницы читаются из файла, копия страницы создается при первой записи.
+    """
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    if not DATA_DIR:
+        raise HTTPException(status_code=403, detail="Отображение файлов выключено (EMULATOR_DATA_DIR не задан)")
+    
+    root = os.path.realpath(DATA_DIR)
+    path = os.path.realpath(os.path.join(root, request.path))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=403, detail="Путь вне каталога данных")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Файл {request.path} не найден")
+    if request.address < 0:
+        raise HTTPException(status_code=400, detail=f"Некорректный адрес: {request.address}")
+    try:
+        values = map_file(path, request.dtype)
+    except DataFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _load_block(processor, request.address, values, True, request.grow)
+
+@app.get("/api/history")
+async def get_history(
+    request: Request,
+    from_step: Optional[int] = Query(None, ge=0),
+    limit: int = Query(100, ge=0, le=MAX_HISTORY_WINDOW),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """Получить окно истории выполнения (без from_step — последние limit шагов)"""
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    
+    def build():
+        first, entries = processor.history_window(from_step, limit, accepts_columnar(request.headers.get("accept")))
+        return {
+            "from_step": first,
+            "total": processor.history_size,
+            "entries": entries
+        }
+    
+    return versioned_response(request, processor, ("history", from_step, limit), build)
+
+@app.post("/api/history/mode")
+async def set_history_mode(
+    mode: str = Query(..., pattern="^(full|pc)$"),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """
+    Режим записи истории: full — стек и флаги на каждом шаге, pc — только адреса
+    выполненных команд (шаги восстанавливаются повторным выполнением). История очищается.
+    """
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    
+    processor.set_history_mode(mode)
+    return {"success": True, "history_mode": processor.history_mode}
 
 @app.post("/api/compile")
-async def compile_code(request: CompileRequest):
+async def compile_code(
+    request: CompileRequest,
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
     """Скомпилировать исходный код"""
     if not assembler or not processor:
         raise HTTPException(status_code=500, detail="Assembler or Processor not initialized")
     
     try:
-        print(request.source_code)
-        machine_code, labels = assembler.assemble(request.source_code)
+        program, report = assemble_source(request.source_code, request.optimize)
+        machine_code = program.machine_code()
+        
+        optimization = None
+        if report is not None:
+            if request.measure_cycles:
+                # Отчет из кэша ассемблирования не изменяется: циклы зависят от памяти сессии
+                original, _ = assemble_source(request.source_code)
+                report = dataclasses.replace(
+                    report,
+                    cycles_before=measure_cycles(original, processor.memory.ram),
+                    cycles_after=measure_cycles(program, processor.memory.ram),
+                )
+            optimization = report.to_dict()
         
         # Загружаем программу в процессор для пошагового выполнения
-        processor.load_program(machine_code, request.source_code)
+        processor.load_program(machine_code, request.source_code, program)
         
-        print(machine_code)
+        logger.debug("Compiled %d instructions", len(machine_code))
         return {
             "success": True,
             "machine_code": machine_code,
-            "labels": labels,
+            "labels": program.labels,
+            "source_map": program.source_map,
+            "verified": program.verified,
+            "max_stack_depth": program.max_stack_depth,
+            "warnings": [{"line": line, "message": message} for line, message in program.warnings],
+            "optimization": optimization,
             "message": "Код успешно скомпилирован"
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка компиляции: {str(e)}")
 
+@app.post("/api/compile/incremental")
+async def compile_incremental(
+    request: IncrementalCompileRequest,
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """Перекомпилировать только измененные строки текущей программы"""
+    if not assembler or not processor:
+        raise HTTPException(status_code=500, detail="Assembler or Processor not initialized")
+    
+    try:
+        previous = getattr(processor, 'program', None)
+        if previous is None or previous.optimization_level:
+            # Правка применяется к исходному (неоптимизированному) коду
+            previous, _ = assemble_source(getattr(processor, 'source_code', ''))
+        
+        program, changed = assembler.reassemble(previous, request.start_line, request.end_line, request.text)
+        machine_code = program.machine_code()
+        processor.load_program(machine_code, program.source_code, program)
+        
+        return {
+            "success": True,
+            "instruction_count": len(machine_code),
+            "changed": [
+                {"address": address, "instruction": machine_code[address], "line": program.line_of(address)}
+                for address in changed
+            ],
+            "labels": program.labels,
+            "message": "Код успешно перекомпилирован"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка компиляции: {str(e)}")
+
 @app.post("/api/load-task")
-async def load_task(request: LoadTaskRequest):
+async def load_task(
+    request: LoadTaskRequest,
+    http_request: Request,
+    view: Dict[str, Any] = Depends(state_view),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
     """Загрузить данные задачи без выполнения программы"""
     if not processor or not assembler:
         raise HTTPException(status_code=500, detail="Processor not initialized")
@@ -99,43 +577,61 @@ async def load_task(request: LoadTaskRequest):
         if not task:
             raise HTTPException(status_code=404, detail=f"Задача {request.task_id} не найдена")
         
-        print(f"Loading task {request.task_id}")
-        print(f"Memory before setup: {processor.memory.ram[0x100:0x120]}")
+        logger.debug("Loading task %d", request.task_id)
         
         # Настраиваем данные для задачи
-        print(f"Calling setup_task_data for task {request.task_id}")
         task_manager.setup_task_data(processor, request.task_id)
-        print(f"setup_task_data completed")
-        
-        print(f"Memory after setup: {processor.memory.ram[0x100:0x120]}")
         
         # Компилируем и загружаем программу (но не выполняем)
-        machine_code, _ = assembler.assemble(task["program"])
-        processor.load_program(machine_code, task["program"])
-        
-        print(f"Memory after load_program: {processor.memory.ram[0x100:0x120]}")
-        
-        # Проверяем, что данные все еще в памяти
-        print(f"Final memory check: {processor.memory.ram[0x100:0x120]}")
+        program, _ = assemble_source(task["program"])
+        processor.load_program(program.machine_code(), task["program"], program)
         
         # Устанавливаем current_task в состоянии процессора
         processor.processor.current_task = request.task_id
         
-        return {
+        return TrustedJSONResponse({
             "success": True,
-            "state": processor.get_state(),
+            "state": processor.get_state(copy=False, **view),
             "message": f"Данные задачи {request.task_id} загружены"
-        }
+        }, http_request)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка загрузки задачи: {str(e)}")
 
 @app.post("/api/execute")
-async def execute_code(request: ExecuteRequest):
-    """Выполнить код"""
+async def execute_code(
+    request: ExecuteRequest,
+    http_request: Request,
+    view: Dict[str, Any] = Depends(state_view),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """
+    Выполнить код самым быстрым движком, поддерживающим запрос, или движком
+    request.engine (явно выбранный движок выполняет программу без кэша
+    результатов — для сравнения скорости). Программа в словах команд
+    (program_words) выполняется эмулятором отдельно от процессора сессии.
+    """
     if not processor or not assembler:
         raise HTTPException(status_code=500, detail="Processor not initialized")
     
     try:
+        if request.program_words is not None:
+            engine = engines.REGISTRY.select(engines.ISA_WORDS, (), request.engine)
+            emulator = engine.engine_class()
+            emulator.load_program(request.program_words)
+            start = time.perf_counter()
+            cycles = emulator.run(MAX_STEP_COUNT)
+            metrics.record_run(cycles, time.perf_counter() - start)
+            return TrustedJSONResponse({
+                "success": True,
+                "engine": engine.name,
+                "executed": cycles,
+                "state": emulator.get_state()
+            }, http_request)
+        
+        # Полное состояние с историей есть только у движков с историей
+        engine = select_engine(processor, request.engine, (engines.HISTORY,) if view["include_history"] else ())
+        use_cache = request.engine is None
+        
         if request.task_id and request.task_id > 0:
             # Выполнение предустановленной задачи
             task = task_manager.get_task(request.task_id)
@@ -146,76 +642,298 @@ async def execute_code(request: ExecuteRequest):
             task_manager.setup_task_data(processor, request.task_id)
             
             # Компилируем и загружаем программу
-            machine_code, _ = assembler.assemble(task["program"])
-            processor.load_program(machine_code, task["program"])
+            program, _ = assemble_source(task["program"], request.optimize)
+            processor.load_program(program.machine_code(), task["program"], program)
             
-            # Выполняем инструкции пошагово для сохранения истории
-            while not processor.processor.is_halted:
-                success = processor.step()
-                if not success:
-                    break
+            # Выполняем и проверяем результат (повторный запуск — из кэша)
+            outcome = await execute_to_halt(processor, engine, request.task_id, use_cache)
             
-            # Проверяем результат
-            result = task_manager.verify_task_result(processor, request.task_id)
-            
-            return {
+            # Ответ кодируется один раз для результата из кэша
+            key = ("execute", request.task_id, engine.name, *view.values())
+            return cached_response(http_request, outcome.processor, key, lambda: {
                 "success": True,
+                "engine": engine.name,
                 "task_id": request.task_id,
-                "result": result,
-                "state": processor.get_state()
-            }
+                "result": outcome.verification,
+                "state": processor.get_state(copy=False, **view)
+            })
         else:
             # Выполнение пользовательского кода
             if not request.source_code:
                 raise HTTPException(status_code=400, detail="Не указан исходный код для выполнения")
             
-            machine_code, _ = assembler.assemble(request.source_code)
-            processor.load_program(machine_code, request.source_code)
+            program, _ = assemble_source(request.source_code, request.optimize)
+            processor.load_program(program.machine_code(), request.source_code, program)
             
-            # Выполняем инструкции пошагово для сохранения истории
-            while not processor.processor.is_halted:
-                success = processor.step()
-                if not success:
-                    break
+            outcome = await execute_to_halt(processor, engine, use_cache=use_cache)
             
-            return {
+            return cached_response(http_request, outcome.processor, ("execute", None, engine.name, *view.values()), lambda: {
                 "success": True,
-                "state": processor.get_state()
-            }
+                "engine": engine.name,
+                "state": processor.get_state(copy=False, **view)
+            })
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка выполнения: {str(e)}")
 
 @app.post("/api/step")
-async def execute_step():
-    """Выполнить один шаг"""
+async def execute_step(
+    request: Request,
+    count: Optional[int] = Query(None, ge=1),
+    until_pc: Optional[int] = Query(None, ge=0),
+    until_halt: bool = False,
+    every_k: Optional[int] = Query(None, ge=1),
+    engine: Optional[str] = None,
+    include_state: bool = False,
+    view: Dict[str, Any] = Depends(state_view),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """
+    Выполнить один шаг, count шагов, до адреса until_pc или до остановки
+    (не более MAX_STEP_COUNT шагов за запрос). Для нескольких шагов
+    возвращается сводное изменение (delta) и записи истории за этот отрезок;
+    every_k — только каждая k-я запись; полное состояние (память и вся
+    накопленная история) — только с include_state. engine — движок выполнения
+    (по умолчанию самый быстрый, поддерживающий запрос).
+    """
     if not processor:
         raise HTTPException(status_code=500, detail="Processor not initialized")
     
     try:
-        # Выполняем один шаг программы
-        success = processor.step()
+        single = count is None and until_pc is None and not until_halt
+        needs = () if single and not view["include_history"] else (engines.HISTORY,)
+        if until_pc is not None:
+            needs += (engines.BREAKPOINTS,)
+        selected = select_engine(processor, engine, needs)
+        # Движок другого класса выполняет шаги на копии состояния сессии
+        target = engines.bind(selected, processor)
         
-        return {
+        if single:
+            # Выполняем один шаг программы
+            success = target.step()
+            metrics.CYCLES_EXECUTED.inc()
+            if target is not processor:
+                processor.adopt(target)
+            
+            return TrustedJSONResponse({
+                "success": True,
+                "engine": selected.name,
+                "state": processor.get_state(copy=False, **view),
+                "continues": success
+            }, request)
+        
+        max_cycles = MAX_STEP_COUNT if count is None else min(count, MAX_STEP_COUNT)
+        start = time.perf_counter()
+        span = target.run_span(max_cycles, until_pc)
+        metrics.record_run(span["cycles"], time.perf_counter() - start)
+        if target is not processor:
+            processor.adopt(target)
+        
+        first, entries = processor.history_window(span["first_step"], span["cycles"],
+                                                  every_k is None and view["raw_history"])
+        if every_k is not None:
+            entries = [
+                {"step": first + index, **entry}
+                for index, entry in enumerate(entries)
+                if (index + 1) % every_k == 0 or index == len(entries) - 1
+            ]
+        registers = processor.processor
+        response = {
             "success": True,
-            "state": processor.get_state(),
-            "continues": success
+            "engine": selected.name,
+            "executed": span["cycles"],
+            "continues": not registers.is_halted,
+            "delta": {
+                "program_counter": registers.program_counter,
+                "stack": registers.stack,
+                "flags": processor.flags,
+                "current_command": registers.current_command,
+                "is_halted": registers.is_halted,
+                "cycles": registers.cycles,
+                "loop_counter": registers.loop_counter,
+                "memory": span["memory"],
+            },
+            "history_start": first,
+            "history": entries,
+            "history_total": processor.history_size
         }
+        if include_state:
+            # Размер ответа растет с памятью и накопленной историей сессии
+            response["state"] = processor.get_state(copy=False, **view)
+        return TrustedJSONResponse(response, request)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка выполнения шага: {str(e)}")
 
+@app.get("/api/engines")
+async def list_engines():
+    """Зарегистрированные движки выполнения (от самого быстрого) с возможностями"""
+    return [info.to_dict() for info in engines.REGISTRY.engines()]
+
 @app.post("/api/reset")
-async def reset_processor():
+async def reset_processor(
+    request: Request,
+    view: Dict[str, Any] = Depends(state_view),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
     """Сбросить процессор"""
     if not processor:
         raise HTTPException(status_code=500, detail="Processor not initialized")
     
     processor.reset()
-    return {
+    return TrustedJSONResponse({
         "success": True,
         "message": "Процессор сброшен",
-        "state": processor.get_state()
-    }
+        "state": processor.get_state(copy=False, **view)
+    }, request)
+
+@app.get("/api/snapshot")
+async def get_snapshot(
+    include_program: bool = False,
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """Двоичный снимок состояния процессора (include_program — вместе с машинным кодом)"""
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    
+    return Response(processor.snapshot(include_program), media_type=SNAPSHOT_MEDIA_TYPE)
+
+@app.post("/api/restore")
+async def restore_snapshot(
+    request: Request,
+    view: Dict[str, Any] = Depends(state_view),
+    processor: Optional[StackProcessor] = Depends(session_processor),
+):
+    """Восстановить состояние процессора из двоичного снимка (тело запроса)"""
+    if not processor:
+        raise HTTPException(status_code=500, detail="Processor not initialized")
+    
+    blob = await request.body()
+    try:
+        # Размер памяти из снимка клиента ограничен, как и при загрузке массивов
+        processor.restore(blob, MAX_MEMORY_SIZE)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка восстановления снимка: {str(e)}")
+    
+    return TrustedJSONResponse({
+        "success": True,
+        "state": processor.get_state(copy=False, **view)
+    }, request)
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """Поставить выполнение программы или задачи в очередь фоновых заданий"""
+    if not jobs or not assembler:
+        raise HTTPException(status_code=500, detail="Jobs not initialized")
+    
+    max_cycles = min(request.max_cycles or JOB_MAX_CYCLES, JOB_MAX_CYCLES)
+    job_processor = StackProcessor(history_mode=request.history_mode)
+    on_finish = None
+    try:
+        if request.task_id and request.task_id > 0:
+            task = task_manager.get_task(request.task_id)
+            if not task:
+                raise HTTPException(status_code=404, detail=f"Задача {request.task_id} не найдена")
+            task_manager.setup_task_data(job_processor, request.task_id)
+            source_code = task["program"]
+            task_id = request.task_id
+            on_finish = lambda finished: task_manager.verify_task_result(finished, task_id)
+        elif request.source_code:
+            source_code = request.source_code
+        else:
+            raise HTTPException(status_code=400, detail="Не указан исходный код для выполнения")
+        
+        program, _ = assemble_source(source_code, request.optimize)
+        job_processor.load_program(program.machine_code(), source_code, program)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка компиляции: {str(e)}")
+    
+    try:
+        job = jobs.submit(job_processor, max_cycles, on_finish)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.info()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, view: Dict[str, Any] = Depends(state_view)):
+    """Статус задания, выполненные циклы и текущее (частичное) состояние"""
+    if not jobs:
+        raise HTTPException(status_code=500, detail="Jobs not initialized")
+    
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задание {job_id} не найдено")
+    
+    # Состояние читается между порциями выполнения
+    with job.lock:
+        state = job.processor.get_state(copy=False, **view)
+        return TrustedJSONResponse({**job.info(), "state": state}, request)
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Отменить задание"""
+    if not jobs:
+        raise HTTPException(status_code=500, detail="Jobs not initialized")
+    
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задание {job_id} не найдено")
+    return job.info()
+
+@app.get("/api/sessions")
+async def list_sessions():
+    """
+    Список сессий. Обращения к хранилищу сессий (здесь и в остальных
+    эндпоинтах сессий) выполняются в пуле потоков, не блокируя цикл событий.
+    """
+    if not sessions:
+        raise HTTPException(status_code=500, detail="Sessions not initialized")
+    
+    return await run_in_threadpool(sessions.list)
+
+@app.post("/api/sessions")
+async def create_session():
+    """Создать новую сессию с чистым процессором"""
+    if not sessions:
+        raise HTTPException(status_code=500, detail="Sessions not initialized")
+    
+    try:
+        session = await run_in_threadpool(sessions.create, StackProcessor(history_mode=HISTORY_MODE))
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return session.info()
+
+@app.post("/api/sessions/{session_id}/fork")
+async def fork_session(session_id: str):
+    """
+    Ветвить сессию с текущей точки выполнения. Дочерняя сессия разделяет с
+    родительской страницы памяти (копируются при записи) и программу.
+    """
+    if not sessions:
+        raise HTTPException(status_code=500, detail="Sessions not initialized")
+    
+    try:
+        session = await run_in_threadpool(sessions.fork, session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Сессия {session_id} не найдена")
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return session.info()
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Удалить сессию"""
+    if not sessions:
+        raise HTTPException(status_code=500, detail="Sessions not initialized")
+    
+    try:
+        deleted = await run_in_threadpool(sessions.delete, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Сессия {session_id} не найдена")
+    return {"success": True}
 
 @app.get("/api/tasks", response_model=List[TaskInfo])
 async def get_tasks():
@@ -0,0 +1,254 @@
+"""
+Замеры памяти длинных выполнений
+
+Нагрузки (счетчик, глубокий стек, проход по памяти) выполняются движками
+с разными режимами истории. Каждый замер идет в отдельном процессе: один
+прогон с tracemalloc дает байты Python-объектов, оставшихся после выполнения
+(на шаг), пик во время выполнения и пик сборки и сериализации состояния
+get_state(); второй прогон без tracemalloc дает пиковый RSS процесса.
+Для процессора выводится и оценка memory_usage(), по которой
+проверяется бюджет памяти (EMULATOR_RUN_MEMORY_BUDGET).
+
+Запуск:
+    python -m app.membench --steps 100000
+    python -m app.membench --workload deep-stack --engine fast/full --engine fast/pc --json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # нет на Windows: пиковый RSS не измеряется
+    resource = None
+
+from .assembler import Assembler
+from .emulator import OpCode, StackEmulator
+from .processor import HISTORY_FULL, HISTORY_PC, StackProcessor
+from .serialization import dumps
+
+DEFAULT_STEPS = 100000
+STACK_DEPTH = 64
+
+# Нагрузки процессора: {n} — число повторений цикла (больше числа шагов замера)
+WORKLOADS = {
+    # Счетчик в цикле: стек из одного-двух элементов
+    "counter": """PUSH {n}
+SETLC
+PUSH 0
+loop:
+PUSH 1
+ADD
+LOOP loop
+HALT
+""",
+    # Тот же цикл над стеком глубиной STACK_DEPTH: полная история копирует весь стек на каждом шаге
+    "deep-stack": "PUSH 1\n" * STACK_DEPTH + """PUSH {n}
+SETLC
+loop:
+PUSH 1
+ADD
+LOOP loop
+HALT
+""",
+    # Запись в последовательные ячейки: память растет собственными страницами
+    "memory": """PUSH {n}
+SETLC
+loop:
+GETLC
+GETLC
+STORE
+LOOP loop
+HALT
+""",
+}
+
+
+def _emulator_word(opcode: OpCode, operand: int = 0) -> int:
+    return (operand << 8) | opcode.value
+
+
+# Программы эмулятора для тех же нагрузок (память эмулятора — 30 ячеек, прохода по памяти нет)
+EMULATOR_WORKLOADS = {
+    "counter": lambda n: [
+        _emulator_word(OpCode.PUSH), _emulator_word(OpCode.PUSH, n), _emulator_word(OpCode.SETLC),
+        _emulator_word(OpCode.PUSH, 1), _emulator_word(OpCode.ADD), _emulator_word(OpCode.LOOP, 3),
+        _emulator_word(OpCode.HALT),
+    ],
+    "deep-stack": lambda n: [_emulator_word(OpCode.PUSH, 1)] * STACK_DEPTH + [
+        _emulator_word(OpCode.PUSH, n), _emulator_word(OpCode.SETLC),
+        _emulator_word(OpCode.PUSH, 1), _emulator_word(OpCode.ADD), _emulator_word(OpCode.LOOP, STACK_DEPTH + 2),
+        _emulator_word(OpCode.HALT),
+    ],
+}
+
+
+@dataclass
+class Target:
+    """Подготовленный движок: выполнение, экспорт состояния и оценка памяти"""
+    run: Callable[[int], int]
+    state: Callable[[], Any]
+    estimate: Optional[Callable[[], int]] = None
+
+
+def _processor_target(workload: str, steps: int, verified: bool, history_mode: str) -> Target:
+    source = WORKLOADS[workload].format(n=steps + 1)
+    program = Assembler().assemble_program(source)
+    # Память вмещает все ячейки прохода по памяти
+    processor = StackProcessor(memory_size=max(4096, steps), history_mode=history_mode)
+    # Без IR программа выполняется пошаговым циклом с проверками
+    processor.load_program(program.machine_code(), source, program if verified else None)
+    return Target(processor.run, processor.get_state, processor.memory_usage)
+
+
+def _emulator_target(workload: str, steps: int) -> Target:
+    emulator = StackEmulator()
+    emulator.load_program(EMULATOR_WORKLOADS[workload](steps + 1))
+
+    def run(count: int) -> int:
+        before = emulator.state.cycles
+        emulator.run_until_halt(count)
+        return emulator.state.cycles - before
+
+    return Target(run, emulator.get_state)
+
+
+# Движок/режим истории -> подготовка нагрузки
+ENGINES: Dict[str, Callable[[str, int], Target]] = {
+    "checked/full": lambda workload, steps: _processor_target(workload, steps, False, HISTORY_FULL),
+    "fast/full": lambda workload, steps: _processor_target(workload, steps, True, HISTORY_FULL),
+    "checked/pc": lambda workload, steps: _processor_target(workload, steps, False, HISTORY_PC),
+    "fast/pc": lambda workload, steps: _processor_target(workload, steps, True, HISTORY_PC),
+    "emulator": _emulator_target,
+}
+
+
+def _supported(workload: str, engine: str) -> bool:
+    return engine != "emulator" or workload in EMULATOR_WORKLOADS
+
+
+def _max_rss() -> Optional[int]:
+    """Пиковый RSS процесса в байтах"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_traced(workload: str, engine: str, steps: int) -> Dict[str, Any]:
+    """Замер tracemalloc в текущем процессе"""
+    tracemalloc.start()
+    try:
+        target = ENGINES[engine](workload, steps)
+        gc.collect()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        executed = target.run(steps)
+        seconds = time.perf_counter() - start
+        retained, run_peak = tracemalloc.get_traced_memory()
+
+        tracemalloc.reset_peak()
+        dumps(target.state())
+        state_peak = tracemalloc.get_traced_memory()[1] - retained
+    finally:
+        tracemalloc.stop()
+    return {
+        "workload": workload,
+        "engine": engine,
+        "steps": executed,
+        "retained": retained - base,
+        "bytes_per_step": (retained - base) / executed if executed else 0.0,
+        "run_peak": run_peak - base,
+        "state_peak": state_peak,
+        "estimate": target.estimate() if target.estimate else None,
+        "traced_seconds": seconds,
+    }
+
+
+def measure_rss(workload: str, engine: str, steps: int) -> Dict[str, Any]:
+    """Пиковый RSS выполнения и экспорта состояния (без tracemalloc)"""
+    target = ENGINES[engine](workload, steps)
+    gc.collect()
+    before = _max_rss()
+    start = time.perf_counter()
+    target.run(steps)
+    seconds = time.perf_counter() - start
+    after_run = _max_rss()
+    dumps(target.state())
+    return {"rss_before": before, "rss_run": after_run, "rss_peak": _max_rss(), "seconds": seconds}
+
+
+def _measure_case(workload: str, engine: str, steps: int) -> Dict[str, Any]:
+    return {**measure_traced(workload, engine, steps), **measure_rss(workload, engine, steps)}
+
+
+def run_case(workload: str, engine: str, steps: int) -> Dict[str, Any]:
+    """
+    Замер в отдельном процессе (RSS и tracemalloc не зависят от предыдущих
+    замеров); без fork — в текущем процессе
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return _measure_case(workload, engine, steps)
+    context = multiprocessing.get_context("fork")
+    # Замеры tracemalloc и RSS — в разных процессах, чтобы трассировка не увеличивала RSS
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        traced = pool.apply(measure_traced, (workload, engine, steps))
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        rss = pool.apply(measure_rss, (workload, engine, steps))
+    return {**traced, **rss}
+
+
+def _mb(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value / (1 << 20):.1f}"
+
+
+def print_results(results: Sequence[Dict[str, Any]], out=sys.stdout):
+    print(f"{'workload':11} {'engine':13} {'steps':>8} {'B/step':>8} {'est B/step':>10} {'retained':>9} "
+          f"{'run peak':>9} {'state':>8} {'RSS peak':>9} {'RSS +':>8} {'steps/s':>9}", file=out)
+    for result in results:
+        estimate = result["estimate"]
+        per_step = "-" if estimate is None or not result["steps"] else f"{estimate / result['steps']:.1f}"
+        rss_growth = None if result["rss_peak"] is None else result["rss_peak"] - result["rss_before"]
+        rate = result["steps"] / result["seconds"] if result["seconds"] else 0.0
+        print(f"{result['workload']:11} {result['engine']:13} {result['steps']:>8} "
+              f"{result['bytes_per_step']:>8.1f} {per_step:>10} {_mb(result['retained']):>9} "
+              f"{_mb(result['run_peak']):>9} {_mb(result['state_peak']):>8} {_mb(result['rss_peak']):>9} "
+              f"{_mb(rss_growth):>8} {rate:>9.0f}", file=out)
+    print("sizes in MB; B/step — retained bytes per executed step (tracemalloc), est — memory_usage(); "
+          "state — peak of get_state() and serialization", file=out)
+
+
+def run_bench(steps: int, workloads: Sequence[str], engines: Sequence[str]) -> List[Dict[str, Any]]:
+    return [run_case(workload, engine, steps)
+            for workload in workloads for engine in engines if _supported(workload, engine)]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры памяти длинных выполнений")
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS, help="шагов выполнения на замер")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), action="append",
+                        help="нагрузка (по умолчанию все)")
+    parser.add_argument("--engine", choices=list(ENGINES), action="append",
+                        help="движок/режим истории (по умолчанию все)")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args(argv)
+    if args.steps < 1:
+        parser.error("--steps must be positive")
+
+    results = run_bench(args.steps, args.workload or list(WORKLOADS), args.engine or list(ENGINES))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Страничная память данных с копированием при записи
+"""
+from itertools import chain, islice
+from typing import Iterator, List, Sequence, Tuple, Union
+
+PAGE_SHIFT = 8
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+
+# Общая нулевая страница: никогда не изменяется, копируется при первой записи
+_ZERO_PAGE = [0] * PAGE_SIZE
+
+
+class PagedRAM:
+    """
+    Память данных из страниц по PAGE_SIZE ячеек. Страницы могут разделяться
+    несколькими экземплярами (после fork()); страница копируется только при
+    первой записи в нее. Поддерживает индексацию и срезы как список.
+    """
+
+    __slots__ = ('size', 'pages', 'owned')
+
+    def __init__(self, size: int = 4096):
+        count = (size + PAGE_MASK) >> PAGE_SHIFT
+        self.size = size
+        self.pages: List[List[int]] = [_ZERO_PAGE] * count
+        self.owned: List[bool] = [False] * count   # страница принадлежит только этому экземпляру
+
+    @classmethod
+    def from_list(cls, values: Sequence[int]) -> "PagedRAM":
+        ram = cls(len(values))
+        ram.write(0, values)
+        return ram
+
+    def fork(self) -> "PagedRAM":
+        """
+        Копия, разделяющая страницы с исходной памятью. Стоимость не зависит
+        от содержимого: копируется только список ссылок на страницы.
+        """
+        child = PagedRAM.__new__(PagedRAM)
+        child.size = self.size
+        child.pages = self.pages.copy()
+        child.owned = [False] * len(self.pages)
+        # Списки изменяются на месте: на них могут ссылаться работающие циклы выполнения
+        self.owned[:] = child.owned
+        return child
+
+    def writable_page(self, index: int) -> List[int]:
+        """
+        Страница для записи (копируется, если разделяется с другими экземплярами
+        или отображена из неизменяемого буфера)
+        """
+        if not self.owned[index]:
+            self.pages[index] = list(self.pages[index])
+            self.owned[index] = True
+        return self.pages[index]
+
+    def read(self, start: int, stop: int) -> List[int]:
+        """Значения ячеек [start, stop)"""
+        stop = min(stop, self.size)
+        result: List[int] = []
+        address = start
+        while address < stop:
+            offset = address & PAGE_MASK
+            count = min(PAGE_SIZE - offset, stop - address)
+            result.extend(self.pages[address >> PAGE_SHIFT][offset:offset + count])
+            address += count
+        return result
+
+    def write(self, start: int, values: Sequence[int]):
+        """Записать значения начиная с адреса start"""
+        if start < 0 or start + len(values) > self.size:
+            raise IndexError("PagedRAM write out of range")
+        position = 0
+        address = start
+        total = len(values)
+        while position < total:
+            offset = address & PAGE_MASK
+            count = min(PAGE_SIZE - offset, total - position)
+            index = address >> PAGE_SHIFT
+            if count == PAGE_SIZE:
+                # Целая страница заменяется новой без копирования прежней
+                page = values[position:position + PAGE_SIZE]
+                self.pages[index] = page if isinstance(page, list) else list(page)
+                self.owned[index] = True
+            else:
+                self.writable_page(index)[offset:offset + count] = values[position:position + count]
+            position += count
+            address += count
+
+    def map(self, start: int, values: Sequence[int]):
+        """
+        Записать значения, разделяя целые страницы с values без копирования
+        (values — неизменяемый буфер, например memoryview отображенного файла).
+        Страница копируется при первой записи в нее; неполные страницы по
+        краям записываются копированием.
+        """
+        if start < 0 or start + len(values) > self.size:
+            raise IndexError("PagedRAM map out of range")
+        head = min(-start & PAGE_MASK, len(values))
+        if head:
+            self.write(start, values[:head])
+        position = head
+        total = len(values)
+        while total - position >= PAGE_SIZE:
+            index = (start + position) >> PAGE_SHIFT
+            self.pages[index] = values[position:position + PAGE_SIZE]
+            self.owned[index] = False
+            position += PAGE_SIZE
+        if position < total:
+            self.write(start + position, values[position:])
+
+    def resize(self, size: int):
+        """Увеличить размер памяти (новые ячейки нулевые)"""
+        if size < self.size:
+            raise ValueError("PagedRAM cannot shrink")
+        count = (size + PAGE_MASK) >> PAGE_SHIFT
+        # Списки дополняются на месте: на них могут ссылаться работающие циклы выполнения
+        self.pages.extend([_ZERO_PAGE] * (count - len(self.pages)))
+        self.owned.extend([False] * (count - len(self.owned)))
+        self.size = size
+
+    def nonzero_pages(self) -> Iterator[Tuple[int, List[int]]]:
+        """(адрес начала, страница) для страниц с ненулевыми значениями"""
+        for index, page in enumerate(self.pages):
+            if page is not _ZERO_PAGE and any(page):
+                yield index << PAGE_SHIFT, page
+
+    @property
+    def resident_pages(self) -> int:
+        """Число страниц, принадлежащих только этому экземпляру"""
+        return sum(self.owned)
+
+    def tolist(self) -> List[int]:
+        values = list(chain.from_iterable(self.pages))
+        if len(values) != self.size:
+            del values[self.size:]
+        return values
+
+    def copy(self) -> List[int]:
+        return self.tolist()
+
+    def _index(self, address: int) -> int:
+        if address < 0:
+            address += self.size
+        if not 0 <= address < self.size:
+            raise IndexError("PagedRAM index out of range")
+        return address
+
+    def __getitem__(self, key: Union[int, slice]):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step == 1:
+                return self.read(start, stop)
+            return self.tolist()[key]
+        address = self._index(key)
+        return self.pages[address >> PAGE_SHIFT][address & PAGE_MASK]
+
+    def __setitem__(self, key: Union[int, slice], value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            value = list(value)
+            if step != 1 or len(value) != max(stop - start, 0):
+                raise ValueError("PagedRAM slice assignment must keep the size")
+            self.write(start, value)
+            return
+        address = self._index(key)
+        self.writable_page(address >> PAGE_SHIFT)[address & PAGE_MASK] = value
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        return islice(chain.from_iterable(self.pages), self.size)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PagedRAM):
+            return self.size == other.size and self.tolist() == other.tolist()
+        if isinstance(other, (list, tuple)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"PagedRAM(size={self.size}, resident_pages={self.resident_pages})"
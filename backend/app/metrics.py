@@ -0,0 +1,299 @@
+"""
+Метрики эмулятора в текстовом формате Prometheus
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы бакетов по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    """Форматирование числа для экспозиции"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Форматирование набора меток {name="value",...}"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """Базовый класс метрики с набором меток"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Список (суффикс имени, метки, значение)"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counter can only be incremented")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        return [("", _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    """Произвольное значение; может вычисляться функцией в момент сбора"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Вычислять значение при каждом сборе метрик"""
+        self._function = function
+
+    def value(self) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def samples(self):
+        return [("", "", self.value())]
+
+
+class Histogram(_Metric):
+    """Гистограмма с кумулятивными бакетами"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [counts по бакетам..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замерить длительность блока"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        result = []
+        for key, data in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += data[i]
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                result.append(("_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            result.append(("_sum", labels, data[-2]))
+            result.append(("_count", labels, data[-1]))
+        return result
+
+
+class MetricsRegistry:
+    """Набор метрик, отдаваемый endpoint'ом /metrics"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Экспозиция всех метрик в текстовом формате Prometheus"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "emulator_http_request_duration_seconds",
+    "Длительность обработки HTTP-запроса",
+    ("method", "route", "status"),
+)
+ASSEMBLE_SECONDS = REGISTRY.histogram(
+    "emulator_assemble_duration_seconds",
+    "Длительность ассемблирования исходного кода",
+)
+EXECUTE_SECONDS = REGISTRY.histogram(
+    "emulator_execute_duration_seconds",
+    "Длительность выполнения программы до остановки",
+)
+CYCLES_EXECUTED = REGISTRY.counter(
+    "emulator_cycles_executed_total",
+    "Количество выполненных инструкций",
+)
+STEPS_PER_SECOND = REGISTRY.gauge(
+    "emulator_steps_per_second",
+    "Скорость выполнения последнего запуска (инструкций в секунду)",
+)
+HISTORY_SIZE = REGISTRY.gauge(
+    "emulator_history_size",
+    "Количество записей в истории выполнения",
+)
+LIVE_SESSIONS = REGISTRY.gauge(
+    "emulator_live_sessions",
+    "Количество активных сессий эмулятора",
+)
+SESSION_STORE_CONFLICTS = REGISTRY.counter(
+    "emulator_session_store_conflicts_total",
+    "Записи состояния сессий, отклоненные из-за изменения версии",
+)
+JOBS_QUEUED = REGISTRY.gauge(
+    "emulator_jobs_queued",
+    "Количество заданий в очереди",
+)
+JOBS_RUNNING = REGISTRY.gauge(
+    "emulator_jobs_running",
+    "Количество выполняющихся заданий",
+)
+NOT_MODIFIED_RESPONSES = REGISTRY.counter(
+    "emulator_not_modified_responses_total",
+    "Ответы 304 на опрос неизменившегося состояния",
+)
+COMPILE_CACHE_HITS = REGISTRY.counter(
+    "emulator_compile_cache_hits_total",
+    "Попадания в кэш компиляции",
+)
+COMPILE_CACHE_MISSES = REGISTRY.counter(
+    "emulator_compile_cache_misses_total",
+    "Промахи кэша компиляции",
+)
+RESULT_CACHE_HITS = REGISTRY.counter(
+    "emulator_result_cache_hits_total",
+    "Запуски программ, результат которых взят из кэша",
+)
+RESULT_CACHE_MISSES = REGISTRY.counter(
+    "emulator_result_cache_misses_total",
+    "Запуски программ, выполненные заново",
+)
+RESULT_CACHE_SHARED = REGISTRY.counter(
+    "emulator_result_cache_shared_total",
+    "Запуски, дождавшиеся одновременного одинакового запуска",
+)
+RESULT_CACHE_BYTES = REGISTRY.gauge(
+    "emulator_result_cache_bytes",
+    "Оценка памяти результатов в кэше выполнения, байт",
+)
+RESULT_CACHE_HIT_RATIO = REGISTRY.gauge(
+    "emulator_result_cache_hit_ratio",
+    "Доля запусков, результат которых взят из кэша",
+)
+COMPILE_CACHE_HIT_RATIO = REGISTRY.gauge(
+    "emulator_compile_cache_hit_ratio",
+    "Доля попаданий в кэш компиляции",
+)
+
+
+def _compile_cache_hit_ratio() -> float:
+    hits = COMPILE_CACHE_HITS.value()
+    total = hits + COMPILE_CACHE_MISSES.value()
+    return hits / total if total else 0.0
+
+
+COMPILE_CACHE_HIT_RATIO.set_function(_compile_cache_hit_ratio)
+
+
+def _result_cache_hit_ratio() -> float:
+    hits = RESULT_CACHE_HITS.value()
+    total = hits + RESULT_CACHE_MISSES.value() + RESULT_CACHE_SHARED.value()
+    return hits / total if total else 0.0
+
+
+RESULT_CACHE_HIT_RATIO.set_function(_result_cache_hit_ratio)
+
+
+def record_run(cycles: int, seconds: float):
+    """Учесть выполнение программы: длительность, циклы и скорость"""
+    EXECUTE_SECONDS.observe(seconds)
+    CYCLES_EXECUTED.inc(cycles)
+    if seconds > 0:
+        STEPS_PER_SECOND.set(cycles / seconds)
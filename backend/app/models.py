@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 from enum import Enum
 
 class FlagType(str, Enum):
@@ -18,6 +18,8 @@ class ProcessorState(BaseModel):
     }
     current_command: str = ""
     is_halted: bool = False
+    cycles: int = 0   # стоимость выполненных команд в циклах (блочные команды дороже)
+    loop_counter: int = 0   # регистр счетчика цикла (SETLC / GETLC / LOOP)
 
 class MemoryState(BaseModel):
     """Состояние памяти"""
@@ -41,6 +43,14 @@ class TaskInfo(BaseModel):
 class CompileRequest(BaseModel):
     """Запрос на компиляцию кода"""
     source_code: str
+    optimize: int = 0   # уровень оптимизации 0-3
+    measure_cycles: bool = False   # замерить стоимость в циклах до и после оптимизации (выполнение на копии памяти)
+
+class IncrementalCompileRequest(BaseModel):
+    """Запрос на инкрементальную перекомпиляцию после правки в редакторе"""
+    start_line: int   # первая заменяемая строка (с 1)
+    end_line: int     # строка, следующая за последней заменяемой
+    text: str = ""    # новый текст заменяемых строк
 
 class LoadTaskRequest(BaseModel):
     """Запрос на загрузку данных задачи"""
@@ -51,6 +61,24 @@ class ExecuteRequest(BaseModel):
     task_id: Optional[int] = None
     step_by_step: bool = False
     source_code: Optional[str] = None
+    optimize: int = 0   # уровень оптимизации 0-3
+    engine: Optional[str] = None                # движок выполнения (по умолчанию — самый быстрый подходящий)
+    program_words: Optional[List[int]] = None   # программа в словах команд эмулятора вместо исходного кода
+
+class JobRequest(BaseModel):
+    """Запрос на фоновое выполнение программы или задачи"""
+    task_id: Optional[int] = None
+    source_code: Optional[str] = None
+    optimize: int = 0                  # уровень оптимизации 0-3
+    max_cycles: Optional[int] = None   # ограничение числа инструкций
+    history_mode: Literal["full", "pc"] = "pc"   # режим записи истории (pc — журнал адресов)
+
+class MemoryMapRequest(BaseModel):
+    """Запрос на отображение файла данных в память"""
+    path: str                          # путь относительно EMULATOR_DATA_DIR
+    address: int = 0                   # адрес первой ячейки
+    dtype: Literal["int8", "uint8", "int16", "uint16", "int32", "uint32", "int64"] = "int64"   # для сырых файлов
+    grow: bool = False                 # увеличить память, если данные не помещаются
 
 class ResetRequest(BaseModel):
     """Запрос на сброс"""
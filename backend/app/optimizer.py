@@ -0,0 +1,374 @@
+"""
+Оптимизатор программ стекового процессора (работает над IR после ассемблирования)
+"""
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .ir import Instruction, OperandKind, Program
+from .verifier import STACK_EFFECTS, STACK_LIMIT, ensure_verified, verify_stack_depth
+
+PUSH_OPCODE = 0x01
+JUMPS = frozenset(['JMP', 'JZ', 'JNZ'])
+# Команды с адресом перехода (LOOP также изменяет счетчик цикла)
+BRANCHES = JUMPS | {'LOOP'}
+FLAG_WRITERS = frozenset(['ADD', 'SUB', 'MUL', 'DIV', 'INC', 'DEC', 'VSUM', 'VDOT'])
+FLAG_READERS = frozenset(['JZ', 'JNZ'])
+# Команды, которые могут завершиться ошибкой при достаточной глубине стека (деление на ноль);
+# обращения к памяти вне ее границ ошибкой не являются
+MAY_FAULT = frozenset(['DIV'])
+BINARY_OPERATIONS: Dict[str, Callable[[int, int], int]] = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'DIV': lambda a, b: a // b,
+}
+
+# Проходы, включаемые уровнем оптимизации
+LEVEL_PASSES = {
+    0: (),
+    1: ('fold', 'simplify'),
+    2: ('fold', 'simplify', 'thread'),
+    3: ('fold', 'simplify', 'thread', 'unreachable'),
+}
+MAX_LEVEL = max(LEVEL_PASSES)
+
+
+@dataclass
+class OptimizationReport:
+    """Отчет оптимизатора"""
+    level: int
+    passes: List[str] = field(default_factory=list)
+    instructions_before: int = 0
+    instructions_after: int = 0
+    cycles_before: Optional[int] = None
+    cycles_after: Optional[int] = None
+    address_map: List[Optional[int]] = field(default_factory=list)  # старый адрес -> новый (удаленные — адрес следующей сохраненной)
+    source_map: List[int] = field(default_factory=list)              # новый адрес -> строка исходника
+
+    def to_dict(self) -> Dict:
+        return {
+            "level": self.level,
+            "passes": self.passes,
+            "instructions_before": self.instructions_before,
+            "instructions_after": self.instructions_after,
+            "cycles_before": self.cycles_before,
+            "cycles_after": self.cycles_after,
+            "address_map": self.address_map,
+            "source_map": self.source_map,
+        }
+
+
+def _successors(instructions: List[Instruction], pc: int) -> List[int]:
+    instruction = instructions[pc]
+    if instruction.mnemonic == 'HALT':
+        return []
+    if instruction.mnemonic == 'JMP':
+        return [instruction.operand]
+    if instruction.mnemonic in FLAG_READERS or instruction.mnemonic == 'LOOP':
+        return [instruction.operand, pc + 1]
+    return [pc + 1]
+
+
+def _stack_safe(program: Program) -> List[bool]:
+    """
+    Инструкции без ошибок стека по проверке глубины: нижняя граница глубины
+    (верна при любом начальном стеке) не меньше числа операндов, а команды,
+    увеличивающие глубину, не превышают лимит (при пустом начальном стеке)
+    """
+    depths = program.stack_depths if program.stack_depths is not None else verify_stack_depth(program).depths
+    safe = []
+    for instruction, interval in zip(program.instructions, depths):
+        need, delta = STACK_EFFECTS.get(instruction.mnemonic, (0, 0))
+        safe.append(interval is not None and interval[0] >= need
+                    and (delta <= 0 or (interval[1] is not None and interval[1] + delta <= STACK_LIMIT)))
+    return safe
+
+
+def _flags_live_after(instructions: List[Instruction], stack_safe: List[bool]) -> List[bool]:
+    """
+    Обратный анализ живости флагов: может ли значение флагов после
+    инструкции быть прочитано (переходом или в итоговом состоянии).
+    Команда, которая может завершиться ошибкой, считается читающей флаги:
+    после ошибки в состоянии остаются флаги до нее.
+    """
+    count = len(instructions)
+    live_in = [False] * count
+    live_out = [False] * count
+    changed = True
+    while changed:
+        changed = False
+        for pc in range(count - 1, -1, -1):
+            instruction = instructions[pc]
+            successors = _successors(instructions, pc)
+            if not successors:
+                out = True   # флаги видны в состоянии после остановки
+            else:
+                out = any(not 0 <= s < count or live_in[s] for s in successors if s is not None)
+            mnemonic = instruction.mnemonic
+            # Ошибка останавливает выполнение, и в состоянии видны флаги до команды
+            may_fault = mnemonic in MAY_FAULT or not stack_safe[pc]
+            value_in = mnemonic in FLAG_READERS or may_fault or (out and mnemonic not in FLAG_WRITERS)
+            if out != live_out[pc] or value_in != live_in[pc]:
+                live_out[pc] = out
+                live_in[pc] = value_in
+                changed = True
+    return live_out
+
+
+def reads_entry_flags(program: Program) -> bool:
+    """
+    Может ли выполнение программы с начала прочитать флаги, оставшиеся от
+    предыдущего запуска (переходом или в состоянии после остановки или ошибки).
+    Результат сохраняется в программе.
+    """
+    if program.entry_flags_read is None:
+        ensure_verified(program)
+        instructions = program.instructions
+        if not instructions:
+            program.entry_flags_read = True
+        else:
+            stack_safe = [True] * len(instructions) if program.verified else _stack_safe(program)
+            first = instructions[0].mnemonic
+            program.entry_flags_read = (
+                first in FLAG_READERS or first in MAY_FAULT or not stack_safe[0]
+                or (first not in FLAG_WRITERS and _flags_live_after(instructions, stack_safe)[0])
+            )
+    return program.entry_flags_read
+
+
+def _leaders(instructions: List[Instruction]) -> Set[int]:
+    """Начала базовых блоков"""
+    leaders = {0}
+    for pc, instruction in enumerate(instructions):
+        if instruction.mnemonic in BRANCHES:
+            if instruction.operand is not None:
+                leaders.add(instruction.operand)
+            leaders.add(pc + 1)
+        elif instruction.mnemonic == 'HALT':
+            leaders.add(pc + 1)
+    return leaders
+
+
+def _remap_targets(instructions: List[Instruction], address_map: List[int]) -> List[Instruction]:
+    """
+    Пересчитать адреса переходов после изменения расположения кода.
+    PUSH метки кладет на стек данные, поэтому его значение не меняется.
+    """
+    count = len(address_map) - 1
+    result = []
+    for instruction in instructions:
+        if instruction.mnemonic in BRANCHES and instruction.operand is not None and 0 <= instruction.operand <= count:
+            instruction = replace(instruction, operand=address_map[instruction.operand])
+        result.append(instruction)
+    return result
+
+
+def _compact(instructions: List[Instruction], lines: List[int],
+             keep: List[bool]) -> Tuple[List[Instruction], List[int], List[int]]:
+    """Удалить инструкции; address_map[i] — новый адрес первой сохраненной инструкции не раньше i"""
+    address_map = [0] * (len(instructions) + 1)
+    kept = []
+    kept_lines = []
+    for pc, instruction in enumerate(instructions):
+        address_map[pc] = len(kept)
+        if keep[pc]:
+            kept.append(instruction)
+            kept_lines.append(lines[pc])
+    address_map[len(instructions)] = len(kept)
+    return _remap_targets(kept, address_map), kept_lines, address_map
+
+
+def _is_constant(instruction: Instruction) -> bool:
+    return instruction.mnemonic == 'PUSH' and instruction.operand_kind in (OperandKind.IMMEDIATE, OperandKind.ADDRESS)
+
+
+def _fold(instructions: List[Instruction], lines: List[int], stack_safe: List[bool],
+          fold: bool, simplify: bool) -> Tuple[List[Instruction], List[int], List[int]]:
+    """
+    Распространение и свертка констант в пределах базового блока и
+    алгебраические упрощения. Инструкции, устанавливающие флаги, удаляются
+    только если значение флагов после них не используется; удаляемые и
+    переставляемые инструкции не должны приводить к ошибке стека
+    (stack_safe), иначе оптимизация скрыла бы ошибку исходной программы.
+    """
+    leaders = _leaders(instructions)
+    flags_live = _flags_live_after(instructions, stack_safe)
+    out: List[Instruction] = []
+    out_lines: List[int] = []
+    out_safe: List[bool] = []   # инструкция out (или все, из которых свернута константа) без ошибок стека
+    address_map = [0] * (len(instructions) + 1)
+    constants = 0   # число подряд идущих PUSH констант на вершине текущего блока
+
+    def push_constant(value: int, line: int, safe: bool):
+        out.append(Instruction(PUSH_OPCODE, 'PUSH', OperandKind.IMMEDIATE, value))
+        out_lines.append(line)
+        out_safe.append(safe)
+
+    def pop() -> Tuple[Instruction, int]:
+        out_safe.pop()
+        return out.pop(), out_lines.pop()
+
+    def retract(pc: int):
+        # Удаленные инструкции блока отображаются на следующую сохраненную
+        while pc >= 0 and address_map[pc] > len(out):
+            address_map[pc] = len(out)
+            pc -= 1
+
+    for pc, instruction in enumerate(instructions):
+        address_map[pc] = len(out)
+        if pc in leaders:
+            constants = 0
+        mnemonic = instruction.mnemonic
+        flags_dead = not flags_live[pc]
+        safe = stack_safe[pc]
+        top_safe = constants >= 1 and out_safe[-1]
+        pair_safe = constants >= 2 and out_safe[-1] and out_safe[-2]
+
+        if fold:
+            if mnemonic in BINARY_OPERATIONS and pair_safe and safe and flags_dead \
+                    and not (mnemonic == 'DIV' and out[-1].operand == 0):
+                b = pop()[0].operand
+                a, line = pop()
+                push_constant(BINARY_OPERATIONS[mnemonic](a.operand, b), line, True)
+                retract(pc)
+                constants -= 1
+                continue
+            if mnemonic in ('INC', 'DEC') and top_safe and flags_dead:
+                a, line = pop()
+                push_constant(a.operand + (1 if mnemonic == 'INC' else -1), line, True)
+                continue
+            if mnemonic == 'DUP' and constants >= 1:
+                # PUSH вместо DUP: то же изменение глубины и та же ошибка переполнения
+                push_constant(out[-1].operand, lines[pc], safe)
+                constants += 1
+                continue
+            if mnemonic == 'SWAP' and pair_safe:
+                out[-1], out[-2] = out[-2], out[-1]
+                out_lines[-1], out_lines[-2] = out_lines[-2], out_lines[-1]
+                continue
+            if mnemonic == 'POP' and top_safe:
+                pop()
+                retract(pc)
+                constants -= 1
+                continue
+
+        if simplify and top_safe and safe and flags_dead:
+            value = out[-1].operand
+            if (mnemonic in ('ADD', 'SUB') and value == 0) or (mnemonic in ('MUL', 'DIV') and value == 1):
+                # x + 0, x - 0, x * 1, x / 1 -> x
+                pop()
+                retract(pc)
+                constants -= 1
+                continue
+
+        out.append(instruction)
+        out_lines.append(lines[pc])
+        out_safe.append(safe)
+        constants = constants + 1 if _is_constant(instruction) else 0
+
+    address_map[len(instructions)] = len(out)
+    return _remap_targets(out, address_map), out_lines, address_map
+
+
+def _thread_jumps(instructions: List[Instruction],
+                  lines: List[int]) -> Tuple[List[Instruction], List[int], List[int]]:
+    """Сквозные переходы: переход на переход заменяется переходом на конечную цель"""
+    count = len(instructions)
+
+    def final_target(target: int, condition: Optional[str]) -> int:
+        seen = set()
+        while 0 <= target < count and target not in seen:
+            seen.add(target)
+            instruction = instructions[target]
+            if instruction.mnemonic == 'JMP':
+                target = instruction.operand
+            elif condition is not None and instruction.mnemonic == condition:
+                # Условие уже выполнено, флаги между переходами не меняются
+                target = instruction.operand
+            elif condition is not None and instruction.mnemonic in FLAG_READERS:
+                # Противоположное условие заведомо не выполнится
+                target = target + 1
+            else:
+                break
+        return target
+
+    threaded = []
+    for pc, instruction in enumerate(instructions):
+        if instruction.mnemonic in BRANCHES and instruction.operand is not None:
+            # LOOP, как и JMP, продолжается только через безусловные переходы
+            condition = None if instruction.mnemonic in ('JMP', 'LOOP') else instruction.mnemonic
+            target = final_target(instruction.operand, condition)
+            if target != instruction.operand:
+                instruction = replace(instruction, operand=target)
+        threaded.append(instruction)
+
+    # Переход на следующую инструкцию не нужен
+    keep = [not (ins.mnemonic in JUMPS and ins.operand == pc + 1) for pc, ins in enumerate(threaded)]
+    return _compact(threaded, lines, keep)
+
+
+def _remove_unreachable(instructions: List[Instruction],
+                        lines: List[int]) -> Tuple[List[Instruction], List[int], List[int]]:
+    """Удаление блоков, недостижимых из точки входа"""
+    count = len(instructions)
+    reachable = [False] * count
+    worklist = [0] if count else []
+    while worklist:
+        pc = worklist.pop()
+        if not 0 <= pc < count or reachable[pc]:
+            continue
+        reachable[pc] = True
+        worklist.extend(s for s in _successors(instructions, pc) if s is not None)
+    return _compact(instructions, lines, reachable)
+
+
+def optimize(program: Program, level: int = MAX_LEVEL) -> Tuple[Program, OptimizationReport]:
+    """
+    Оптимизировать программу. Уровни:
+    1 — свертка констант и алгебраические упрощения,
+    2 — плюс сквозные переходы,
+    3 — плюс удаление недостижимого кода.
+    Исходная программа не изменяется.
+    """
+    if level not in LEVEL_PASSES:
+        raise ValueError(f"Unknown optimization level: {level}")
+    passes = LEVEL_PASSES[level]
+    instructions = list(program.instructions)
+    lines = program.source_map
+    address_map = list(range(len(instructions) + 1))
+
+    def apply(result: Tuple[List[Instruction], List[int], List[int]]):
+        nonlocal instructions, lines, address_map
+        instructions, lines, pass_map = result
+        address_map = [pass_map[address] for address in address_map]
+
+    if 'fold' in passes or 'simplify' in passes:
+        apply(_fold(instructions, lines, _stack_safe(program), 'fold' in passes, 'simplify' in passes))
+    if 'thread' in passes:
+        apply(_thread_jumps(instructions, lines))
+    if 'unreachable' in passes:
+        apply(_remove_unreachable(instructions, lines))
+        # После удаления блоков могли появиться переходы на следующую инструкцию
+        apply(_thread_jumps(instructions, lines))
+
+    size = len(instructions)
+    labels = {name: address_map[address] if 0 <= address < len(address_map) else address
+              for name, address in program.labels.items()}
+    optimized = Program(
+        instructions=instructions, lines=lines, labels=labels, source_code=program.source_code,
+        label_lines=dict(program.label_lines), optimization_level=level
+    )
+    stack_report = verify_stack_depth(optimized)
+    optimized.verified = stack_report.safe
+    optimized.max_stack_depth = stack_report.max_depth
+    optimized.warnings = stack_report.warnings
+
+    report = OptimizationReport(
+        level=level,
+        passes=list(passes),
+        instructions_before=len(program.instructions),
+        instructions_after=size,
+        address_map=[address if address < size else None for address in address_map[:-1]],
+        source_map=optimized.source_map,
+    )
+    return optimized, report
@@ -1,27 +1,271 @@
 """
 Эмулятор стекового процессора с Гарвардской архитектурой
 """
-from typing import List, Dict, Any, Optional
+import secrets
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import count, repeat
+from operator import add, mul
+from typing import List, Dict, Any, Callable, NamedTuple, Optional, Sequence, Tuple
 from .models import ProcessorState, MemoryState
+from .hooks import Hookable
+from .ir import Program, ProgramEdit
+from .memory import PAGE_MASK, PAGE_SHIFT, PAGE_SIZE, PagedRAM
+from .snapshot import (ENGINE_PROCESSOR, EMPTY_PROGRAM_HASH, PROGRAM_HASH_BLOCK, PROGRAMS, Snapshot, check_pc,
+                       code_digests, memory_runs, pack, program_hash, unpack)
+from .verifier import STACK_LIMIT, ensure_verified
 
-class StackProcessor:
+# Флаги хранятся битовой маской и вычисляются лениво по результату
+# последней арифметической операции
+FLAG_ZERO = 0x1
+FLAG_CARRY = 0x2
+FLAG_OVERFLOW = 0x4
+FLAG_NAMES = (("zero", FLAG_ZERO), ("carry", FLAG_CARRY), ("overflow", FLAG_OVERFLOW))
+
+def flag_bits(result: Optional[int]) -> int:
+    """Маска флагов по результату последней операции (None — флаги не установлены)"""
+    if result is None:
+        return 0
+    bits = FLAG_ZERO if result == 0 else 0
+    if result < 0:
+        bits |= FLAG_CARRY  # Упрощенная логика
+    if result > 32767 or result < -32768:
+        bits |= FLAG_OVERFLOW
+    return bits
+
+def flags_dict(bits: int) -> Dict[str, bool]:
+    """Представление маски флагов в виде словаря (для API)"""
+    return {name: bool(bits & mask) for name, mask in FLAG_NAMES}
+
+# Словари флагов для всех масок: история разделяет эти объекты
+_FLAG_VIEWS = [flags_dict(bits) for bits in range(1 << len(FLAG_NAMES))]
+
+# Режимы записи истории: полная (стек и флаги на каждом шаге) или журнал
+# адресов выполненных команд с восстановлением шагов повторным выполнением
+HISTORY_FULL = "full"
+HISTORY_PC = "pc"
+HISTORY_MODES = (HISTORY_FULL, HISTORY_PC)
+
+# Шагов между контрольными точками в режиме журнала (ограничивает длину повторного выполнения)
+CHECKPOINT_INTERVAL = 4096
+# Сколько последних шагов восстанавливается, если окно истории не задано
+REPLAY_LIMIT = 10000
+
+# Блочные команды над памятью данных: число операндов на стеке.
+# Стоимость команды — 1 + BLOCK_ELEMENT_CYCLES циклов на каждый элемент блока
+BLOCK_OPERANDS = {"MEMCPY": 3, "MEMFILL": 3, "VSUM": 2, "VDOT": 3}
+BLOCK_ELEMENT_CYCLES = 1
+
+# Идентификатор процессора в метке состояния: префикс процесса и номер экземпляра,
+# чтобы метки разных процессоров (и процессов) не совпадали при равных версиях
+_PROCESS_TAG = secrets.token_hex(3)
+_INSTANCE_NUMBERS = count()
+
+# Число закэшированных представлений состояния одной версии
+VIEW_CACHE_SIZE = 4
+
+# Оценка памяти выполнения, байт: ссылка на элемент стека, запись полной истории
+# (список стека и элементы колонок), собственная страница памяти данных, контрольная точка
+STACK_SLOT_BYTES = 8
+HISTORY_ENTRY_BYTES = sys.getsizeof([]) + 2 * STACK_SLOT_BYTES + 2 * array('i').itemsize + 1
+PAGE_BYTES = sys.getsizeof([0] * PAGE_SIZE)
+CHECKPOINT_BYTES = sys.getsizeof((None,) * 7) + 3 * sys.getsizeof([])
+# Шагов между проверками бюджета памяти при выполнении
+BUDGET_CHECK_INTERVAL = 4096
+
+# Действие команд на стек для событий обработчиков: (снимается, помещается)
+STACK_EFFECTS = {
+    "PUSH": (0, 1), "POP": (1, 0), "DUP": (0, 1), "SWAP": (2, 2), "ROT": (3, 3),
+    "ADD": (2, 1), "SUB": (2, 1), "MUL": (2, 1), "DIV": (2, 1), "INC": (1, 1), "DEC": (1, 1),
+    "LOAD": (1, 1), "STORE": (2, 0), "SETLC": (1, 0), "GETLC": (0, 1),
+    "MEMCPY": (3, 0), "MEMFILL": (3, 0), "VSUM": (2, 1), "VDOT": (3, 1),
+}
+BRANCH_INSTRUCTIONS = ("JMP", "JZ", "JNZ", "LOOP")
+# Число помещенных на стек значений: ниже них стек после шага совпадает со стеком до шага
+_PUSHED = {**dict.fromkeys((*BRANCH_INSTRUCTIONS, "HALT"), 0),
+           **{instruction: pushed for instruction, (_, pushed) in STACK_EFFECTS.items()}}
+MEMORY_INSTRUCTIONS = frozenset(("LOAD", "STORE", *BLOCK_OPERANDS))
+
+class Checkpoint(NamedTuple):
+    """Состояние перед шагом step журнала (память разделяется копированием при записи)"""
+    step: int
+    program_counter: int
+    stack: List[int]
+    flag_result: Optional[int]
+    current_command: str
+    ram: PagedRAM
+    loop_counter: int = 0
+
+class HistoryRecords(NamedTuple):
+    """
+    Окно полной истории колонками, без преобразования в словари: команда
+    записи — строка code по адресу executed. Используется колоночным форматом ответа.
+    """
+    code: Sequence[str]
+    executed: array
+    stacks: List[List[int]]
+    pc: List[int]
+    flags: array
+    prefix: array
+
+class History:
+    """
+    Полная история выполнения по колонкам: адрес выполненной команды, стек,
+    адрес следующей команды и маска флагов после каждого шага, а также длина
+    начала стека, не измененного шагом. Колонки заполняются при выполнении,
+    и колоночный ответ кодирует их срезы без обхода записей. Адрес следующей
+    команды — список: переход по числовому операнду может выйти за int32.
+    """
+    __slots__ = ("executed", "stacks", "pc", "flags", "prefix")
+
+    def __init__(self):
+        self.executed = array('i')
+        self.stacks: List[List[int]] = []
+        self.pc: List[int] = []
+        self.flags = array('B')
+        self.prefix = array('i')
+
+    def __len__(self) -> int:
+        return len(self.stacks)
+
+    def append(self, executed: int, instruction: str, stack: List[int], pc: int, flags: int):
+        self.executed.append(executed)
+        self.stacks.append(stack.copy())
+        self.pc.append(pc)
+        self.flags.append(flags)
+        self.prefix.append(len(stack) - _PUSHED[instruction])
+
+    def copy(self, stack_prefix: Sequence[int] = ()) -> "History":
+        """Копия колонок; stack_prefix добавляется под стеком всех записей"""
+        history = History()
+        history.executed = array('i', self.executed)
+        history.pc = self.pc.copy()
+        history.flags = array('B', self.flags)
+        if stack_prefix:
+            prefix = list(stack_prefix)
+            history.stacks = [prefix + stack for stack in self.stacks]
+            history.prefix = array('i', map(add, self.prefix, repeat(len(prefix))))
+        else:
+            history.stacks = self.stacks.copy()
+            history.prefix = array('i', self.prefix)
+        return history
+
+    def window(self, start: int, end: int, code: Sequence[str]) -> HistoryRecords:
+        """Записи [start, end); первая запись окна не опирается на предыдущий стек"""
+        prefix = self.prefix[start:end]
+        if prefix:
+            prefix[0] = 0
+        return HistoryRecords(code, self.executed[start:end], self.stacks[start:end],
+                              self.pc[start:end], self.flags[start:end], prefix)
+
+class StackProcessor(Hookable):
     """Эмулятор стекового процессора"""
     
-    def __init__(self, memory_size: int = 4096):
+    # Бюджет памяти выполнения в байтах (None — без ограничения); значение класса
+    # задает бюджет по умолчанию для всех процессоров
+    memory_budget: Optional[int] = None
+    
+    def __init__(self, memory_size: int = 4096, history_mode: str = HISTORY_FULL,
+                 memory_budget: Optional[int] = None):
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
         self.memory_size = memory_size
         self.processor = ProcessorState()
         self.memory = MemoryState()
-        self.memory.ram = [0] * memory_size
+        self.memory.ram = PagedRAM(memory_size)
         self.program_memory = [0] * memory_size  # Память команд
         self.labels = {}  # Метки для переходов
+        self.flag_result: Optional[int] = None  # Результат, по которому вычисляются флаги
+        self.history_mode = history_mode
+        self._clear_history()
+        self._init_version()
         
+    def _init_version(self):
+        self.instance_id = f"{_PROCESS_TAG}{next(_INSTANCE_NUMBERS):x}"
+        self.version = 0
+        self._views: Dict[Any, Any] = {}
+        self._views_version = 0
+
+    def changed(self):
+        """Состояние изменено: новая версия (закэшированные представления устаревают)"""
+        self.version += 1
+
+    @property
+    def state_tag(self) -> str:
+        """Метка текущего состояния: меняется при любом изменении процессора"""
+        return f"{self.instance_id}-{self.version}"
+
+    def cached_view(self, key: Any, build: Callable[[], Any]) -> Any:
+        """
+        Представление состояния (например, закодированный ответ), вычисленное
+        build() один раз для текущей версии; key различает параметры представления
+        """
+        if self._views_version != self.version:
+            self._views = {}
+            self._views_version = self.version
+        value = self._views.get(key)
+        if value is None:
+            if len(self._views) >= VIEW_CACHE_SIZE:
+                self._views.clear()
+            value = self._views[key] = build()
+        return value
+
     def reset(self):
         """Сброс процессора в начальное состояние"""
+        self.changed()
         self.processor = ProcessorState()
         self.memory = MemoryState()
-        self.memory.ram = [0] * self.memory_size
-        self.program_memory = [0] * self.memory_size
+        self.memory.ram = PagedRAM(self.memory_size)
+        self.program_memory = [0] * len(self.program_memory)
         self.labels = {}
+        self.flag_result = None
+        self._clear_history()
+
+    def _clear_history(self):
+        self.memory.history = History()
+        self.pc_log = array('i')            # адреса выполненных команд (режим журнала)
+        self.checkpoints: List[Checkpoint] = []
+        self._checkpoint_steps: List[int] = []
+        self._checkpoint_needed = False
+        self._reset_measure()
+
+    def _reset_measure(self):
+        # Записи истории, уже учтенные в оценке памяти, и их элементы стека
+        self._measured_entries = 0
+        self._measured_slots = 0
+
+    def set_history_mode(self, mode: str):
+        """Переключить режим записи истории (накопленная история очищается)"""
+        if mode not in HISTORY_MODES:
+            raise ValueError(f"Unknown history mode: {mode}")
+        self.history_mode = mode
+        self._clear_history()
+        self.changed()
+
+    def note_external_change(self):
+        """Состояние изменено вне выполнения программы: журналу нужна новая контрольная точка"""
+        self._checkpoint_needed = True
+
+    @property
+    def history_size(self) -> int:
+        """Число записанных шагов истории"""
+        if self.history_mode == HISTORY_PC:
+            return len(self.pc_log)
+        return len(self.memory.history)
+
+    def _prepare_recording(self):
+        """Контрольная точка журнала перед выполнением, если она нужна"""
+        step = len(self.pc_log)
+        if (self._checkpoint_needed or not self.checkpoints
+                or step - self.checkpoints[-1].step >= CHECKPOINT_INTERVAL):
+            self.checkpoints.append(Checkpoint(
+                step, self.processor.program_counter, self.processor.stack.copy(),
+                self.flag_result, self.processor.current_command, self.memory.ram.fork(),
+                self.processor.loop_counter
+            ))
+            self._checkpoint_steps.append(step)
+            self._checkpoint_needed = False
     
     def push(self, value: int):
         """Поместить значение на стек"""
@@ -74,12 +318,48 @@ class StackProcessor:
         """Сохранить значение в память"""
         if 0 <= address < self.memory_size:
             self.memory.ram[address] = value
+            self.changed()
+    
+    def load_memory(self, start: int, values: Sequence[int], zero_copy: bool = False, grow: bool = False):
+        """
+        Записать блок значений в память данных (копированием срезов по страницам).
+        Как и в store_to_memory, значения за пределами памяти отбрасываются;
+        grow — вместо этого увеличить память до конца блока.
+        zero_copy — разделять целые страницы с неизменяемым буфером values без
+        копирования (страница копируется при первой записи программой).
+        """
+        if start < 0:
+            values = values[-start:]
+            start = 0
+        end = start + len(values)
+        if end > self.memory_size:
+            if grow:
+                self.memory.ram.resize(end)
+                self.memory_size = end
+            else:
+                values = values[:max(self.memory_size - start, 0)]
+        if not len(values):
+            return
+        if zero_copy:
+            self.memory.ram.map(start, values)
+        else:
+            self.memory.ram.write(start, values)
+        self.note_external_change()
+        self.changed()
     
     def update_flags(self, result: int):
-        """Обновить флаги после операции"""
-        self.processor.flags["zero"] = (result == 0)
-        self.processor.flags["carry"] = (result < 0)  # Упрощенная логика
-        self.processor.flags["overflow"] = (result > 32767 or result < -32768)
+        """Обновить флаги после операции (вычисляются лениво при чтении)"""
+        self.flag_result = result
+    
+    @property
+    def flag_bits(self) -> int:
+        """Текущая маска флагов"""
+        return flag_bits(self.flag_result)
+    
+    @property
+    def flags(self) -> Dict[str, bool]:
+        """Флаги в виде словаря"""
+        return flags_dict(flag_bits(self.flag_result))
     
     def execute_instruction(self, instruction: str, operand: Optional[int] = None):
         """Выполнить одну инструкцию"""
@@ -204,7 +484,7 @@ class StackProcessor:
                 raise Exception("JMP requires operand")
         
         elif instruction == "JZ":
-            if operand is not None and self.processor.flags["zero"]:
+            if operand is not None and self.flag_bits & FLAG_ZERO:
                 self.processor.program_counter = operand
             elif operand is not None:
                 self.processor.program_counter += 1
@@ -212,25 +492,147 @@ class StackProcessor:
                 raise Exception("JZ requires operand")
         
         elif instruction == "JNZ":
-            if operand is not None and not self.processor.flags["zero"]:
+            if operand is not None and not self.flag_bits & FLAG_ZERO:
                 self.processor.program_counter = operand
             elif operand is not None:
                 self.processor.program_counter += 1
             else:
                 raise Exception("JNZ requires operand")
         
+        elif instruction == "LOOP":
+            if operand is None:
+                raise Exception("LOOP requires operand")
+            self.processor.loop_counter -= 1
+            if self.processor.loop_counter != 0:
+                self.processor.program_counter = operand
+            else:
+                self.processor.program_counter += 1
+        
+        elif instruction == "SETLC":
+            self.processor.loop_counter = self.pop()
+        
+        elif instruction == "GETLC":
+            self.push(self.processor.loop_counter)
+        
         elif instruction == "HALT":
             self.processor.is_halted = True
         
+        elif instruction in BLOCK_OPERANDS:
+            need = BLOCK_OPERANDS[instruction]
+            if len(self.processor.stack) < need:
+                raise Exception(f"{instruction} requires {need} operands on stack")
+            result, count = self._block_instruction(instruction)
+            self.processor.cycles += count * BLOCK_ELEMENT_CYCLES
+            if result is not None:
+                self.update_flags(result)
+        
         else:
             raise Exception(f"Unknown instruction: {instruction}")
         
         # Увеличиваем счетчик команд, если не было перехода
-        if instruction not in ["JMP", "JZ", "JNZ"]:
+        if instruction not in BRANCH_INSTRUCTIONS:
             self.processor.program_counter += 1
     
+    def _block_instruction(self, instruction: str) -> Tuple[Optional[int], int]:
+        """
+        Блочная команда над памятью данных. Операнды помещаются на стек в порядке
+        записи и снимаются с вершины:
+        MEMCPY (dst, src, count) — копирование блока (блоки могут перекрываться);
+        MEMFILL (dst, value, count) — заполнение блока значением;
+        VSUM (addr, count) — сумма блока на стек;
+        VDOT (a, b, count) — скалярное произведение блоков на стек.
+        Как и в LOAD/STORE, ячейки вне памяти читаются как 0, запись в них
+        игнорируется. Возвращает результат для флагов (None — флаги не меняются)
+        и число обработанных элементов (внутри памяти), по которому считается стоимость.
+        """
+        stack = self.processor.stack
+        ram = self.memory.ram
+        size = self.memory_size
+        count = max(stack.pop(), 0)
+        if instruction == "VSUM":
+            values = ram.read(max(stack[-1], 0), min(stack[-1] + count, size))
+            stack[-1] = result = sum(values)
+            return result, len(values)
+        second = stack.pop()
+        first = stack.pop()
+        if instruction == "VDOT":
+            low = max(0, -first, -second)
+            high = min(count, size - first, size - second)
+            if high <= low:
+                stack.append(0)
+                return 0, 0
+            result = sum(map(mul, ram.read(first + low, first + high), ram.read(second + low, second + high)))
+            stack.append(result)
+            return result, high - low
+        low = max(first, 0)
+        high = min(first + count, size)
+        if high <= low:
+            return None, 0
+        if instruction == "MEMFILL":
+            ram.write(low, [second] * (high - low))
+        else:
+            # Источник читается целиком до записи: перекрытие блоков допустимо
+            source = second + low - first
+            stop = source + high - low
+            inside_low, inside_high = max(source, 0), min(stop, size)
+            if inside_high > inside_low:
+                values = [0] * (inside_low - source) + ram.read(inside_low, inside_high) + [0] * (stop - inside_high)
+            else:
+                values = [0] * (high - low)
+            ram.write(low, values)
+        return None, high - low
+
     def step(self) -> bool:
         """Выполнить один шаг программы. Возвращает True если выполнение продолжается"""
+        self.changed()
+        if self.history_mode == HISTORY_PC:
+            self._prepare_recording()
+        if self._hook_set is not None:
+            continues = self._step_hooked()
+        else:
+            continues = self._step()
+        if continues and self.memory_budget is not None and self._enforce_budget():
+            return False
+        return continues
+
+    def memory_usage(self) -> int:
+        """
+        Оценка памяти, занятой выполнением, в байтах: история (или журнал
+        адресов и контрольные точки), стек и собственные страницы памяти данных.
+        Страницы, разделяемые после fork или отображенные из файла, не учитываются.
+        """
+        history = self.memory.history
+        if self._measured_entries > len(history):
+            self._reset_measure()
+        if self._measured_entries < len(history):
+            self._measured_slots += sum(map(len, history.stacks[self._measured_entries:]))
+            self._measured_entries = len(history)
+        pointers = STACK_SLOT_BYTES * (len(self.memory.ram.pages) * 2)
+        return (
+            len(history) * HISTORY_ENTRY_BYTES
+            + self._measured_slots * STACK_SLOT_BYTES
+            + len(self.pc_log) * self.pc_log.itemsize
+            + sum(CHECKPOINT_BYTES + pointers + len(checkpoint.stack) * STACK_SLOT_BYTES
+                  for checkpoint in self.checkpoints)
+            + len(self.processor.stack) * STACK_SLOT_BYTES
+            + self.memory.ram.resident_pages * PAGE_BYTES
+        )
+
+    def _enforce_budget(self) -> bool:
+        """Остановить выполнение с ошибкой, если оценка памяти превысила бюджет"""
+        usage = self.memory_usage()
+        if usage <= self.memory_budget:
+            return False
+        self.processor.is_halted = True
+        self.processor.current_command = (
+            f"ERROR: Memory budget exceeded: {usage} > {self.memory_budget} bytes "
+            f"(reset the processor or use the pc history mode)"
+        )
+        if self._hook_set is not None:
+            self._hook_set.halt(self)
+        return True
+
+    def _step(self) -> bool:
         if self.processor.is_halted:
             return False
         
@@ -242,26 +644,25 @@ class StackProcessor:
             self.processor.is_halted = True
             return False
         
-        # Получаем инструкцию
+        # Получаем инструкцию (разобрана один раз при загрузке программы)
         instruction_line = self.compiled_code[self.processor.program_counter]
-        parts = instruction_line.split()
-        instruction = parts[0]
-        operand = self._parse_operand(parts[1]) if len(parts) > 1 else None
+        instruction, operand = self._decoded[self.processor.program_counter]
         
         # Сохраняем текущую команду для отображения
         self.processor.current_command = instruction_line
         
         # Выполняем инструкцию
         try:
+            executed_pc = self.processor.program_counter
+            self.processor.cycles += 1
             self.execute_instruction(instruction, operand)
             
-            # Сохраняем состояние в историю
-            self.memory.history.append({
-                'command': instruction_line,
-                'stack': self.processor.stack.copy(),
-                'programCounter': self.processor.program_counter,
-                'flags': self.processor.flags.copy()
-            })
+            # Сохраняем состояние в историю; словари строятся только в get_state()
+            if self.history_mode == HISTORY_PC:
+                self.pc_log.append(executed_pc)
+            else:
+                self.memory.history.append(executed_pc, instruction, self.processor.stack,
+                                           self.processor.program_counter, self.flag_bits)
             
             return not self.processor.is_halted
             
@@ -270,28 +671,632 @@ class StackProcessor:
             self.processor.current_command = f"ERROR: {str(e)}"
             return False
     
-    def load_program(self, compiled_code: List[str], source_code: str = ""):
+    def _memory_access(self, instruction: str) -> Tuple[range, ...]:
+        """
+        Ячейки памяти (внутри памяти), которые прочитает и запишет команда
+        с текущими операндами на стеке: (чтения..., записи)
+        """
+        stack = self.processor.stack
+        size = self.memory_size
+        empty = range(0)
+        if len(stack) < STACK_EFFECTS[instruction][0]:
+            return (empty,)
+        if instruction == "LOAD":
+            address = stack[-1]
+            return (range(address, address + 1) if 0 <= address < size else empty, empty)
+        if instruction == "STORE":
+            address = stack[-1]
+            return (empty, range(address, address + 1) if 0 <= address < size else empty)
+        count = max(stack[-1], 0)
+        if instruction == "VSUM":
+            return (range(max(stack[-2], 0), min(stack[-2] + count, size)), empty)
+        first, second = stack[-3], stack[-2]
+        if instruction == "VDOT":
+            low = max(0, -first, -second)
+            high = max(min(count, size - first, size - second), low)
+            return (range(first + low, first + high), range(second + low, second + high), empty)
+        written = range(max(first, 0), max(min(first + count, size), max(first, 0)))
+        if instruction == "MEMFILL":
+            return (empty, written)
+        source = range(max(second + written.start - first, 0), min(second + written.stop - first, size))
+        return (source, written)
+
+    def _step_hooked(self) -> bool:
+        """
+        Шаг с вызовом обработчиков событий (app/hooks.py). Семантика
+        совпадает с _step(); используется только при подключенных обработчиках.
+        """
+        hooks = self._hook_set
+        state = self.processor
+        if state.is_halted:
+            return False
+        if not hasattr(self, 'compiled_code') or not self.compiled_code:
+            return False
+        if state.program_counter >= len(self.compiled_code):
+            state.is_halted = True
+            hooks.halt(self)
+            return False
+        
+        pc = state.program_counter
+        instruction_line = self.compiled_code[pc]
+        instruction, operand = self._decoded[pc]
+        state.current_command = instruction_line
+        stack = state.stack
+        ram = self.memory.ram
+        depth = len(stack)
+        popped_values: List[int] = []
+        executed = False
+        
+        try:
+            for hook in hooks.on_step:
+                hook(self, pc, instruction_line)
+            popped = pushed = 0
+            if (hooks.on_pop or hooks.on_push) and instruction in STACK_EFFECTS:
+                popped, pushed = STACK_EFFECTS[instruction]
+            if popped <= depth:
+                popped_values = stack[depth - popped:][::-1]
+            reads, writes = (), ()
+            if (hooks.on_memory_read or hooks.on_memory_write) and instruction in MEMORY_INSTRUCTIONS:
+                *blocks, writes = self._memory_access(instruction)
+                reads = [(address, ram[address]) for block in blocks for address in block]
+            if instruction in BRANCH_INSTRUCTIONS and hooks.on_branch:
+                taken = (instruction == "JMP"
+                         or (instruction == "JZ" and bool(self.flag_bits & FLAG_ZERO))
+                         or (instruction == "JNZ" and not self.flag_bits & FLAG_ZERO)
+                         or (instruction == "LOOP" and state.loop_counter != 1))
+            
+            state.cycles += 1
+            self.execute_instruction(instruction, operand)
+            executed = True
+            
+            if self.history_mode == HISTORY_PC:
+                self.pc_log.append(pc)
+            else:
+                self.memory.history.append(pc, instruction, stack, state.program_counter, self.flag_bits)
+            
+            for value in popped_values:
+                for hook in hooks.on_pop:
+                    hook(self, value)
+            for address, value in reads:
+                for hook in hooks.on_memory_read:
+                    hook(self, address, value)
+            for address in writes:
+                for hook in hooks.on_memory_write:
+                    hook(self, address, ram[address])
+            for value in (stack[len(stack) - pushed:] if pushed else ()):
+                for hook in hooks.on_push:
+                    hook(self, value)
+            if instruction in BRANCH_INSTRUCTIONS:
+                for hook in hooks.on_branch:
+                    hook(self, pc, operand, taken)
+            
+        except Exception as e:
+            state.is_halted = True
+            state.current_command = f"ERROR: {str(e)}"
+            if not executed:
+                # Значения, снятые командой до ошибки, тоже сообщаются
+                for value in popped_values[:depth - len(stack)]:
+                    for hook in hooks.on_pop:
+                        hook(self, value)
+        if state.is_halted:
+            hooks.halt(self)
+        return not state.is_halted
+    
+    def run(self, max_cycles: Optional[int] = None, stop_pc: Optional[int] = None) -> int:
+        """
+        Выполнять программу до остановки или max_cycles инструкций
+        (stop_pc — также до перехода на этот адрес).
+        Возвращает число выполненных инструкций. С бюджетом памяти выполнение
+        идет порциями по BUDGET_CHECK_INTERVAL шагов и останавливается с
+        ошибкой, если оценка памяти после порции превышает бюджет.
+        """
+        self.changed()
+        if self.memory_budget is not None:
+            return self._run_budgeted(max_cycles, stop_pc)
+        return self._run_mode(max_cycles, stop_pc)
+
+    def _run_mode(self, max_cycles: Optional[int], stop_pc: Optional[int]) -> int:
+        if self.history_mode == HISTORY_PC:
+            return self._run_recorded(max_cycles, stop_pc)
+        return self._run(max_cycles, stop_pc)
+
+    def _run_budgeted(self, max_cycles: Optional[int], stop_pc: Optional[int]) -> int:
+        cycles = 0
+        while max_cycles is None or cycles < max_cycles:
+            chunk = BUDGET_CHECK_INTERVAL
+            if max_cycles is not None:
+                chunk = min(chunk, max_cycles - cycles)
+            executed = self._run_mode(chunk, stop_pc)
+            cycles += executed
+            if self.processor.is_halted or self._enforce_budget():
+                break
+            if executed < chunk or (stop_pc is not None and self.processor.program_counter == stop_pc):
+                break
+        return cycles
+
+    def _run_recorded(self, max_cycles: Optional[int], stop_pc: Optional[int]) -> int:
+        """Выполнение в режиме журнала: порциями между контрольными точками"""
+        cycles = 0
+        while max_cycles is None or cycles < max_cycles:
+            self._prepare_recording()
+            chunk = CHECKPOINT_INTERVAL - (len(self.pc_log) - self.checkpoints[-1].step)
+            if max_cycles is not None:
+                chunk = min(chunk, max_cycles - cycles)
+            executed = self._run(chunk, stop_pc)
+            cycles += executed
+            if (executed < chunk or self.processor.is_halted
+                    or (stop_pc is not None and self.processor.program_counter == stop_pc)):
+                break
+        return cycles
+
+    def _run(self, max_cycles: Optional[int], stop_pc: Optional[int]) -> int:
+        # Вариант цикла выбирается один раз: без обработчиков шаг их не проверяет
+        hooks = self._hook_set
+        if hooks is None and self._can_run_unchecked():
+            return self._run_unchecked(max_cycles, stop_pc)
+        step = self._step if hooks is None else self._step_hooked
+        
+        cycles = 0
+        code_size = len(getattr(self, 'compiled_code', None) or [])
+        while not self.processor.is_halted and (max_cycles is None or cycles < max_cycles):
+            if self.processor.program_counter >= code_size:
+                self.processor.is_halted = True
+                if hooks is not None:
+                    hooks.halt(self)
+                break
+            cycles += 1
+            if not step() or self.processor.program_counter == stop_pc:
+                break
+        return cycles
+    
+    def _can_run_unchecked(self) -> bool:
+        """Программа проверена статически, и текущий стек не нарушает доказательство"""
+        program = getattr(self, 'program', None)
+        return (
+            program is not None
+            and ensure_verified(program).verified
+            and program.max_stack_depth is not None
+            and program.max_stack_depth + len(self.processor.stack) <= 256
+        )
+    
+    def _run_unchecked(self, max_cycles: Optional[int] = None, stop_pc: Optional[int] = None) -> int:
+        """
+        Быстрый цикл выполнения для проверенных программ: без проверок
+        глубины стека и без разбора инструкций на каждом шаге.
+        Семантика (флаги, история, ошибки) совпадает с step().
+        """
+        state = self.processor
+        stack = state.stack
+        push = stack.append
+        pop = stack.pop
+        flag_result = self.flag_result
+        flags = flag_bits(flag_result)
+        loop_counter = state.loop_counter
+        history = self.memory.history
+        record_pc = self.history_mode == HISTORY_PC
+        log_append = self.pc_log.append
+        # Колонки полной истории пополняются прямо в цикле
+        executed_append = history.executed.append
+        stack_append = history.stacks.append
+        pc_append = history.pc.append
+        flags_append = history.flags.append
+        prefix_append = history.prefix.append
+        pushed = _PUSHED
+        ram = self.memory.ram
+        pages = ram.pages
+        owned = ram.owned
+        memory_size = self.memory_size
+        code = self.compiled_code
+        decoded = self._decoded
+        code_size = len(decoded)
+        pc = state.program_counter
+        halted = state.is_halted
+        command = None
+        cycles = 0
+        block_cycles = 0   # дополнительная стоимость блочных команд
+        limit = -1 if max_cycles is None else max_cycles
+        
+        try:
+            while not halted and cycles != limit:
+                if pc >= code_size:
+                    halted = True
+                    break
+                instruction, operand = decoded[pc]
+                command = code[pc]
+                cycles += 1
+                next_pc = pc + 1
+                
+                if instruction == "PUSH":
+                    push(operand)
+                elif instruction == "LOOP":
+                    # Переход тела цикла проверяется раньше остальных команд
+                    loop_counter -= 1
+                    if loop_counter != 0:
+                        next_pc = operand
+                elif instruction == "ADD" or instruction == "SUB" or instruction == "MUL" or instruction == "DIV":
+                    b = pop()
+                    if instruction == "ADD":
+                        result = stack[-1] + b
+                    elif instruction == "SUB":
+                        result = stack[-1] - b
+                    elif instruction == "MUL":
+                        result = stack[-1] * b
+                    else:
+                        if b == 0:
+                            pop()
+                            raise Exception("Division by zero")
+                        result = stack[-1] // b
+                    stack[-1] = flag_result = result
+                    flags = flag_bits(result)
+                elif instruction == "INC" or instruction == "DEC":
+                    result = stack[-1] + (1 if instruction == "INC" else -1)
+                    stack[-1] = flag_result = result
+                    flags = flag_bits(result)
+                elif instruction == "LOAD":
+                    address = stack[-1]
+                    stack[-1] = pages[address >> PAGE_SHIFT][address & PAGE_MASK] if 0 <= address < memory_size else 0
+                elif instruction == "STORE":
+                    address = pop()
+                    value = pop()
+                    if 0 <= address < memory_size:
+                        page = address >> PAGE_SHIFT
+                        if not owned[page]:
+                            ram.writable_page(page)
+                        pages[page][address & PAGE_MASK] = value
+                elif instruction == "DUP":
+                    push(stack[-1])
+                elif instruction == "POP":
+                    pop()
+                elif instruction == "SWAP":
+                    stack[-1], stack[-2] = stack[-2], stack[-1]
+                elif instruction == "ROT":
+                    stack[-3], stack[-2], stack[-1] = stack[-2], stack[-1], stack[-3]
+                elif instruction == "JMP":
+                    next_pc = operand
+                elif instruction == "JZ":
+                    # Флаг zero установлен только при нулевом результате
+                    if flag_result == 0:
+                        next_pc = operand
+                elif instruction == "JNZ":
+                    if flag_result != 0:
+                        next_pc = operand
+                elif instruction == "SETLC":
+                    loop_counter = pop()
+                elif instruction == "GETLC":
+                    push(loop_counter)
+                elif instruction == "HALT":
+                    halted = True
+                elif instruction in BLOCK_OPERANDS:
+                    result, count = self._block_instruction(instruction)
+                    block_cycles += count * BLOCK_ELEMENT_CYCLES
+                    if result is not None:
+                        flag_result = result
+                        flags = flag_bits(result)
+                else:
+                    raise Exception(f"Unknown instruction: {instruction}")
+                
+                if record_pc:
+                    log_append(pc)
+                else:
+                    executed_append(pc)
+                    stack_append(stack.copy())
+                    pc_append(next_pc)
+                    flags_append(flags)
+                    prefix_append(len(stack) - pushed[instruction])
+                pc = next_pc
+                if pc == stop_pc:
+                    break
+        except Exception as e:
+            halted = True
+            command = f"ERROR: {str(e)}"
+        finally:
+            self.flag_result = flag_result
+            state.loop_counter = loop_counter
+            state.cycles += cycles + block_cycles
+            state.program_counter = pc
+            state.is_halted = halted
+            if command is not None:
+                state.current_command = command
+        return cycles
+    
+    def load_program(self, compiled_code: List[str], source_code: str = "", program: Optional[Program] = None):
         """Загрузить скомпилированную программу"""
+        self.changed()
+        edit = program.edit if program is not None and program.code is compiled_code else None
+        if edit is not None and edit.base_code is getattr(self, 'compiled_code', None) \
+                and getattr(self, '_code_digests', None) is not None:
+            # Программа получена правкой загруженной: разбор и хэш только для изменившихся адресов
+            self._decoded, self._code_digests = self._apply_edit(edit, compiled_code)
+        else:
+            self._decoded = list(map(self._decode, compiled_code))
+            self._code_digests = code_digests(compiled_code)
         self.compiled_code = compiled_code
         self.source_code = source_code
+        self.program = program
+        # Программа доступна по хэшу для восстановления снимков
+        self.program_key = program_hash(compiled_code, self._code_digests)
+        PROGRAMS.register(self.program_key, (compiled_code, source_code, program, self._decoded, self._code_digests))
         self.processor.program_counter = 0
         self.processor.is_halted = False
         self.processor.current_command = ""
-        self.memory.history = []
+        self.processor.cycles = 0
+        self.processor.loop_counter = 0
+        self._clear_history()
     
-    def get_state(self) -> Dict[str, Any]:
-        """Получить текущее состояние процессора"""
+    def _decode(self, instruction_line: str) -> Tuple[str, Any]:
+        """Разбор строки машинного кода: (мнемоника, операнд)"""
+        parts = instruction_line.split()
+        operand = self._parse_operand(parts[1]) if len(parts) > 1 else None
+        return parts[0].upper(), operand
+
+    def _apply_edit(self, edit: ProgramEdit, compiled_code: List[str]) -> Tuple[List[Tuple[str, Any]], List[bytes]]:
+        """Разобранные команды и хэши блоков после правки загруженной программы"""
+        start, end, new_end = edit.start, edit.end, edit.start + edit.count
+        decoded = self._decoded[:start] + list(map(self._decode, compiled_code[start:new_end])) + self._decoded[end:]
+        for address in edit.relinked:
+            decoded[address] = self._decode(compiled_code[address])
+
+        if edit.count != end - start:
+            # Адреса хвоста сдвинулись: пересчитываются все блоки от первого изменения до конца
+            first_block = min(start, min(edit.relinked, default=start)) // PROGRAM_HASH_BLOCK
+            return decoded, self._code_digests[:first_block] + code_digests(compiled_code, first_block)
+        digests = list(self._code_digests)
+        blocks = set(range(start // PROGRAM_HASH_BLOCK, (new_end - 1) // PROGRAM_HASH_BLOCK + 1))
+        blocks.update(address // PROGRAM_HASH_BLOCK for address in edit.relinked)
+        for block in blocks:
+            digests[block] = code_digests(compiled_code, block, block + 1)[0]
+        return decoded, digests
+
+    def snapshot(self, include_program: bool = False) -> bytes:
+        """
+        Двоичный снимок состояния: pc, стек, флаги, остановка, ссылка на
+        программу (хэш) и ненулевая память. История в снимок не входит.
+        include_program — включить машинный код для восстановления в другом процессе.
+        """
+        return pack(self.snapshot_record(include_program))
+
+    def snapshot_record(self, include_program: bool = False) -> Snapshot:
+        """Неупакованный снимок состояния (см. snapshot)"""
+        code = getattr(self, 'compiled_code', None) or []
+        ram = self.memory.ram
+        return Snapshot(
+            engine=ENGINE_PROCESSOR,
+            pc=self.processor.program_counter,
+            cycles=self.processor.cycles,
+            loop_counter=self.processor.loop_counter,
+            halted=self.processor.is_halted,
+            flag_value=self.flag_result,
+            stack=self.processor.stack,
+            ram_size=len(ram),
+            runs=memory_runs(ram),
+            program_hash=getattr(self, 'program_key', None) or program_hash(code),
+            message=self.processor.current_command,
+            program_code=code if include_program else None,
+            source_code=getattr(self, 'source_code', '') if include_program else "",
+        )
+
+    def restore(self, blob: bytes, max_memory_size: Optional[int] = None):
+        """
+        Восстановить состояние из снимка (без повторного ассемблирования программы).
+        max_memory_size — предельный размер памяти снимка (ячеек).
+        Снимок проверяется целиком до изменения процессора: при ошибке состояние не меняется.
+        """
+        snapshot = unpack(blob, ENGINE_PROCESSOR, max_memory_size, STACK_LIMIT)
+        key = snapshot.program_hash
+        entry = PROGRAMS.get(key)
+        if entry is None and snapshot.program_code is not None:
+            # Программа передана в снимке: разбираем машинный код без ассемблера
+            code = snapshot.program_code
+            digests = code_digests(code)
+            entry = (code, snapshot.source_code, None, list(map(self._decode, code)), digests)
+            key = program_hash(code, digests)
+            PROGRAMS.register(key, entry)
+        elif entry is None:
+            if key != EMPTY_PROGRAM_HASH:
+                raise Exception("Программа снимка не загружена")
+            entry = ([], "", None, [], [])
+        check_pc(snapshot, len(entry[0]))
+        ram = PagedRAM(snapshot.ram_size)
+        for start, values in snapshot.runs:
+            ram.write(start, values)
+        state = ProcessorState(
+            program_counter=snapshot.pc,
+            stack=snapshot.stack,
+            current_command=snapshot.message,
+            is_halted=snapshot.halted,
+            cycles=snapshot.cycles,
+            loop_counter=snapshot.loop_counter,
+        )
+
+        self.changed()
+        self.compiled_code, self.source_code, self.program, self._decoded, self._code_digests = entry
+        self.program_key = key
+        self.processor = state
+        self.memory = MemoryState()
+        self._clear_history()
+        self.memory.ram = ram
+        self.memory_size = snapshot.ram_size
+        self.flag_result = snapshot.flag_value
+
+    def fork(self) -> "StackProcessor":
+        """
+        Дочерний процессор для выполнения «что если» с текущей точки.
+        Страницы памяти разделяются с родителем и копируются при записи,
+        программа (код, разбор, IR) разделяется без копирования.
+        """
+        child = self._derive(self.memory.ram.fork(), self.history_mode)
+        child._copy_execution(self)
+        child.memory_budget = self.memory_budget
+        return child
+
+    def adopt(self, source: "StackProcessor", stack_prefix: Sequence[int] = ()):
+        """
+        Перенести в процессор программу и состояние source вместе с историей
+        (например, готовый результат выполнения). Память разделяется с source
+        и копируется при записи; source после этого не изменяется.
+        stack_prefix — значения под стеком source (во всех записях истории),
+        если source выполнялся без них.
+        """
+        self.memory_size = source.memory_size
+        self.memory = MemoryState()
+        self.memory.ram = source.memory.ram.fork()
+        self.program_memory = source.program_memory
+        self.labels = source.labels
+        self.history_mode = source.history_mode
+        for name in ('compiled_code', 'source_code', 'program', '_decoded', '_code_digests', 'program_key'):
+            if hasattr(source, name):
+                setattr(self, name, getattr(source, name))
+        self._copy_execution(source)
+        if stack_prefix:
+            prefix = list(stack_prefix)
+            self.processor.stack = prefix + self.processor.stack
+            self.memory.history = source.memory.history.copy(prefix)
+            self.checkpoints = [checkpoint._replace(stack=prefix + checkpoint.stack)
+                                for checkpoint in self.checkpoints]
+        self.changed()
+
+    def _copy_execution(self, source: "StackProcessor"):
+        self.processor = source.processor.model_copy(update={"stack": source.processor.stack.copy()})
+        self.flag_result = source.flag_result
+        # Стеки записей истории и контрольные точки неизменяемы и разделяются
+        self.memory.history = source.memory.history.copy()
+        self.pc_log = array('i', source.pc_log)
+        self.checkpoints = source.checkpoints.copy()
+        self._checkpoint_steps = source._checkpoint_steps.copy()
+        self._checkpoint_needed = source._checkpoint_needed
+        self._reset_measure()
+
+    def _derive(self, ram: PagedRAM, history_mode: str) -> "StackProcessor":
+        """Новый процессор с той же программой и заданной памятью"""
+        child = type(self).__new__(type(self))
+        child.memory_size = self.memory_size
+        child.processor = ProcessorState()
+        child.memory = MemoryState()
+        child.memory.ram = ram
+        child.program_memory = self.program_memory
+        child.labels = self.labels
+        child.flag_result = None
+        child.history_mode = history_mode
+        child._clear_history()
+        child._init_version()
+        for name in ('compiled_code', 'source_code', 'program', '_decoded', '_code_digests', 'program_key'):
+            if hasattr(self, name):
+                setattr(child, name, getattr(self, name))
+        return child
+
+    def _replay(self, start: int, end: int) -> HistoryRecords:
+        """
+        Записи истории [start, end) режима журнала: повторное выполнение от
+        ближайшей контрольной точки (выполнение детерминировано).
+        """
+        checkpoint = self.checkpoints[bisect_right(self._checkpoint_steps, start) - 1]
+        scratch = self._derive(checkpoint.ram.fork(), HISTORY_FULL)
+        scratch.processor = ProcessorState(
+            program_counter=checkpoint.program_counter,
+            stack=checkpoint.stack.copy(),
+            current_command=checkpoint.current_command,
+            loop_counter=checkpoint.loop_counter,
+        )
+        scratch.flag_result = checkpoint.flag_result
+        scratch.run(end - checkpoint.step)
+        return scratch.memory.history.window(start - checkpoint.step, end - checkpoint.step, scratch.compiled_code)
+
+    def run_span(self, max_cycles: int, stop_pc: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Выполнить до max_cycles инструкций (или до stop_pc) и вернуть изменения:
+        число шагов, первый шаг в истории и измененные ячейки памяти.
+        Для сравнения памяти используется снимок страниц: проверяются
+        только страницы, скопированные при записи за время выполнения.
+        """
+        ram = self.memory.ram
+        before = ram.fork()
+        first_step = self.history_size
+        cycles = self.run(max_cycles, stop_pc)
+        changes = []
+        for index, page in enumerate(ram.pages):
+            old = before.pages[index]
+            if page is old:
+                continue
+            base = index << PAGE_SHIFT
+            changes.extend([base + offset, value] for offset, (value, previous) in enumerate(zip(page, old))
+                           if value != previous and base + offset < len(ram))
+        return {"cycles": cycles, "first_step": first_step, "memory": changes}
+
+    def memory_window(self, start: int = 0, count: Optional[int] = None) -> List[int]:
+        """Срез памяти данных [start, start + count) без копирования всей памяти"""
+        ram = self.memory.ram
+        if count is None:
+            return ram[start:]
+        return ram[start:start + count]
+
+    def history_window(self, from_step: Optional[int] = None, limit: Optional[int] = None,
+                       raw: bool = False) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Записи истории с шага from_step (не более limit).
+        Без from_step — последние limit записей. Возвращает (первый шаг, записи).
+        raw=True — сырые записи (HistoryRecords) вместо словарей.
+        """
+        total = self.history_size
+        if limit is None and self.history_mode == HISTORY_PC:
+            limit = REPLAY_LIMIT
+        if from_step is None:
+            from_step = 0 if limit is None else max(total - limit, 0)
+        end = total if limit is None else min(from_step + limit, total)
+        if self.history_mode == HISTORY_PC:
+            records = self._replay(from_step, end) if from_step < end else History().window(0, 0, [])
+        else:
+            records = self.memory.history.window(from_step, end, getattr(self, 'compiled_code', []))
+        if raw:
+            return from_step, records
+        code = records.code
+        return from_step, [
+            {
+                'command': code[executed],
+                'stack': stack,
+                'programCounter': pc,
+                'flags': _FLAG_VIEWS[flags]
+            }
+            for executed, stack, pc, flags in zip(records.executed, records.stacks, records.pc, records.flags)
+        ]
+
+    def get_state(self, copy: bool = True, include_ram: bool = True, include_history: bool = True,
+                  ram_start: int = 0, ram_count: Optional[int] = None,
+                  history_from: Optional[int] = None, history_limit: Optional[int] = None,
+                  raw_history: bool = False) -> Dict[str, Any]:
+        """
+        Получить текущее состояние процессора.
+        copy=False — без копирования стека (для немедленной сериализации).
+        include_ram/include_history=False исключают тяжелые поля, ram_start/ram_count
+        и history_from/history_limit ограничивают их окном.
+        raw_history=True — история сырыми записями (для колоночного формата).
+        """
+        if not include_ram:
+            ram_start, ram = 0, []
+        elif ram_start or ram_count is not None:
+            ram = self.memory_window(ram_start, ram_count)
+        else:
+            ram = self.memory.ram.tolist()
+        if include_history:
+            history_start, history = self.history_window(history_from, history_limit, raw_history)
+        else:
+            history_start, history = 0, []
         return {
             "processor": {
                 "program_counter": self.processor.program_counter,
-                "stack": self.processor.stack.copy(),
-                "flags": self.processor.flags,
+                "stack": self.processor.stack.copy() if copy else self.processor.stack,
+                "flags": self.flags,
                 "current_command": self.processor.current_command,
-                "is_halted": self.processor.is_halted
+                "is_halted": self.processor.is_halted,
+                "cycles": self.processor.cycles,
+                "loop_counter": self.processor.loop_counter
             },
             "memory": {
-                "ram": self.memory.ram.copy(),
-                "history": self.memory.history.copy()
+                "ram": ram,
+                "ram_start": ram_start,
+                "history": history,
+                "history_start": history_start,
+                "history_total": self.history_size,
+                "history_mode": self.history_mode
             },
             "source_code": getattr(self, 'source_code', ''),
             "machine_code": getattr(self, 'compiled_code', []),
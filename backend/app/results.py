@@ -0,0 +1,144 @@
+"""
+Кэш результатов выполнения программ
+
+Выполнение детерминировано: результат определяется программой, начальным
+состоянием процессора (память, стек, флаги), режимом истории и пределом
+циклов. Поэтому повторный запуск той же программы на тех же данных (кнопка
+«Выполнить» у задачи) берется из кэша: сохраняется завершенный процессор и
+результат проверки задачи, а состояние переносится в процессор сессии
+разделением страниц памяти.
+
+load_program сохраняет стек, поэтому при повторном запуске в сессии на
+стеке лежат результаты предыдущего. Проверенная программа не читает ниже
+своих значений: она выполняется без них, стек не входит в ключ и
+возвращается под стек результата. Флаги до запуска входят в ключ, только
+если программа может их прочитать.
+
+Кэш ограничен суммарной оценкой памяти результатов (memory_usage);
+запуски, остановленные ошибкой (в том числе бюджетом памяти) или
+пределом циклов, не кэшируются.
+
+Одновременные одинаковые запуски выполняются один раз: остальные запросы
+ждут результата первого. Кэш используется из цикла событий; само выполнение
+идет в пуле потоков на отдельной копии процессора.
+"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .optimizer import reads_entry_flags
+from .processor import StackProcessor
+from .snapshot import pack
+from .verifier import STACK_LIMIT, ensure_verified
+from . import metrics
+
+
+class ExecutionResult(NamedTuple):
+    """Результат выполнения: завершенный процессор (не изменяется), циклы и проверка задачи"""
+    processor: StackProcessor
+    cycles: int
+    verification: Optional[Dict[str, Any]] = None
+
+
+def keeps_entry_stack(processor: StackProcessor) -> bool:
+    """
+    Результат не зависит от стека до запуска: программа проверена (не читает
+    ниже своих значений) и вместе с ним не превышает предел стека
+    """
+    program = getattr(processor, 'program', None)
+    return (program is not None and ensure_verified(program).verified and program.max_stack_depth is not None
+            and program.max_stack_depth + len(processor.processor.stack) <= STACK_LIMIT)
+
+
+def execution_key(processor: StackProcessor, max_cycles: Optional[int],
+                  task_id: Optional[int] = None) -> Optional[Tuple]:
+    """
+    Ключ запуска по начальному состоянию: хэш снимка (программа, память, стек,
+    флаги, pc) и исходного кода, режим истории, предел циклов и задача для
+    проверки. Исходный код входит в ключ, так как он возвращается в состоянии.
+    Флаги не входят в ключ, если программа их не читает (стек перед
+    запуском пуст). None — запуск нельзя кэшировать (подключены
+    обработчики событий).
+    """
+    if processor.hooks:
+        return None
+    record = processor.snapshot_record()
+    program = getattr(processor, 'program', None)
+    if program is not None and not reads_entry_flags(program):
+        record.flag_value = None
+    digest = hashlib.sha256(pack(record))
+    digest.update(getattr(processor, 'source_code', '').encode("utf-8"))
+    return digest.digest(), processor.history_mode, max_cycles, task_id
+
+
+def cacheable(result: "ExecutionResult") -> bool:
+    """Запуск завершился командой HALT (не ошибкой, не бюджетом памяти и не пределом циклов)"""
+    state = result.processor.processor
+    return state.is_halted and not state.current_command.startswith("ERROR")
+
+
+class ResultCache:
+    """
+    LRU-кэш результатов с объединением одновременных одинаковых запусков;
+    суммарная оценка памяти результатов не превышает max_bytes
+    """
+
+    def __init__(self, max_bytes: int = 128 << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, Tuple[ExecutionResult, int]]" = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def get_or_run(self, key: Hashable, prepare: Callable[[], Callable[[], Any]]) -> Any:
+        """
+        Результат для key: из кэша, из уже идущего запуска или новым запуском.
+        prepare() вызывается в цикле событий только при промахе и возвращает
+        функцию, которая выполняется в пуле потоков.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            metrics.RESULT_CACHE_HITS.inc()
+            return self._entries[key][0]
+        pending = self._pending.get(key)
+        if pending is not None:
+            metrics.RESULT_CACHE_SHARED.inc()
+            return await asyncio.shield(pending)
+
+        metrics.RESULT_CACHE_MISSES.inc()
+        compute = prepare()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await run_in_threadpool(compute)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()   # ожидающих может не быть: ошибка уже передана вызывающему
+            raise
+        finally:
+            del self._pending[key]
+        future.set_result(result)
+        if cacheable(result):
+            self._store(key, result, result.processor.memory_usage())
+        return result
+
+    def _store(self, key: Hashable, result: ExecutionResult, size: int):
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (result, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,150 @@
+"""
+Быстрая сериализация ответов с состоянием эмулятора
+"""
+import gzip
+import json
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from . import wire
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость
+    brotli = None
+
+# Ответы меньше этого размера не сжимаются
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def dumps(payload: Any) -> bytes:
+    """Сериализация в JSON (orjson, если установлен)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            # orjson не поддерживает целые вне 64 бит — используем стандартный кодировщик
+            pass
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    """Разбор Accept-Encoding (и Accept): кодировка -> q"""
+    result = {}
+    for part in header.split(","):
+        pieces = part.strip().split(";")
+        name = pieces[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for parameter in pieces[1:]:
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[name] = quality
+    return result
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбрать сжатие по заголовку Accept-Encoding (br предпочтительнее gzip)"""
+    if not accept_encoding:
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def accepts_columnar(accept: Optional[str]) -> bool:
+    """Клиент запросил колоночный формат (явно, в заголовке Accept)"""
+    if not accept:
+        return False
+    return _accepted_encodings(accept).get(wire.COLUMNAR_MEDIA_TYPE, 0.0) > 0
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    """Сжать тело ответа выбранной кодировкой"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def encode_response(content: Any, request: Optional[Request] = None) -> Tuple[bytes, str, Dict[str, str]]:
+    """
+    Тело ответа, тип содержимого и заголовки (Content-Encoding, Vary):
+    колоночный формат, если клиент его принимает, иначе JSON; большие тела
+    сжимаются по Accept-Encoding
+    """
+    headers = {}
+    if request is not None and accepts_columnar(request.headers.get("accept")):
+        media_type = wire.COLUMNAR_MEDIA_TYPE
+        body = wire.encode(content)
+    else:
+        media_type = "application/json"
+        body = dumps(content)
+    if request is not None:
+        headers["Vary"] = "Accept"
+    if request is not None and len(body) >= COMPRESS_MIN_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept, Accept-Encoding"
+    return body, media_type, headers
+
+
+def entity_tag(state_tag: str) -> str:
+    """
+    Слабый ETag по метке состояния: представления одного состояния в разных
+    форматах и кодировках считаются эквивалентными
+    """
+    return f'W/"{state_tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Заголовок If-None-Match содержит etag (слабое сравнение, как требует RFC 9110)"""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+class TrustedJSONResponse(Response):
+    """
+    Ответ с данными, сформированными самим сервером: без повторной
+    валидации pydantic и jsonable_encoder, с быстрым кодировщиком и
+    сжатием по Accept-Encoding для больших тел. Если клиент принимает
+    application/x-emulator-columnar, тело кодируется колоночным форматом
+    (app/wire.py).
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, content: Any, request: Optional[Request] = None, status_code: int = 200,
+                 headers: Optional[Mapping[str, str]] = None):
+        body, self.media_type, encoded_headers = encode_response(content, request)
+        super().__init__(body, status_code=status_code, headers={**(headers or {}), **encoded_headers})
+
+    def render(self, content: Any) -> bytes:
+        return content
@@ -0,0 +1,199 @@
+"""
+Сессии эмулятора: независимые процессоры, которые можно ветвить (fork)
+"""
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from .processor import StackProcessor
+from .store import SessionStore, WriteBehindWriter
+from . import metrics
+
+DEFAULT_SESSION = "default"
+
+
+class SessionLimitError(RuntimeError):
+    """Превышено максимальное число сессий"""
+
+
+@dataclass
+class Session:
+    """Сессия: процессор и происхождение"""
+    id: str
+    processor: StackProcessor
+    parent_id: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    version: int = 0   # версия состояния во внешнем хранилище (0 — еще не сохранено)
+
+    def info(self) -> Dict:
+        ram = self.processor.memory.ram
+        return {
+            "id": self.id,
+            "version": self.version,
+            "parent_id": self.parent_id,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "program_counter": self.processor.processor.program_counter,
+            "is_halted": self.processor.processor.is_halted,
+            "resident_pages": ram.resident_pages,
+            "total_pages": len(ram.pages),
+        }
+
+
+class SessionManager:
+    """
+    Реестр сессий с ограничением числа и временем жизни неактивных сессий.
+    С внешним хранилищем (store) локальные сессии — кэш: перед запросом
+    состояние загружается, если его версия изменилась в другом процессе,
+    после изменяющего запроса сохраняется пакетной записью до ответа клиенту.
+    История выполнения не сохраняется: в другом процессе сессия продолжается
+    с пустой историей.
+    """
+
+    def __init__(self, max_sessions: int = 64, idle_ttl: float = 3600.0,
+                 store: Optional[SessionStore] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.store = store
+        self.writer = WriteBehindWriter(store, on_conflict=self._invalidate) if store is not None else None
+        self._sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, processor: StackProcessor, parent_id: Optional[str], session_id: Optional[str]) -> Session:
+        with self._lock:
+            if session_id is None and len(self._sessions) >= self.max_sessions:
+                self._expire_locked()
+                if len(self._sessions) >= self.max_sessions:
+                    raise SessionLimitError(f"Достигнут предел числа сессий ({self.max_sessions})")
+            session = Session(id=session_id or secrets.token_hex(8), processor=processor, parent_id=parent_id)
+            self._sessions[session.id] = session
+        if session_id is None:
+            # Новая сессия должна быть видна другим процессам до ответа
+            written = self.commit(session)
+            if written is not None:
+                written.result()
+        return session
+
+    def create(self, processor: Optional[StackProcessor] = None, session_id: Optional[str] = None) -> Session:
+        """Новая сессия (с новым процессором, если он не передан)"""
+        return self._add(processor or StackProcessor(), None, session_id)
+
+    def _stored_version(self, session_id: str) -> int:
+        pending = self.writer.pending(session_id)
+        return pending[0] if pending else self.store.version(session_id)
+
+    def acquire(self, session_id: str) -> Optional[Session]:
+        """Сессия с актуальным состоянием (из хранилища, если оно новее локального)"""
+        local = self.get(session_id)
+        if self.store is None:
+            return local
+        version = self._stored_version(session_id)
+        if version == 0:
+            if session_id == DEFAULT_SESSION or (local is not None and local.version == 0):
+                return local
+            # Сессия удалена в другом процессе
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            return None
+        if local is not None and local.version == version:
+            return local
+        stored = self.writer.pending(session_id) or self.store.load(session_id)
+        if stored is None:
+            return None
+        if local is None:
+            local = Session(id=session_id, processor=StackProcessor())
+            with self._lock:
+                self._sessions[session_id] = local
+        local.processor.restore(stored[1])
+        local.version = stored[0]
+        return local
+
+    def commit(self, session: Session) -> Optional[Future]:
+        """
+        Сохранить состояние сессии после изменения (пакетная запись с проверкой
+        версии). Возвращает Future записи: False — сессию изменил другой
+        процесс, изменение не сохранено; None — хранилища нет.
+        """
+        if self.writer is None:
+            return None
+        expected = session.version
+        session.version += 1
+        return self.writer.enqueue(session.id, session.processor.snapshot(include_program=True),
+                                   expected, session.version)
+
+    def _invalidate(self, session_id: str):
+        """Запись отклонена: другой процесс изменил сессию, локальная копия устарела"""
+        metrics.SESSION_STORE_CONFLICTS.inc()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.version = -1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.store.close()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.time()
+        return session
+
+    def fork(self, session_id: str) -> Session:
+        """Ветвить сессию: дочерний процессор разделяет память с родителем до первой записи"""
+        parent = self.acquire(session_id)
+        if parent is None:
+            raise KeyError(session_id)
+        return self._add(parent.processor.fork(), parent.id, None)
+
+    def delete(self, session_id: str) -> bool:
+        if session_id == DEFAULT_SESSION:
+            raise ValueError("Сессию по умолчанию удалить нельзя")
+        with self._lock:
+            deleted = self._sessions.pop(session_id, None) is not None
+        if self.store is not None:
+            deleted = deleted or self._stored_version(session_id) != 0
+            self.writer.discard(session_id)
+            self.store.delete(session_id)
+        return deleted
+
+    def list(self) -> List[Dict]:
+        """
+        Сведения о сессиях без загрузки состояния и без продления их жизни.
+        С хранилищем список берется из его метаданных (id, версия, время записи
+        updated); состояние процессора добавляется только для локальных копий
+        той же версии и для локальных сессий, еще не записанных в хранилище.
+        """
+        local = dict(self._sessions)
+        if self.store is None:
+            return [session.info() for session in local.values()]
+        infos = []
+        for session_id, version, updated in self.store.entries():
+            pending = self.writer.pending(session_id)
+            if pending:
+                version = pending[0]
+            session = local.pop(session_id, None)
+            info = session.info() if session is not None and session.version == version else {
+                "id": session_id, "version": version}
+            info["updated"] = updated
+            infos.append(info)
+        infos.extend(session.info() for session in local.values() if session.version == 0)
+        return infos
+
+    def _expire_locked(self):
+        deadline = time.time() - self.idle_ttl
+        for session_id in [s.id for s in self._sessions.values()
+                           if s.last_used < deadline and s.id != DEFAULT_SESSION]:
+            del self._sessions[session_id]
+
+    def expire(self):
+        """Удалить сессии, неактивные дольше idle_ttl"""
+        with self._lock:
+            self._expire_locked()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
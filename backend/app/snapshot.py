@@ -0,0 +1,289 @@
+"""
+Компактный двоичный снимок состояния эмулятора (версионированный формат)
+
+Формат (little-endian):
+    заголовок   MAGIC, версия, тип движка, флаги, pc, циклы, размер памяти, хэш программы
+    строка      текущая команда / ошибка
+    значения    флаг-результат (если есть), счетчик цикла (если не 0), стек
+    память      число отрезков, для каждого: начало и значения (нулевые ячейки вне отрезков)
+    программа   (необязательно) машинный код и исходный текст
+
+Значения хранятся массивом int64; если число не помещается в 64 бита,
+блок кодируется целыми переменной длины.
+"""
+import hashlib
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence, Tuple
+
+MAGIC = b"SEMU"
+SNAPSHOT_VERSION = 1
+
+# Тип движка, которому принадлежит снимок
+ENGINE_PROCESSOR = 1
+ENGINE_EMULATOR = 2
+
+_FLAG_HALTED = 0x1
+_FLAG_HAS_FLAG_VALUE = 0x2
+_FLAG_HAS_PROGRAM = 0x4
+_FLAG_HAS_LOOP_COUNTER = 0x8
+
+_HEADER = struct.Struct("<4sBBBqQI32s")
+_U32 = struct.Struct("<I")
+_VALUES_HEADER = struct.Struct("<BI")
+_VALUES_INT64 = 0
+_VALUES_VARINT = 1
+
+# Нулевые промежутки короче этого включаются в отрезок памяти целиком
+RUN_GAP = 4
+
+# Сколько программ хранит реестр
+PROGRAM_REGISTRY_SIZE = 256
+
+
+# Команд в блоке хэша программы: после правки пересчитываются только затронутые блоки
+PROGRAM_HASH_BLOCK = 1024
+
+
+def code_digests(code: Sequence[Any], first_block: int = 0, end_block: Optional[int] = None) -> List[bytes]:
+    """Хэши блоков программы по PROGRAM_HASH_BLOCK команд (блоки [first_block, end_block))"""
+    if end_block is None:
+        end_block = -(-len(code) // PROGRAM_HASH_BLOCK)
+    return [
+        hashlib.sha256("\n".join(map(str, code[block * PROGRAM_HASH_BLOCK:(block + 1) * PROGRAM_HASH_BLOCK]))
+                       .encode("utf-8")).digest()
+        for block in range(first_block, end_block)
+    ]
+
+
+def program_hash(code: Sequence[Any], digests: Optional[List[bytes]] = None) -> bytes:
+    """
+    Хэш программы (машинный код в текстовом виде или слова команд) — хэш от
+    хэшей блоков; digests — уже вычисленные хэши блоков (см. code_digests).
+    """
+    if digests is None:
+        digests = code_digests(code)
+    return hashlib.sha256(b"".join(digests)).digest()
+
+
+# Хэш пустой программы (процессор без загруженного кода)
+EMPTY_PROGRAM_HASH = program_hash([])
+
+
+class ProgramRegistry:
+    """Загруженные программы по хэшу: восстановление снимка не требует повторного ассемблирования"""
+
+    def __init__(self, maxsize: int = PROGRAM_REGISTRY_SIZE):
+        self.maxsize = maxsize
+        self._programs: "OrderedDict[bytes, Any]" = OrderedDict()
+
+    def register(self, key: bytes, entry: Any):
+        self._programs[key] = entry
+        self._programs.move_to_end(key)
+        while len(self._programs) > self.maxsize:
+            self._programs.popitem(last=False)
+
+    def get(self, key: bytes) -> Optional[Any]:
+        entry = self._programs.get(key)
+        if entry is not None:
+            self._programs.move_to_end(key)
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._programs)
+
+
+PROGRAMS = ProgramRegistry()
+
+
+@dataclass
+class Snapshot:
+    """Разобранный снимок состояния"""
+    engine: int
+    pc: int = 0
+    halted: bool = False
+    flag_value: Optional[int] = None
+    stack: List[int] = field(default_factory=list)
+    ram_size: int = 0
+    runs: List[Tuple[int, List[int]]] = field(default_factory=list)  # (начало, значения)
+    program_hash: bytes = b"\0" * 32
+    cycles: int = 0
+    loop_counter: int = 0
+    message: str = ""                       # текущая команда процессора или ошибка эмулятора
+    program_code: Optional[List[str]] = None  # машинный код (если включен в снимок)
+    source_code: str = ""
+
+    def ram(self) -> List[int]:
+        """Восстановить память целиком (отрезки копируются срезами)"""
+        ram = [0] * self.ram_size
+        for start, values in self.runs:
+            ram[start:start + len(values)] = values
+        return ram
+
+
+def memory_runs(ram: Sequence[int], gap: int = RUN_GAP) -> List[Tuple[int, List[int]]]:
+    """
+    Отрезки ненулевой памяти; короткие нулевые промежутки не разрывают отрезок.
+    Для страничной памяти нулевые страницы пропускаются целиком.
+    """
+    chunks = ram.nonzero_pages() if hasattr(ram, 'nonzero_pages') else [(0, ram)]
+    runs = []
+    start = None
+    last = -1
+    for base, chunk in chunks:
+        for offset, value in enumerate(chunk):
+            if not value:
+                continue
+            address = base + offset
+            if start is None:
+                start = address
+            elif address - last > gap:
+                runs.append((start, list(ram[start:last + 1])))
+                start = address
+            last = address
+    if start is not None:
+        runs.append((start, list(ram[start:last + 1])))
+    return runs
+
+
+def _pack_values(values: Sequence[int]) -> bytes:
+    try:
+        packed = array("q", values)
+    except OverflowError:
+        parts = [_VALUES_HEADER.pack(_VALUES_VARINT, len(values))]
+        for value in values:
+            length = (value.bit_length() + 8) // 8
+            parts.append(_U32.pack(length) + value.to_bytes(length, "little", signed=True))
+        return b"".join(parts)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return _VALUES_HEADER.pack(_VALUES_INT64, len(values)) + packed.tobytes()
+
+
+def _pack_text(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return _U32.pack(len(data)) + data
+
+
+class _Reader:
+    """Последовательное чтение блоков снимка"""
+
+    def __init__(self, blob: bytes, offset: int):
+        self.view = memoryview(blob)
+        self.offset = offset
+
+    def take(self, size: int) -> memoryview:
+        end = self.offset + size
+        if end > len(self.view):
+            raise ValueError("Snapshot is truncated")
+        chunk = self.view[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def u32(self) -> int:
+        return _U32.unpack(self.take(_U32.size))[0]
+
+    def text(self) -> str:
+        return bytes(self.take(self.u32())).decode("utf-8")
+
+    def values(self) -> List[int]:
+        kind, count = _VALUES_HEADER.unpack(self.take(_VALUES_HEADER.size))
+        if kind == _VALUES_INT64:
+            values = array("q")
+            values.frombytes(self.take(count * 8))
+            if sys.byteorder == "big":
+                values.byteswap()
+            return values.tolist()
+        if kind == _VALUES_VARINT:
+            result = []
+            for _ in range(count):
+                length = self.u32()
+                result.append(int.from_bytes(self.take(length), "little", signed=True))
+            return result
+        raise ValueError(f"Unknown value encoding: {kind}")
+
+
+def pack(snapshot: Snapshot) -> bytes:
+    """Сериализовать снимок в двоичный вид"""
+    flags = 0
+    if snapshot.halted:
+        flags |= _FLAG_HALTED
+    if snapshot.flag_value is not None:
+        flags |= _FLAG_HAS_FLAG_VALUE
+    if snapshot.program_code is not None:
+        flags |= _FLAG_HAS_PROGRAM
+    if snapshot.loop_counter:
+        flags |= _FLAG_HAS_LOOP_COUNTER
+    parts = [
+        _HEADER.pack(MAGIC, SNAPSHOT_VERSION, snapshot.engine, flags, snapshot.pc,
+                     snapshot.cycles, snapshot.ram_size, snapshot.program_hash),
+        _pack_text(snapshot.message),
+    ]
+    if snapshot.flag_value is not None:
+        parts.append(_pack_values([snapshot.flag_value]))
+    if snapshot.loop_counter:
+        parts.append(_pack_values([snapshot.loop_counter]))
+    parts.append(_pack_values(snapshot.stack))
+    parts.append(_U32.pack(len(snapshot.runs)))
+    for start, values in snapshot.runs:
+        parts.append(_U32.pack(start))
+        parts.append(_pack_values(values))
+    if snapshot.program_code is not None:
+        parts.append(_pack_text("\n".join(snapshot.program_code)))
+        parts.append(_pack_text(snapshot.source_code))
+    return b"".join(parts)
+
+
+def unpack(blob: bytes, engine: Optional[int] = None, max_ram_size: Optional[int] = None,
+           max_stack: Optional[int] = None) -> Snapshot:
+    """
+    Разобрать двоичный снимок; engine — ожидаемый тип движка, max_ram_size —
+    предельный размер памяти (для снимков, полученных от клиента), max_stack —
+    предельная глубина стека. Адрес команды проверяется по машинному коду
+    снимка, если он включен (иначе — при восстановлении, по коду из реестра).
+    """
+    if len(blob) < _HEADER.size:
+        raise ValueError("Snapshot is truncated")
+    magic, version, kind, flags, pc, cycles, ram_size, key = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not an emulator snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {version}")
+    if engine is not None and kind != engine:
+        raise ValueError(f"Snapshot belongs to another engine: {kind}")
+    if max_ram_size is not None and ram_size > max_ram_size:
+        raise ValueError(f"Snapshot memory size {ram_size} exceeds the limit of {max_ram_size} cells")
+    if pc < 0:
+        raise ValueError(f"Snapshot program counter is negative: {pc}")
+
+    reader = _Reader(blob, _HEADER.size)
+    snapshot = Snapshot(engine=kind, pc=pc, halted=bool(flags & _FLAG_HALTED), ram_size=ram_size,
+                        program_hash=key, cycles=cycles, message=reader.text())
+    if flags & _FLAG_HAS_FLAG_VALUE:
+        snapshot.flag_value = reader.values()[0]
+    if flags & _FLAG_HAS_LOOP_COUNTER:
+        snapshot.loop_counter = reader.values()[0]
+    snapshot.stack = reader.values()
+    if max_stack is not None and len(snapshot.stack) > max_stack:
+        raise ValueError(f"Snapshot stack depth {len(snapshot.stack)} exceeds the limit of {max_stack}")
+    for _ in range(reader.u32()):
+        start = reader.u32()
+        values = reader.values()
+        if start + len(values) > ram_size:
+            raise ValueError("Snapshot memory run is out of range")
+        snapshot.runs.append((start, values))
+    if flags & _FLAG_HAS_PROGRAM:
+        code = reader.text()
+        snapshot.program_code = code.split("\n") if code else []
+        snapshot.source_code = reader.text()
+        check_pc(snapshot, len(snapshot.program_code))
+    return snapshot
+
+
+def check_pc(snapshot: Snapshot, code_size: int):
+    """Адрес команды снимка внутри программы (или сразу за ее концом)"""
+    if snapshot.pc > code_size:
+        raise ValueError(f"Snapshot program counter {snapshot.pc} is outside the program of {code_size} instructions")
@@ -0,0 +1,245 @@
+"""
+Внешнее хранилище состояния сессий (для запуска в нескольких процессах)
+
+Состояние сессии хранится снимком (app/snapshot.py) с номером версии.
+Запись выполняется с проверкой версии (оптимистическая блокировка):
+если с момента чтения сессию изменил другой процесс, запись отклоняется.
+История выполнения в хранилище не входит.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (id, данные, ожидаемая версия, новая версия)
+WriteItem = Tuple[str, bytes, int, int]
+
+
+class SessionStore:
+    """Интерфейс хранилища: версия 0 означает отсутствие сессии"""
+
+    def version(self, session_id: str) -> int:
+        raise NotImplementedError
+
+    def load(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        """(версия, снимок) или None"""
+        raise NotImplementedError
+
+    def save_batch(self, items: Sequence[WriteItem]) -> List[str]:
+        """Записать пакет; возвращает id сессий, запись которых отклонена из-за версии"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """(id, версия, время записи) всех сессий без загрузки снимков, от давно записанных"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """Хранилище в памяти процесса"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[int, bytes, float]] = {}   # id -> (версия, снимок, время записи)
+        self._lock = threading.Lock()
+
+    def version(self, session_id: str) -> int:
+        entry = self._data.get(session_id)
+        return entry[0] if entry else 0
+
+    def load(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        entry = self._data.get(session_id)
+        return entry[:2] if entry else None
+
+    def save_batch(self, items: Sequence[WriteItem]) -> List[str]:
+        conflicts = []
+        now = time.time()
+        with self._lock:
+            for session_id, data, expected, new_version in items:
+                if self.version(session_id) != expected:
+                    conflicts.append(session_id)
+                    continue
+                self._data.pop(session_id, None)
+                self._data[session_id] = (new_version, data, now)
+        return conflicts
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        with self._lock:
+            return [(session_id, version, updated) for session_id, (version, _, updated) in self._data.items()]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Хранилище в локальной базе SQLite (общей для процессов на одной машине)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, version INTEGER NOT NULL, data BLOB NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def version(self, session_id: str) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        with self._lock:
+            row = self._connection.execute("SELECT version, data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def save_batch(self, items: Sequence[WriteItem]) -> List[str]:
+        conflicts = []
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for session_id, data, expected, new_version in items:
+                    if expected == 0:
+                        cursor.execute(
+                            "INSERT OR IGNORE INTO sessions (id, version, data, updated) VALUES (?, ?, ?, ?)",
+                            (session_id, new_version, data, now),
+                        )
+                    else:
+                        cursor.execute(
+                            "UPDATE sessions SET version = ?, data = ?, updated = ? WHERE id = ? AND version = ?",
+                            (new_version, data, now, session_id, expected),
+                        )
+                    if cursor.rowcount != 1:
+                        conflicts.append(session_id)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return conflicts
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        with self._lock:
+            return self._connection.execute("SELECT id, version, updated FROM sessions ORDER BY updated").fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class WriteBehindWriter:
+    """
+    Пакетная запись с подтверждением (group commit): изменения сессий,
+    поступившие во время предыдущей транзакции, записываются следующей
+    одной транзакцией (повторные записи одной сессии объединяются).
+    enqueue() возвращает Future: True — состояние записано, False — запись
+    отклонена из-за версии; запрос отвечает клиенту после подтверждения.
+    """
+
+    def __init__(self, store: SessionStore, on_conflict: Optional[Callable[[str], None]] = None):
+        self.store = store
+        self.on_conflict = on_conflict
+        # id -> (запись, ожидающие подтверждения); _writing — пакет текущей транзакции
+        self._pending: Dict[str, Tuple[WriteItem, List[Future]]] = {}
+        self._writing: Dict[str, WriteItem] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name="emulator-session-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, session_id: str, data: bytes, expected: int, new_version: int) -> Future:
+        future: Future = Future()
+        with self._lock:
+            waiters = [future]
+            previous = self._pending.get(session_id)
+            if previous is not None:
+                # Объединяем записи: проверяется версия, прочитанная до первой из них
+                expected = previous[0][2]
+                waiters = previous[1] + waiters
+            self._pending[session_id] = ((session_id, data, expected, new_version), waiters)
+        self._wakeup.set()
+        return future
+
+    def pending(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        """Еще не подтвержденное состояние сессии (версия, снимок)"""
+        with self._lock:
+            entry = self._pending.get(session_id)
+            item = entry[0] if entry else self._writing.get(session_id)
+        return (item[3], item[1]) if item else None
+
+    def discard(self, session_id: str):
+        with self._lock:
+            entry = self._pending.pop(session_id, None)
+        if entry is not None:
+            for future in entry[1]:
+                future.set_result(False)
+
+    def flush(self):
+        with self._lock:
+            batch = list(self._pending.values())
+            self._pending.clear()
+            self._writing = {item[0]: item for item, _ in batch}
+        if not batch:
+            return
+        try:
+            conflicts = set(self.store.save_batch([item for item, _ in batch]))
+        except Exception as e:
+            logger.exception("Session store flush failed")
+            for _, waiters in batch:
+                for future in waiters:
+                    future.set_exception(e)
+            return
+        finally:
+            with self._lock:
+                self._writing = {}
+        for item, waiters in batch:
+            written = item[0] not in conflicts
+            if not written:
+                logger.warning("Session %s was modified concurrently, write discarded", item[0])
+                if self.on_conflict is not None:
+                    self.on_conflict(item[0])
+            for future in waiters:
+                future.set_result(written)
+
+    def _loop(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+def open_store(url: str) -> Optional[SessionStore]:
+    """Хранилище по строке настройки: '' — нет, 'memory', 'sqlite:<путь>'"""
+    if not url:
+        return None
+    if url == "memory":
+        return MemorySessionStore()
+    if url.startswith("sqlite:"):
+        path = url[len("sqlite:"):]
+        if path.startswith("//"):
+            path = path[2:]
+        return SQLiteSessionStore(path or "sessions.db")
+    raise ValueError(f"Unknown session store: {url}")
@@ -1,9 +1,12 @@
 """
 Предустановленные задачи для эмулятора
 """
+import logging
 from typing import List, Dict, Any
 from .processor import StackProcessor
 
+logger = logging.getLogger(__name__)
+
 class TaskManager:
     """Менеджер задач для эмулятора"""
     
@@ -36,128 +39,43 @@ class TaskManager:
     def _get_sum_array_program(self) -> str:
         """Программа для суммы элементов массива"""
         return """
-; Инициализация размера массива
-PUSH 7
-
-; Элементы массива (в обратном порядке для последовательного доступа)
-PUSH 70
-PUSH 60  
-PUSH 50
-PUSH 40
-PUSH 30
-PUSH 20
-PUSH 10
-
-; Стек: [10, 20, 30, 40, 50, 60, 70, 7]
-PUSH 0           ; Аккумулятор = 0
+; Сумма элементов массива: размер по адресу 0x100, элементы с 0x101.
+; Счетчик цикла — регистр LC, а не элемент стека
+PUSH 0           ; аккумулятор
+PUSH 0x100
+LOAD
+PUSH 0
+ADD              ; флаги по размеру массива
+JZ LOOP_END      ; пустой массив: LOOP с LC = 0 не завершился бы
+SETLC            ; LC = размер массива
+PUSH 0x101       ; адрес текущего элемента
 
+; Стек: [сумма, адрес]
 LOOP_START:
-  ; Проверка условия выхода
-  DUP            ; Дублируем счетчик
-  JZ LOOP_END    ; Если счетчик == 0, выходим
-  
-  ; Достаем элемент массива с помощью ROT
-  ; Стек: [10, 20, 30, 40, 50, 60, 70, 7, 0, 7]
-  ; Нужно взять элемент с вершины (10) и сложить с аккумулятором (0)
-  ROT            ; [..., 0, 7, 7] → [..., 7, 0, 7]
-  ROT            ; [..., 7, 0, 7] → [..., 0, 7, 7]
-  ADD            ; Суммируем элемент с аккумулятором
-  ROT            ; [..., 7, сумма] → [..., сумма, 7]
-  DEC            ; Уменьшаем счетчик
-  
-  JMP LOOP_START
+  DUP
+  LOAD           ; [сумма, адрес, элемент]
+  ROT            ; [адрес, элемент, сумма]
+  ADD            ; [адрес, сумма]
+  SWAP           ; [сумма, адрес]
+  INC            ; следующий элемент
+  LOOP LOOP_START  ; LC -= 1, переход пока LC != 0
 
 LOOP_END:
-  POP            ; Убираем счетчик (0)
+  POP            ; убираем адрес (или размер пустого массива)
   HALT
         """.strip()
     
     def _get_convolution_program(self) -> str:
         """Программа для свертки двух массивов"""
         return """
-; Свертка двух массивов (скалярное произведение) для 10 элементов
-; acc = 0
-PUSH 0
-
-; i = 0
-PUSH 0x101
-LOAD
-PUSH 0x111
-LOAD
-MUL
-ADD
-
-; i = 1
-PUSH 0x102
-LOAD
-PUSH 0x112
-LOAD
-MUL
-ADD
-
-; i = 2
-PUSH 0x103
-LOAD
-PUSH 0x113
-LOAD
-MUL
-ADD
-
-; i = 3
-PUSH 0x104
-LOAD
-PUSH 0x114
-LOAD
-MUL
-ADD
-
-; i = 4
-PUSH 0x105
-LOAD
-PUSH 0x115
-LOAD
-MUL
-ADD
-
-; i = 5
-PUSH 0x106
-LOAD
-PUSH 0x116
-LOAD
-MUL
-ADD
-
-; i = 6
-PUSH 0x107
-LOAD
-PUSH 0x117
-LOAD
-MUL
-ADD
-
-; i = 7
-PUSH 0x108
-LOAD
-PUSH 0x118
-LOAD
-MUL
-ADD
-
-; i = 8
-PUSH 0x109
-LOAD
-PUSH 0x119
-LOAD
-MUL
-ADD
-
-; i = 9
-PUSH 0x10A
-LOAD
-PUSH 0x11A
-LOAD
-MUL
-ADD
+; Свертка двух массивов (скалярное произведение)
+; A: длина по адресу 0x100, элементы с 0x101; B: элементы с 0x111.
+; Длина берется из памяти, поэтому программа не зависит от размера массивов
+PUSH 0x101       ; начало A
+PUSH 0x111       ; начало B
+PUSH 0x100
+LOAD             ; длина A
+VDOT             ; acc = A[0]*B[0] + ... + A[n-1]*B[n-1]
 
 ; store result
 PUSH 0x120
@@ -181,16 +99,18 @@ HALT
     
     def setup_task_data(self, processor: StackProcessor, task_id: int):
         """Настроить данные для задачи в процессоре"""
-        print(f"=== setup_task_data called for task {task_id} ===")
         task = self.get_task(task_id)
         if not task:
             raise ValueError(f"Task {task_id} not found")
         
         test_data = task["test_data"]
-        print(f"Setting up task {task_id} data: {test_data}")
+        logger.debug("Setting up task %d data: %s", task_id, test_data)
         
         # Особая раскладка памяти для задач
-        if task_id == 2:
+        if task_id == 1:
+            # Размер и элементы массива: 0x100, 0x101..
+            processor.load_memory(0x100, test_data)
+        elif task_id == 2:
             # Формат test_data: [size_a, a1..aN, size_b, b1..bM]
             if not test_data or len(test_data) < 3:
                 raise ValueError("Invalid test data for task 2")
@@ -199,27 +119,17 @@ HALT
             size_b = test_data[1 + size_a]
             b_vals = test_data[2 + size_a:2 + size_a + size_b]
 
-            print(f"Task 2 data: size_a={size_a}, a_vals={a_vals}, size_b={size_b}, b_vals={b_vals}")
-
             # Размер и элементы массива A: 0x100, 0x101.. 
-            processor.store_to_memory(0x100, size_a)
-            print(f"Stored size_a={size_a} at address 0x100")
-            for i, v in enumerate(a_vals):
-                processor.store_to_memory(0x101 + i, v)
-                print(f"Stored A[{i}] = {v} at address 0x{0x101 + i:04X}")
+            processor.load_memory(0x100, [size_a] + a_vals)
 
             # Размер и элементы массива B: 0x110, 0x111..
-            processor.store_to_memory(0x110, size_b)
-            print(f"Stored size_b={size_b} at address 0x110")
-            for i, v in enumerate(b_vals):
-                processor.store_to_memory(0x111 + i, v)
-                print(f"Stored B[{i}] = {v} at address 0x{0x111 + i:04X}")
-            
-            print(f"Memory after setup: {processor.memory.ram[0x100:0x120]}")
+            processor.load_memory(0x110, [size_b] + b_vals)
+
+            # Ячейка результата: значение от предыдущего запуска не засчитывается
+            processor.load_memory(0x120, [0])
         else:
             # По умолчанию — последовательная загрузка начиная с 0x1000
-            for i, value in enumerate(test_data):
-                processor.store_to_memory(0x1000 + i, value)
+            processor.load_memory(0x1000, test_data)
     
     def verify_task_result(self, processor: StackProcessor, task_id: int) -> Dict[str, Any]:
         """Проверить результат выполнения задачи"""
@@ -0,0 +1,223 @@
+"""
+Статическая проверка глубины стека (абстрактная интерпретация по графу переходов)
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .ir import Program
+
+# Максимальная глубина стека процессора
+STACK_LIMIT = 256
+
+# Стековый эффект инструкций: (требуется элементов, изменение глубины)
+STACK_EFFECTS: Dict[str, Tuple[int, int]] = {
+    'PUSH': (0, 1),
+    'POP': (1, -1),
+    'DUP': (1, 1),
+    'SWAP': (2, 0),
+    'ROT': (3, 0),
+    'ADD': (2, -1),
+    'SUB': (2, -1),
+    'MUL': (2, -1),
+    'DIV': (2, -1),
+    'INC': (1, 0),
+    'DEC': (1, 0),
+    'LOAD': (1, 0),
+    'STORE': (2, -2),
+    'MEMCPY': (3, -3),
+    'MEMFILL': (3, -3),
+    'VSUM': (2, -1),
+    'VDOT': (3, -2),
+    'JMP': (0, 0),
+    'JZ': (0, 0),
+    'JNZ': (0, 0),
+    'LOOP': (0, 0),
+    'SETLC': (1, -1),
+    'GETLC': (0, 1),
+    'HALT': (0, 0),
+}
+
+# Сколько раз интервал может расти до расширения верхней границы до бесконечности
+_WIDENING_THRESHOLD = 3
+
+
+@dataclass
+class StackDepthReport:
+    """Результат проверки: интервалы глубины по адресам, ошибки и предупреждения"""
+    depths: List[Optional[Tuple[int, Optional[int]]]] = field(default_factory=list)  # None — недостижимо; верхняя граница None — не ограничена
+    errors: List[Tuple[int, str]] = field(default_factory=list)     # (строка, сообщение) — гарантированная ошибка
+    warnings: List[Tuple[int, str]] = field(default_factory=list)   # (строка, сообщение) — возможная ошибка
+    max_depth: Optional[int] = 0
+
+    @property
+    def safe(self) -> bool:
+        """Программа доказуемо не выходит за границы стека"""
+        return not self.errors and not self.warnings and self.max_depth is not None
+
+
+def _successors(program: Program, pc: int) -> List[int]:
+    instruction = program.instructions[pc]
+    mnemonic = instruction.mnemonic
+    if mnemonic == 'HALT':
+        return []
+    if mnemonic == 'JMP':
+        return [instruction.operand]
+    if mnemonic in ('JZ', 'JNZ', 'LOOP'):
+        return [instruction.operand, pc + 1]
+    return [pc + 1]
+
+
+def verify_stack_depth(program: Program, initial_depth: int = 0, limit: int = STACK_LIMIT) -> StackDepthReport:
+    """
+    Вычислить интервал [min, max] глубины стека перед каждой инструкцией
+    (при начальной глубине initial_depth). Нижняя граница верна и для большего
+    начального стека, поэтому гарантированное превышение лимита — ошибка.
+    Нехватка элементов — только предупреждение: программа может выполняться
+    на стеке, оставшемся от предыдущего запуска (load_program его сохраняет).
+    """
+    count = len(program.instructions)
+    report = StackDepthReport(depths=[None] * count, max_depth=initial_depth)
+    if not count:
+        return report
+
+    depths = report.depths
+    visits = [0] * count
+    depths[0] = (initial_depth, initial_depth)
+    worklist = [0]
+    bad_targets = set()
+
+    while worklist:
+        pc = worklist.pop()
+        low, high = depths[pc]
+        instruction = program.instructions[pc]
+        need, delta = STACK_EFFECTS.get(instruction.mnemonic, (0, 0))
+
+        if low < need:
+            if high is not None and high < need:
+                # Ни на одном пути элементов не хватает — дальше выполнение не идет
+                continue
+            low = need
+        new_low = low + delta
+        new_high = None if high is None else high + delta
+        if new_low > limit:
+            continue
+
+        for target in _successors(program, pc):
+            if target is None or target < 0:
+                bad_targets.add(pc)
+                continue
+            if target >= count:
+                # Выход за конец программы — остановка
+                continue
+            current = depths[target]
+            if current is None:
+                depths[target] = (new_low, new_high)
+                worklist.append(target)
+                continue
+            joined_low = min(current[0], new_low)
+            joined_high = None if current[1] is None or new_high is None else max(current[1], new_high)
+            if (joined_low, joined_high) == current:
+                continue
+            visits[target] += 1
+            if visits[target] > _WIDENING_THRESHOLD and joined_high is not None and joined_high != current[1]:
+                joined_high = None
+            depths[target] = (joined_low, joined_high)
+            worklist.append(target)
+
+    max_depth: Optional[int] = initial_depth
+    for pc, interval in enumerate(depths):
+        if interval is None or not _diagnose(program, pc, interval, pc in bad_targets, limit, report):
+            continue
+        high = interval[1]
+        if high is None:
+            max_depth = None
+        elif max_depth is not None:
+            _, delta = STACK_EFFECTS.get(program.instructions[pc].mnemonic, (0, 0))
+            max_depth = max(max_depth, high + max(delta, 0))
+
+    report.max_depth = max_depth
+    return report
+
+
+def _diagnose(program: Program, pc: int, interval: Tuple[int, Optional[int]], bad_target: bool,
+              limit: int, report: StackDepthReport) -> bool:
+    """
+    Ошибки и предупреждения для адреса pc с интервалом глубины interval.
+    False — выполнение на pc заведомо прекращается.
+    """
+    instruction = program.instructions[pc]
+    low, high = interval
+    mnemonic = instruction.mnemonic
+    need, delta = STACK_EFFECTS.get(mnemonic, (0, 0))
+
+    if high is not None and high < need:
+        report.warnings.append((program.line_of(pc), f"{mnemonic}: нехватка элементов стека, если он пуст в начале "
+                                                       f"(требуется {need}, добавлено не более {high})"))
+        return False
+    if low < need:
+        report.warnings.append((program.line_of(pc), f"{mnemonic}: возможна нехватка элементов стека (требуется {need}, минимум {low})"))
+    if delta > 0:
+        if max(low, need) + delta > limit:
+            report.errors.append((program.line_of(pc), f"{mnemonic}: переполнение стека (глубина {max(low, need) + delta} > {limit})"))
+            return False
+        if high is None or high + delta > limit:
+            report.warnings.append((program.line_of(pc), f"{mnemonic}: возможно переполнение стека"))
+    if bad_target:
+        report.warnings.append((program.line_of(pc), f"{mnemonic}: некорректный адрес перехода {instruction.operand}"))
+    return True
+
+
+def reverify_edit(program: Program, previous: Program, limit: int = STACK_LIMIT) -> Optional[StackDepthReport]:
+    """
+    Проверка программы, полученной правкой проверенной программы previous
+    (program.edit), без обхода графа переходов. Если число команд не
+    изменилось, а замененные команды имеют тот же стековый эффект и те же
+    переходы (правка операнда или комментария, ADD -> SUB), система
+    уравнений та же и интервалы глубины совпадают с previous: заново
+    строятся только сообщения для замененных адресов.
+    None — правка меняет глубину стека или граф переходов, нужна полная проверка.
+    """
+    edit = program.edit
+    if edit is None or previous.stack_depths is None or edit.base_code is not previous.code \
+            or edit.relinked or edit.count != edit.end - edit.start:
+        return None
+    for pc in range(edit.start, edit.end):
+        old, new = previous.instructions[pc], program.instructions[pc]
+        if STACK_EFFECTS.get(old.mnemonic, (0, 0)) != STACK_EFFECTS.get(new.mnemonic, (0, 0)) \
+                or _successors(previous, pc) != _successors(program, pc):
+            return None
+
+    report = StackDepthReport(depths=previous.stack_depths, max_depth=previous.max_stack_depth)
+    # Сообщения вне правки переносятся из previous: строки до нее не сдвинулись,
+    # строки после нее сдвинулись вместе с первой командой хвоста
+    count = len(previous.instructions)
+    edit_line = previous.line_of(edit.start) if edit.start < count else None
+    tail_line = previous.line_of(edit.end) if edit.end < count else None
+    line_delta = program.line_of(edit.end) - tail_line if tail_line is not None else 0
+    report.warnings = [(line, message) for line, message in previous.warnings
+                       if edit_line is None or line < edit_line]
+    for pc in range(edit.start, edit.end):
+        interval = report.depths[pc]
+        if interval is not None:
+            bad_target = any(target is None or target < 0 for target in _successors(program, pc))
+            _diagnose(program, pc, interval, bad_target, limit, report)
+    if tail_line is not None:
+        report.warnings.extend((line + line_delta, message) for line, message in previous.warnings
+                               if line >= tail_line)
+    return report
+
+
+def ensure_verified(program: Program) -> Program:
+    """
+    Выполнить проверку, отложенную после правки (Program.verification_pending).
+    Гарантированная ошибка стека здесь не прерывает работу: программа
+    остается непроверенной, и ошибка возникнет при выполнении.
+    """
+    if program.verification_pending:
+        report = verify_stack_depth(program)
+        program.max_stack_depth = report.max_depth
+        program.warnings = report.warnings
+        program.stack_depths = None if report.errors else report.depths
+        program.verified = report.safe
+        program.verification_pending = False
+    return program
@@ -0,0 +1,230 @@
+"""
+Двоичный колоночный формат ответов API (application/x-emulator-columnar)
+
+Тяжелые поля состояния передаются типизированными массивами вместо JSON:
+история — параллельными колонками (адреса, номера команд в таблице строк,
+байты флагов, стек как смещения и значения), память и другие длинные
+списки целых — сырыми байтами. Остальная часть ответа остается JSON.
+
+Тело ответа (все числа little-endian):
+
+    "EMCF" | версия u8 | 3 байта 0 | длина заголовка u32 | заголовок (JSON, UTF-8)
+    | нули до границы 8 байт | данные колонок
+
+Заголовок: {"data": ответ, "columns": [{"dtype", "offset", "count"}, ...]}.
+В data длинный список целых заменен ссылкой {"$column": номер}, история —
+объектом {"$history": {...}} с колонками pc, command, flags, stack_prefix,
+stack_offsets, stack_values (и step, если он есть в записях). Команда записи i —
+commands[command[i] - command_base]: для истории процессора command — адреса
+выполненных команд, а commands — строки машинного кода от command_base. Стек записи i —
+первые stack_prefix[i] элементов стека записи i-1 и продолжение
+stack_values[stack_offsets[i]:stack_offsets[i + 1]]: соседние шаги меняют
+только вершину, поэтому передаются лишь изменившиеся элементы. Смещение
+колонки отсчитывается от начала данных и кратно 8, поэтому клиент создает
+типизированный массив над буфером ответа без копирования. Значения, не помещающиеся в int64,
+остаются JSON-списком на месте ссылки.
+
+История процессора хранится такими же колонками (processor.History): они
+заполняются при выполнении, и кодирование окна истории копирует их срезы,
+обходя в Python только стеки записей.
+"""
+import json
+import struct
+import sys
+from array import array
+from itertools import accumulate, chain, repeat
+from operator import getitem
+from typing import Any, Dict, List, Optional, Sequence
+
+from .dataload import DTYPES
+from .processor import FLAG_NAMES, HistoryRecords
+
+COLUMNAR_MEDIA_TYPE = "application/x-emulator-columnar"
+MAGIC = b"EMCF"
+VERSION = 2
+ALIGNMENT = 8
+
+# Списки целых короче этого остаются в JSON-заголовке
+COLUMN_MIN_LENGTH = 16
+
+_DTYPE_NAMES = {code: name for name, code in DTYPES.items()}
+_RANGES = {code: (-(1 << (8 * struct.calcsize(code) - 1)), (1 << (8 * struct.calcsize(code) - 1)) - 1)
+           for code in "bhiq"}
+_RANGES.update({code: (0, (1 << (8 * struct.calcsize(code))) - 1) for code in "BHI"})
+
+# Типы колонок по возрастанию размера: выбирается самый узкий подходящий
+SIGNED = ("b", "h", "i", "q")
+UNSIGNED = ("B", "H", "I", "q")
+
+HISTORY_KEYS = ("command", "stack", "programCounter", "flags")
+_FLAG_MASKS = tuple(FLAG_NAMES)
+_FLAG_LIMIT = (1 << len(FLAG_NAMES)) - 1
+_HEADER = struct.Struct("<4sB3xI")
+
+
+def _shared_prefixes(stacks) -> List[int]:
+    """Длина общего с предыдущим стеком начала каждого стека"""
+    prefixes = []
+    previous: Sequence[int] = ()
+    for stack in stacks:
+        shared = min(len(previous), len(stack))
+        # Обычно меняется только вершина: ищем изменение сверху на глубину
+        # нескольких элементов и один раз проверяем оставшееся начало
+        bottom = max(shared - 3, 0)
+        while shared > bottom and stack[shared - 1] != previous[shared - 1]:
+            shared -= 1
+        if shared and stack[:shared] != previous[:shared]:
+            shared = next(index for index, (a, b) in enumerate(zip(stack, previous)) if a != b)
+        prefixes.append(shared)
+        previous = stack
+    return prefixes
+
+
+class _Encoder:
+    """Накопление колонок одного ответа"""
+
+    def __init__(self):
+        self.columns: List[Dict[str, Any]] = []
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    def column(self, values: Sequence[int], codes: Sequence[str] = SIGNED, bounds=None) -> Any:
+        """
+        Ссылка на колонку из самого узкого подходящего типа (или сами значения);
+        bounds — известные заранее границы значений, чтобы не обходить их
+        """
+        if values:
+            low, high = bounds or (min(values), max(values))
+            code = next((code for code in codes if _RANGES[code][0] <= low and high <= _RANGES[code][1]), None)
+            if code is None:
+                return list(values)
+        else:
+            code = codes[0]
+        if isinstance(values, array) and values.typecode == code and sys.byteorder == "little":
+            data = values
+        else:
+            data = array(code, values)
+            if sys.byteorder == "big":
+                data.byteswap()
+        raw = data.tobytes()
+        padding = -self.size % ALIGNMENT
+        if padding:
+            self.chunks.append(bytes(padding))
+            self.size += padding
+        self.columns.append({"dtype": _DTYPE_NAMES[code], "offset": self.size, "count": len(data)})
+        self.chunks.append(raw)
+        self.size += len(raw)
+        return {"$column": len(self.columns) - 1}
+
+    def history(self, commands: Sequence[str], base: int, ids: Sequence[int], stacks: Sequence[Sequence[int]],
+                pcs: Sequence[int], flags: Sequence[int], prefixes: Sequence[int], steps=None,
+                code_size: Optional[int] = None) -> Dict[str, Any]:
+        """code_size — длина машинного кода, ограничивающая номера команд (None — границы вычисляются)"""
+        tails = list(map(getitem, stacks, map(slice, prefixes, repeat(None))))
+        columns = {
+            "count": len(stacks),
+            "commands": list(commands),
+            "command_base": base,
+            "flag_names": [name for name, _ in FLAG_NAMES],
+            "pc": self.column(pcs),
+            "command": self.column(ids, UNSIGNED, None if code_size is None else (0, code_size)),
+            "flags": self.column(flags, UNSIGNED, (0, _FLAG_LIMIT)),
+            "stack_prefix": self.column(prefixes, UNSIGNED),
+            "stack_offsets": self.column(list(accumulate(map(len, tails), initial=0))),
+            "stack_values": self.column(list(chain.from_iterable(tails))),
+        }
+        if steps is not None:
+            columns["step"] = self.column(steps)
+        return {"$history": columns}
+
+    def history_records(self, records: HistoryRecords) -> Dict[str, Any]:
+        """Колонки из окна истории процессора: срезы колонок, заполненных при выполнении"""
+        executed = records.executed
+        base = min(executed, default=0)
+        return self.history(records.code[base:max(executed, default=-1) + 1], base, executed,
+                            records.stacks, records.pc, records.flags, records.prefix, code_size=len(records.code))
+
+    def history_entries(self, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Колонки из записей истории в виде словарей (например, прореженных every_k)"""
+        table: Dict[Any, int] = {}
+        ids = [table.setdefault(entry["command"], len(table)) for entry in entries]
+        stacks = [entry["stack"] for entry in entries]
+        flags = bytes(sum(mask for name, mask in _FLAG_MASKS if entry["flags"][name]) for entry in entries)
+        steps = [entry["step"] for entry in entries] if "step" in entries[0] else None
+        return self.history(list(table), 0, ids, stacks, [entry["programCounter"] for entry in entries],
+                            flags, _shared_prefixes(stacks), steps)
+
+    def convert(self, value: Any) -> Any:
+        if isinstance(value, HistoryRecords):
+            return self.history_records(value)
+        if isinstance(value, dict):
+            return {key: self.convert(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple, array, memoryview)):
+            if len(value) >= COLUMN_MIN_LENGTH and all(type(item) is int for item in value):
+                return self.column(value)
+            if value and isinstance(value[0], dict) and all(key in value[0] for key in HISTORY_KEYS):
+                return self.history_entries(value)
+            return [self.convert(item) for item in value]
+        return value
+
+
+def encode(content: Any) -> bytes:
+    """Ответ в колоночном формате"""
+    encoder = _Encoder()
+    data = encoder.convert(content)
+    header = json.dumps({"data": data, "columns": encoder.columns},
+                        ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    prefix = _HEADER.pack(MAGIC, VERSION, len(header)) + header
+    return b"".join([prefix, bytes(-len(prefix) % ALIGNMENT), *encoder.chunks])
+
+
+def decode(body: bytes) -> Any:
+    """
+    Разбор колоночного ответа в обычные структуры: колонки — списки,
+    история — список словарей, как в JSON-ответе
+    """
+    magic, version, length = _HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Не колоночный ответ эмулятора")
+    end = _HEADER.size + length
+    header = json.loads(body[_HEADER.size:end])
+    base = end + (-end % ALIGNMENT)
+    columns = []
+    for column in header["columns"]:
+        data = array(DTYPES[column["dtype"]])
+        start = base + column["offset"]
+        data.frombytes(body[start:start + column["count"] * data.itemsize])
+        if sys.byteorder == "big":
+            data.byteswap()
+        columns.append(data.tolist())
+
+    def resolve(value: Any) -> Any:
+        if isinstance(value, dict):
+            if "$column" in value:
+                return columns[value["$column"]]
+            if "$history" in value:
+                return _history_entries({key: resolve(item) for key, item in value["$history"].items()})
+            return {key: resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [resolve(item) for item in value]
+        return value
+
+    return resolve(header["data"])
+
+
+def _history_entries(columns: Dict[str, Any]) -> List[Dict[str, Any]]:
+    names, commands, base, offsets, values = (columns["flag_names"], columns["commands"], columns["command_base"],
+                                              columns["stack_offsets"], columns["stack_values"])
+    entries, stack = [], []
+    for index, (command, pc, bits, shared) in enumerate(
+            zip(columns["command"], columns["pc"], columns["flags"], columns["stack_prefix"])):
+        stack = stack[:shared] + values[offsets[index]:offsets[index + 1]]
+        entries.append({
+            "command": commands[command - base],
+            "stack": stack,
+            "programCounter": pc,
+            "flags": {name: bool(bits >> position & 1) for position, name in enumerate(names)},
+        })
+    if "step" in columns:
+        entries = [{"step": step, **entry} for step, entry in zip(columns["step"], entries)]
+    return entries
@@ -476,10 +476,26 @@ HALT`
                     <code className="font-mono text-blue-600">LOAD</code>
                     <span className="text-gray-600">загрузить из памяти</span>
                   </div>
-                  <div className="flex justify-between items-center py-1">
+                  <div className="flex justify-between items-center py-1 border-b border-gray-100">
                     <code className="font-mono text-blue-600">STORE</code>
                     <span className="text-gray-600">сохранить в память</span>
                   </div>
+                  <div className="flex justify-between items-center py-1 border-b border-gray-100">
+                    <code className="font-mono text-blue-600">MEMCPY</code>
+                    <span className="text-gray-600">копировать блок (dst, src, n)</span>
+                  </div>
+                  <div className="flex justify-between items-center py-1 border-b border-gray-100">
+                    <code className="font-mono text-blue-600">MEMFILL</code>
+                    <span className="text-gray-600">заполнить блок (dst, value, n)</span>
+                  </div>
+                  <div className="flex justify-between items-center py-1 border-b border-gray-100">
+                    <code className="font-mono text-blue-600">VSUM</code>
+                    <span className="text-gray-600">сумма блока (addr, n)</span>
+                  </div>
+                  <div className="flex justify-between items-center py-1">
+                    <code className="font-mono text-blue-600">VDOT</code>
+                    <span className="text-gray-600">скалярное произведение (a, b, n)</span>
+                  </div>
                 </div>
               </div>
 
@@ -502,6 +518,14 @@ HALT`
                     <code className="font-mono text-blue-600">JNZ &lt;label&gt;</code>
                     <span className="text-gray-600">переход если не ноль</span>
                   </div>
+                  <div className="flex justify-between items-center py-1 border-b border-gray-100">
+                    <code className="font-mono text-blue-600">LOOP &lt;label&gt;</code>
+                    <span className="text-gray-600">счетчик − 1, переход если не ноль</span>
+                  </div>
+                  <div className="flex justify-between items-center py-1 border-b border-gray-100">
+                    <code className="font-mono text-blue-600">SETLC / GETLC</code>
+                    <span className="text-gray-600">записать / прочитать счетчик цикла</span>
+                  </div>
                   <div className="flex justify-between items-center py-1">
                     <code className="font-mono text-blue-600">HALT</code>
                     <span className="text-gray-600">остановка выполнения</span>
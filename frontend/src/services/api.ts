@@ -1,4 +1,5 @@
 import type { EmulatorState, ExecuteRequest, TaskInfo } from '../types/emulator';
+import { COLUMNAR_MEDIA_TYPE, decodeColumnar } from './columnar';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -10,6 +11,8 @@ class ApiService {
       const response = await fetch(url, {
         headers: {
           'Content-Type': 'application/json',
+          // История и память состояния приходят двоичными колонками
+          'Accept': `${COLUMNAR_MEDIA_TYPE}, application/json;q=0.9`,
           ...options.headers,
         },
         ...options,
@@ -21,6 +24,9 @@ class ApiService {
         throw new Error(`HTTP error! status: ${response.status}, message: ${errorText}`);
       }
 
+      if (response.headers.get('Content-Type')?.startsWith(COLUMNAR_MEDIA_TYPE)) {
+        return decodeColumnar(await response.arrayBuffer());
+      }
       return response.json();
     } catch (error) {
       if (error instanceof TypeError && error.message.includes('fetch')) {
@@ -0,0 +1,107 @@
+// Разбор двоичного колоночного формата ответов (application/x-emulator-columnar).
+// Описание формата — backend/app/wire.py.
+
+export const COLUMNAR_MEDIA_TYPE = 'application/x-emulator-columnar';
+
+const MAGIC = 'EMCF';
+const VERSION = 2;
+const HEADER_SIZE = 12;
+const ALIGNMENT = 8;
+
+type TypedArray = Int8Array | Uint8Array | Int16Array | Uint16Array | Int32Array | Uint32Array | BigInt64Array;
+
+interface ColumnInfo {
+  dtype: string;
+  offset: number;
+  count: number;
+}
+
+const LITTLE_ENDIAN = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+const ARRAY_TYPES: Record<string, { new (buffer: ArrayBuffer, offset: number, length: number): TypedArray; BYTES_PER_ELEMENT: number }> = {
+  int8: Int8Array,
+  uint8: Uint8Array,
+  int16: Int16Array,
+  uint16: Uint16Array,
+  int32: Int32Array,
+  uint32: Uint32Array,
+  int64: BigInt64Array,
+};
+
+const GETTERS: Record<string, (view: DataView, offset: number) => number> = {
+  int8: (view, offset) => view.getInt8(offset),
+  uint8: (view, offset) => view.getUint8(offset),
+  int16: (view, offset) => view.getInt16(offset, true),
+  uint16: (view, offset) => view.getUint16(offset, true),
+  int32: (view, offset) => view.getInt32(offset, true),
+  uint32: (view, offset) => view.getUint32(offset, true),
+  int64: (view, offset) => Number(view.getBigInt64(offset, true)),
+};
+
+// Колонка в виде обычного массива чисел. На little-endian машинах данные
+// читаются типизированным массивом прямо из буфера ответа
+function readColumn(buffer: ArrayBuffer, base: number, info: ColumnInfo): number[] {
+  const start = base + info.offset;
+  if (LITTLE_ENDIAN) {
+    const view = new ARRAY_TYPES[info.dtype](buffer, start, info.count);
+    return Array.from(view as ArrayLike<number | bigint>, Number);
+  }
+  const view = new DataView(buffer, start);
+  const get = GETTERS[info.dtype];
+  const size = ARRAY_TYPES[info.dtype].BYTES_PER_ELEMENT;
+  return Array.from({ length: info.count }, (_, index) => get(view, index * size));
+}
+
+// Записи истории из колонок: команда — строка commands с номером command
+// минус command_base, стек — начало стека предыдущей записи длиной
+// stack_prefix и продолжение из stack_values
+function historyEntries(columns: any): any[] {
+  const { commands, command_base: base, flag_names: names, pc, command, flags, stack_prefix: prefix, stack_offsets: offsets, stack_values: values } = columns;
+  const entries = new Array(columns.count);
+  let stack: number[] = [];
+  for (let index = 0; index < columns.count; index++) {
+    stack = stack.slice(0, prefix[index]).concat(values.slice(offsets[index], offsets[index + 1]));
+    const entryFlags: Record<string, boolean> = {};
+    names.forEach((name: string, position: number) => {
+      entryFlags[name] = ((flags[index] >> position) & 1) === 1;
+    });
+    const entry: any = { command: commands[command[index] - base], stack, programCounter: pc[index], flags: entryFlags };
+    entries[index] = columns.step ? { step: columns.step[index], ...entry } : entry;
+  }
+  return entries;
+}
+
+// Разобрать ответ в те же структуры, что и JSON-ответ
+export function decodeColumnar(buffer: ArrayBuffer): any {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== MAGIC || view.getUint8(4) !== VERSION) {
+    throw new Error('Не колоночный ответ эмулятора');
+  }
+  const length = view.getUint32(8, true);
+  const end = HEADER_SIZE + length;
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, HEADER_SIZE, length)));
+  const base = end + ((ALIGNMENT - (end % ALIGNMENT)) % ALIGNMENT);
+  const columns: number[][] = header.columns.map((info: ColumnInfo) => readColumn(buffer, base, info));
+
+  const resolve = (value: any): any => {
+    if (Array.isArray(value)) {
+      return value.map(resolve);
+    }
+    if (value !== null && typeof value === 'object') {
+      if ('$column' in value) {
+        return columns[value.$column];
+      }
+      if ('$history' in value) {
+        return historyEntries(resolve(value.$history));
+      }
+      const result: Record<string, any> = {};
+      for (const key of Object.keys(value)) {
+        result[key] = resolve(value[key]);
+      }
+      return result;
+    }
+    return value;
+  };
+  return resolve(header.data);
+}